@@ -0,0 +1,245 @@
+"""Benchmarks the construction, reset and step costs of every task of the suite.
+
+Each task is measured with its default context and with a non-default one,
+derived from its `ContextSchema`. Results are written as JSON, and can be
+compared against a stored baseline:
+
+```commandline
+python benchmarks/environments.py --output baseline.json
+python benchmarks/environments.py --output results.json --baseline baseline.json
+python benchmarks/environments.py --results results.json --baseline baseline.json
+python benchmarks/environments.py --tasks cheetah/run walker/run --steps 500
+```
+"""
+
+import argparse
+import contextlib
+import datetime
+import importlib.metadata
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import mujoco
+import numpy as np
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import models, store
+
+# Metrics for which higher is better, all others are durations.
+_HIGHER_IS_BETTER = ('steps_per_second',)
+
+
+@contextlib.contextmanager
+def _timed(owner, name, timings, key):
+    """Accumulates the time spent in `owner.name` into `timings[key]`."""
+    function = getattr(owner, name)
+
+    def wrapped(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[key] += time.perf_counter() - start
+
+    setattr(owner, name, wrapped)
+    try:
+        yield
+    finally:
+        setattr(owner, name, function)
+
+
+def custom_task_kwargs(domain_name, task_name):
+    """Returns non-default `reward_kwargs` and `dynamics_kwargs` for a task."""
+    schema = suite.context_schema(domain_name, task_name)
+    context = schema.default()
+    for name, parameter in schema.parameters.items():
+        if name.endswith('.margin'):
+            context[name] = 1.5 * parameter.default if parameter.default else 1.0
+        elif name.startswith('dynamics.'):
+            context[name] = np.clip(1.1 * parameter.default, parameter.low, parameter.high)
+    schema.validate(context)
+    return schema.to_kwargs(context)
+
+
+def measure_construction(domain_name, task_name, task_kwargs, repeats):
+    """Returns the time to build an environment, split into its phases."""
+    from lxml import etree  # Imported here, the wrappers patch the module.
+
+    domain = suite._DOMAINS[domain_name]
+    runs = []
+    for _ in range(repeats):
+        models.MODEL_CACHE.clear()
+        timings = dict.fromkeys(('model_fn', 'lxml_parse', 'spec_parse', 'compile'), 0.0)
+        # Models derived by `ModelLoader.derive` are parsed into and compiled from a `mujoco.MjSpec`.
+        with _timed(domain, 'get_model_and_assets', timings, 'model_fn'), \
+                _timed(etree, 'fromstring', timings, 'lxml_parse'), \
+                _timed(etree, 'XML', timings, 'lxml_parse'), \
+                _timed(mujoco.MjSpec, 'from_string', timings, 'spec_parse'), \
+                _timed(mujoco.MjSpec, 'compile', timings, 'compile'), \
+                _timed(models.wrapper.MjModel, 'from_xml_string', timings, 'compile'):
+            start = time.perf_counter()
+            suite.load(domain_name, task_name, task_kwargs=task_kwargs)
+            total = time.perf_counter() - start
+
+        start = time.perf_counter()
+        suite.load(domain_name, task_name, task_kwargs=task_kwargs)
+        cached = time.perf_counter() - start
+        runs.append({
+            'construction_s': total,
+            'construction_cached_s': cached,
+            'xml_generation_s': timings['model_fn'] - timings['lxml_parse'],
+            'lxml_parse_s': timings['lxml_parse'] + timings['spec_parse'],
+            'compile_s': timings['compile'],
+        })
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def measure_episode(domain_name, task_name, task_kwargs, num_steps, num_resets):
+    """Returns the reset latency, step rate and time per step of each phase."""
+    env = suite.load(domain_name, task_name, task_kwargs=dict(task_kwargs, random=0))
+    spec = env.action_spec()
+    actions = np.random.RandomState(0).uniform(spec.minimum, spec.maximum, (num_steps,) + spec.shape)
+
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(num_resets):
+        env.reset()
+    reset = (time.perf_counter() - start) / num_resets
+
+    env.reset()
+    start = time.perf_counter()
+    for action in actions:
+        if env.step(action).last():
+            env.reset()
+    steps_per_second = num_steps / (time.perf_counter() - start)
+
+    # The phases of `control.Environment.step`, timed one by one.
+    physics, task = env.physics, env.task
+    n_sub_steps = env._n_sub_steps
+    env.reset()
+    clock = time.perf_counter
+    phases = np.zeros(3)
+    for action in actions:
+        t0 = clock()
+        task.before_step(action, physics)
+        physics.step(n_sub_steps)
+        task.after_step(physics)
+        t1 = clock()
+        task.get_observation(physics)
+        t2 = clock()
+        task.get_reward(physics)
+        t3 = clock()
+        phases += (t1 - t0, t2 - t1, t3 - t2)
+    physics_time, observation_time, reward_time = phases / num_steps
+
+    return {
+        'reset_s': reset,
+        'steps_per_second': steps_per_second,
+        'physics_step_s': physics_time,
+        'observation_step_s': observation_time,
+        'reward_step_s': reward_time,
+    }
+
+
+def run(tasks, num_steps, num_resets, repeats):
+    """Returns the results of all benchmarks, keyed by `domain/task`."""
+    results = {}
+    for domain_name, task_name in tasks:
+        name = '{}/{}'.format(domain_name, task_name)
+        results[name] = {}
+        for context in ('default', 'custom'):
+            task_kwargs = {} if context == 'default' else custom_task_kwargs(domain_name, task_name)
+            result = measure_construction(domain_name, task_name, task_kwargs, repeats)
+            result.update(measure_episode(domain_name, task_name, task_kwargs, num_steps, num_resets))
+            results[name][context] = result
+        print('{:<20} {:>9.0f} steps/s, reset {:.2f} ms, construction {:.1f} ms'.format(
+            name, results[name]['default']['steps_per_second'], results[name]['default']['reset_s'] * 1e3,
+            results[name]['default']['construction_s'] * 1e3), file=sys.stderr)
+    return results
+
+
+def metadata():
+    """Returns the versions and machine the benchmarks ran on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'mujoco': mujoco.__version__,
+        'dm_control': importlib.metadata.version('dm_control'),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints the relative change of every metric and returns the regressions."""
+    regressions = []
+    for name in sorted(set(results) & set(baseline)):
+        for context in sorted(set(results[name]) & set(baseline[name])):
+            for metric, value in sorted(results[name][context].items()):
+                reference = baseline[name][context].get(metric)
+                if not reference:
+                    continue
+                change = value / reference - 1
+                worse = -change if metric in _HIGHER_IS_BETTER else change
+                flag = ' REGRESSION' if worse > threshold else ''
+                print('{:<20} {:<8} {:<22} {:>12.6g} {:>12.6g} {:>+8.1%}{}'.format(
+                    name, context, metric, reference, value, change, flag))
+                if flag:
+                    regressions.append((name, context, metric, change))
+    missing = sorted(set(baseline) - set(results))
+    if missing:
+        print('Not measured: ' + ', '.join(missing))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=str, nargs='*', default=None,
+                        help='Tasks to benchmark as domain/task, defaults to all tasks.')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--resets', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3, help='Repeats of the construction benchmark.')
+    parser.add_argument('--output', type=str, default=None, help='Path to write the results to.')
+    parser.add_argument('--results', type=str, default=None,
+                        help='Path of stored results to compare instead of running the benchmarks.')
+    parser.add_argument('--baseline', type=str, default=None, help='Path of stored results to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change above which a metric is reported as a regression.')
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results) as f:
+            report = json.load(f)
+    else:
+        # Only models compiled in this process are measured.
+        store.set_model_store(None)
+        tasks = suite.ALL_TASKS if args.tasks is None else [tuple(t.split('/')) for t in args.tasks]
+        report = {'metadata': metadata(),
+                  'results': run(tasks, args.steps, args.resets, args.repeats)}
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report['results'], baseline['results'], args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Compares rendering a batch with `physics.render` and with a `BatchRenderer`.
+
+Every mode steps the batch and renders one frame per member and step, such
+that the threaded renderer overlaps the rendering with the stepping. The
+first frames of every mode must be identical to those of `physics.render`,
+which is also checked for a frame of every task of `--check`, e.g. quadruped
+Escape, whose rangefinder rays are hidden by `physics.render`:
+
+```commandline
+MUJOCO_GL=egl python benchmarks/rendering.py
+MUJOCO_GL=osmesa python benchmarks/rendering.py --task walker/walk --envs 16 --size 64 --json
+```
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import rendering
+
+
+def _physics_render(env, size, camera_id):
+    def render():
+        return np.stack([physics.render(size, size, camera_id=camera_id) for physics in env.physics])
+    return render
+
+
+def _check(task, size, camera_id):
+    """Returns whether a `BatchRenderer` frame of a single environment equals `physics.render`."""
+    domain_name, task_name = task.split('/')
+    env = suite.load(domain_name, task_name, task_kwargs={'random': 0})
+    env.reset()
+    with rendering.BatchRenderer(1, size, size, camera_id=camera_id) as renderer:
+        frame = renderer.render([env.physics])[0]
+    return bool(np.array_equal(frame, env.physics.render(size, size, camera_id=camera_id)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--task', type=str, default='cheetah/run', help='Task as domain/task.')
+    parser.add_argument('--envs', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--size', type=int, default=84, help='Height and width of the frames.')
+    parser.add_argument('--camera_id', type=int, default=0)
+    parser.add_argument('--check', type=str, nargs='*', default=['cheetah/run', 'quadruped/escape'],
+                        help='Tasks whose frames are compared with `physics.render`.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+    domain_name, task_name = args.task.split('/')
+
+    checks = {task: _check(task, args.size, args.camera_id) for task in args.check}
+    results = {}
+    reference = None
+    for mode in ('physics.render', 'batch', 'batch-threaded'):
+        render_kwargs = None
+        if mode != 'physics.render':
+            render_kwargs = {'height': args.size, 'width': args.size, 'camera_id': args.camera_id,
+                             'threaded': mode == 'batch-threaded'}
+        env = suite.load_batch(domain_name, task_name, args.envs, task_kwargs={'random': 0},
+                               render_kwargs=render_kwargs)
+        render = _physics_render(env, args.size, args.camera_id) if render_kwargs is None else None
+        spec = env.action_spec()
+        actions = np.random.RandomState(0).uniform(
+            spec.minimum, spec.maximum, (args.steps, args.envs) + spec.shape)
+        env.reset()
+        frames = render() if render else env.frames
+        if reference is None:
+            reference = frames.copy()
+        identical = bool(np.array_equal(frames, reference))
+
+        start = time.perf_counter()
+        for action in actions:
+            env.step(action)
+            if render:
+                render()
+        elapsed = time.perf_counter() - start
+        env.close()
+        results[mode] = {'step_ms': elapsed / args.steps * 1e3, 'identical': identical}
+
+    if args.json:
+        print(json.dumps({'modes': results, 'identical': checks}, indent=2))
+    else:
+        print('{:<16} {:>12} {:>10}'.format('mode', 'step ms', 'identical'))
+        for mode, result in results.items():
+            print('{:<16} {:>12.2f} {:>10}'.format(mode, result['step_ms'], str(result['identical'])))
+        for task, identical in checks.items():
+            print('{:<29} {:>10}'.format(task, str(identical)))
+
+
+if __name__ == '__main__':
+    main()
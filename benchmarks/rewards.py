@@ -0,0 +1,118 @@
+"""Benchmarks the reward phase of every task with and without reward kernels.
+
+The reference run replaces `utils.rewards.tolerance_kernel` by calls to
+`dm_control.utils.rewards.tolerance` before any domain is imported, which is
+how the rewards were evaluated before being compiled. Both runs happen in
+separate processes, roll out the same actions and must return bit-identical
+rewards:
+
+```commandline
+python benchmarks/rewards.py
+python benchmarks/rewards.py --tasks cheetah/run walker/run --steps 2000 --json
+```
+"""
+
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(tasks, num_steps, repeats):
+    """Returns the mean time of `get_reward` and the rewards of every task."""
+    # Imported here such that the reference run can patch the kernels first.
+    from contextual_control_suite import suite
+
+    results = {}
+    for domain_name, task_name in tasks:
+        env = suite.load(domain_name, task_name, task_kwargs={'random': 0})
+        spec = env.action_spec()
+        actions = np.random.RandomState(0).uniform(spec.minimum, spec.maximum, (num_steps,) + spec.shape)
+        physics, task = env.physics, env.task
+        clock = time.perf_counter
+        elapsed = 0.0
+        rewards = []
+        env.reset()
+        for action in actions:
+            if env.step(action).last():
+                env.reset()
+            start = clock()
+            for _ in range(repeats):
+                reward = task.get_reward(physics)
+            elapsed += clock() - start
+            rewards.append(reward)
+        results['{}/{}'.format(domain_name, task_name)] = {
+            'reward_s': elapsed / (num_steps * repeats),
+            'rewards': np.asarray(rewards, dtype=np.float64).tobytes().hex(),
+        }
+    return results
+
+
+def _patch_reference_kernels():
+    from dm_control.utils import rewards
+    from contextual_control_suite.utils import rewards as utils
+
+    utils.tolerance_kernel = lambda **parameters: functools.partial(rewards.tolerance, **parameters)
+
+
+def _run_child(reference, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--steps', str(args.steps),
+               '--repeats', str(args.repeats), '--tasks'] + args.tasks
+    if reference:
+        command.append('--reference')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [_ROOT, os.environ.get('PYTHONPATH')])))
+    output = subprocess.run(command, capture_output=True, text=True, check=True, env=env).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=str, nargs='*', default=None,
+                        help='Tasks to benchmark as domain/task, defaults to all tasks.')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=10, help='Calls of `get_reward` per step.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--reference', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.reference:
+            _patch_reference_kernels()
+        tasks = [tuple(t.split('/')) for t in args.tasks]
+        print(json.dumps(measure(tasks, args.steps, args.repeats)))
+        return
+
+    if args.tasks is None:
+        from contextual_control_suite import suite
+        args.tasks = ['/'.join(task) for task in suite.ALL_TASKS]
+    reference = _run_child(True, args)
+    kernels = _run_child(False, args)
+
+    report = {}
+    for name in args.tasks:
+        report[name] = {
+            'reference_s': reference[name]['reward_s'],
+            'kernel_s': kernels[name]['reward_s'],
+            'speedup': reference[name]['reward_s'] / kernels[name]['reward_s'],
+            'identical': reference[name]['rewards'] == kernels[name]['rewards'],
+        }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print('{:<22} {:>14} {:>14} {:>8} {:>10}'.format('task', 'reference us', 'kernel us', 'speedup', 'identical'))
+        for name, result in report.items():
+            print('{:<22} {:>14.2f} {:>14.2f} {:>7.2f}x {:>10}'.format(
+                name, result['reference_s'] * 1e6, result['kernel_s'] * 1e6, result['speedup'], str(result['identical'])))
+    sys.exit(0 if all(result['identical'] for result in report.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Measures the cold import time and peak memory of the suite.
+
+Every measurement runs in a fresh interpreter, such that no module is cached:
+
+```commandline
+python benchmarks/startup.py --repeats 10
+python benchmarks/startup.py --domain cartpole --task balance
+```
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_CHILD = """
+import resource, time, json
+start = time.perf_counter()
+from contextual_control_suite import suite
+imported = time.perf_counter()
+if {domain!r}:
+    suite.load({domain!r}, {task!r})
+loaded = time.perf_counter()
+print(json.dumps({{
+    'import_s': imported - start,
+    'load_s': loaded - imported,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+
+# The suite is imported from this checkout, whether it is installed or not.
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(domain=None, task=None):
+    """Returns the import time, load time and peak RSS of a fresh interpreter."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [_ROOT, env.get('PYTHONPATH')]))
+    output = subprocess.run([sys.executable, '-c', _CHILD.format(domain=domain, task=task)],
+                            check=True, capture_output=True, text=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--domain', type=str, default=None)
+    parser.add_argument('--task', type=str, default=None)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+    if bool(args.domain) != bool(args.task):
+        parser.error('--domain and --task must be given together.')
+
+    runs = [measure(args.domain, args.task) for _ in range(args.repeats)]
+    summary = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"import: {summary['import_s'] * 1e3:.1f} ms, "
+              f"load: {summary['load_s'] * 1e3:.1f} ms, "
+              f"peak RSS: {summary['max_rss_mb']:.1f} MB (median of {args.repeats})")
+
+
+if __name__ == '__main__':
+    main()
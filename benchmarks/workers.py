@@ -0,0 +1,81 @@
+"""Compares the startup time and memory of spawned workers and of a `WarmPool`.
+
+Every worker builds an environment for one of the entries, which are cycled
+through the workers. Memory is reported as the total proportional set size
+(PSS) of the workers, which splits the pages shared copy-on-write between the
+processes sharing them:
+
+```commandline
+python benchmarks/workers.py --workers 8
+python benchmarks/workers.py --workers 16 --entries walker/run cheetah/run --json
+```
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+from contextual_control_suite.utils import pool
+
+
+def _pss_bytes():
+    """Returns the proportional set size of this process, in bytes."""
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _build(entry):
+    # Imported here such that spawned workers pay for the import.
+    from contextual_control_suite import suite
+
+    domain_name, task_name = entry
+    env = suite.load(domain_name, task_name)
+    env.reset()
+    return os.getpid(), time.time(), _pss_bytes()
+
+
+def _measure(make_pool, entries, num_workers):
+    start = time.time()
+    with make_pool() as workers:
+        created = time.time()
+        results = workers.map(_build, [entries[i % len(entries)] for i in range(num_workers)], chunksize=1)
+    pss = {}
+    for pid, _, worker_pss in results:
+        pss[pid] = max(pss.get(pid, 0), worker_pss)
+    return {
+        'pool_s': created - start,
+        'ready_s': max(ready for _, ready, _ in results) - start,
+        'workers_pss_mb': sum(pss.values()) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--entries', type=str, nargs='*', default=['walker/run', 'cheetah/run', 'cartpole/swingup'],
+                        help='Tasks built by the workers as domain/task.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+    entries = [tuple(entry.split('/')) for entry in args.entries]
+
+    results = {
+        'spawn': _measure(lambda: multiprocessing.get_context('spawn').Pool(args.workers), entries, args.workers),
+        'warm': _measure(lambda: pool.WarmPool([entry + (None,) for entry in entries], args.workers),
+                         entries, args.workers),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print('{:<8} {:>10} {:>12} {:>16}'.format('pool', 'pool s', 'ready s', 'workers PSS MB'))
+        for name, result in results.items():
+            print('{:<8} {:>10.3f} {:>12.3f} {:>16.1f}'.format(
+                name, result['pool_s'], result['ready_s'], result['workers_pss_mb']))
+
+
+if __name__ == '__main__':
+    main()
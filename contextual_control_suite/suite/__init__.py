@@ -16,32 +16,65 @@
 """A collection of MuJoCo-based Reinforcement Learning environments."""
 
 import collections
-import inspect
+import collections.abc
+import importlib
 
-from dm_control.rl import control
+# A static manifest of the tasks of every domain and their tags. The task
+# collections below are built from it, such that importing the suite does not
+# import any domain. Each domain module is only imported when first loaded, and
+# must declare the same tasks in its `SUITE`.
+_MANIFEST = {
+    'cartpole': {'balance': ('benchmarking',), 'swingup': ('benchmarking',)},
+    'cheetah': {'run': ('benchmarking',)},
+    'finger': {'spin': ('benchmarking',)},
+    'fish': {'swim': ('benchmarking', 'model_randomization')},
+    'hopper': {'stand': ('benchmarking',), 'hop': ('benchmarking',)},
+    'pendulum': {'swingup': ('benchmarking',)},
+    'quadruped': {'walk': (), 'run': (), 'escape': ('model_randomization',)},
+    'reacher': {'easy': ('benchmarking', 'easy', 'model_randomization'),
+                'hard': ('benchmarking', 'model_randomization')},
+    'walker': {'stand': ('benchmarking',), 'walk': ('benchmarking',), 'run': ('benchmarking',)},
+}
 
-from contextual_control_suite.suite import cartpole, pendulum, reacher, cheetah, hopper, quadruped, walker, finger, fish
 
-# Find all domains imported.
-_DOMAINS = {name: module for name, module in locals().items()
-            if inspect.ismodule(module) and hasattr(module, 'SUITE')}
+class _LazyDomains(collections.abc.Mapping):
+    """A mapping from domain names to their modules, importing them on first access."""
+
+    def __getitem__(self, domain_name):
+        if domain_name not in _MANIFEST:
+            raise KeyError(domain_name)
+        domain = importlib.import_module('{}.{}'.format(__name__, domain_name))
+        if tuple(domain.SUITE.keys()) != tuple(_MANIFEST[domain_name]):
+            raise RuntimeError('The tasks of domain {!r} do not match the manifest of the '
+                               'suite.'.format(domain_name))
+        return domain
+
+    def __iter__(self):
+        return iter(_MANIFEST)
+
+    def __len__(self):
+        return len(_MANIFEST)
+
+
+_DOMAINS = _LazyDomains()
+
+
+def __getattr__(name):
+    # Domain modules remain accessible as attributes, e.g. `suite.cartpole`.
+    if name in _MANIFEST:
+        return _DOMAINS[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 def _get_tasks(tag):
     """Returns a sequence of (domain name, task name) pairs for the given tag."""
     result = []
 
-    for domain_name in sorted(_DOMAINS.keys()):
-
-        domain = _DOMAINS[domain_name]
+    for domain_name in sorted(_MANIFEST.keys()):
 
-        if tag is None:
-            tasks_in_domain = domain.SUITE
-        else:
-            tasks_in_domain = domain.SUITE.tagged(tag)
-
-        for task_name in tasks_in_domain.keys():
-            result.append((domain_name, task_name))
+        for task_name, tags in _MANIFEST[domain_name].items():
+            if tag is None or tag in tags:
+                result.append((domain_name, task_name))
 
     return tuple(result)
 
@@ -67,6 +100,10 @@ EXTRA = tuple(sorted(set(ALL_TASKS) - set(BENCHMARKING)))
 NO_REWARD_VIZ = _get_tasks('no_reward_visualization')
 REWARD_VIZ = tuple(sorted(set(ALL_TASKS) - set(NO_REWARD_VIZ)))
 
+# Tasks randomizing fields of the model at every episode, which therefore
+# cannot share a compiled model between environments.
+MODEL_RANDOMIZATION = _get_tasks('model_randomization')
+
 # A mapping from each domain name to a sequence of its task names.
 TASKS_BY_DOMAIN = _get_tasks_by_domain(ALL_TASKS)
 
@@ -95,6 +132,120 @@ def load(domain_name, task_name, task_kwargs=None, environment_kwargs=None,
                              environment_kwargs, visualize_reward)
 
 
+def load_batch(domain_name, task_name, num_envs, task_kwargs=None,
+               environment_kwargs=None, visualize_reward=False, render_kwargs=None):
+    """Returns a batch of environments sharing a single compiled model.
+
+    ```python
+    env = suite.load_batch('cheetah', 'run', 64, task_kwargs={'dynamics_kwargs': {'length': 0.5}})
+    time_step = env.step(actions)  # `actions` has shape [64, 6].
+    ```
+
+    Args:
+      domain_name: A string containing the name of a domain.
+      task_name: A string containing the name of a task.
+      num_envs: Number of environments in the batch.
+      task_kwargs: Optional `dict` of keyword arguments for the task, shared by
+        all environments of the batch.
+      environment_kwargs: Optional `dict` specifying keyword arguments for the
+        environment.
+      visualize_reward: Optional `bool`. If `True`, object colours in rendered
+        frames are set to indicate the reward at each step. Default `False`.
+      render_kwargs: Optional `dict` of keyword arguments of the
+        `rendering.BatchRenderer` rendering every member into `env.frames`.
+
+    Raises:
+      ValueError: If the domain or task doesn't exist, or if the task randomizes
+        its model and can therefore not be batched.
+
+    Returns:
+      A `BatchEnvironment` instance.
+    """
+    if (domain_name, task_name) in MODEL_RANDOMIZATION:
+        raise ValueError('Task {!r} of domain {!r} randomizes its model and cannot be '
+                         'batched.'.format(task_name, domain_name))
+    # Imported here such that importing the suite does not import MuJoCo.
+    from contextual_control_suite.utils.environment import BatchEnvironment
+
+    env = build_environment(domain_name, task_name, task_kwargs,
+                            environment_kwargs, visualize_reward)
+    return BatchEnvironment(env, num_envs, random=(task_kwargs or {}).get('random'),
+                            render_kwargs=render_kwargs)
+
+
+def load_vector(contexts, num_workers=None, environment_kwargs=None, seed=None, render_kwargs=None):
+    """Returns environments with different contexts stepped in worker processes.
+
+    ```python
+    contexts = [('cheetah', 'run', {'dynamics_kwargs': {'length': 0.4}}),
+                ('walker', 'run', {'reward_kwargs': {'horizontal_velocity': {'margin': -4}}})]
+    env = suite.load_vector(contexts, num_workers=2, seed=0)
+    ```
+
+    Args:
+      contexts: A sequence of `(domain_name, task_name, task_kwargs)` triples.
+      num_workers: Optional number of worker processes, defaults to the number
+        of CPUs.
+      environment_kwargs: Optional `dict` specifying keyword arguments for all
+        environments.
+      seed: Optional integer, environment `i` is seeded with `seed + i` unless
+        its `task_kwargs` specify `random`.
+      render_kwargs: Optional `dict` of keyword arguments of the
+        `rendering.BatchRenderer` of every worker, rendering into `env.frames`.
+
+    Raises:
+      ValueError: If a domain or task doesn't exist.
+
+    Returns:
+      A `VectorEnvironment` instance.
+    """
+    from contextual_control_suite.utils.vector import VectorEnvironment
+
+    return VectorEnvironment(contexts, num_workers=num_workers, environment_kwargs=environment_kwargs,
+                             seed=seed, render_kwargs=render_kwargs)
+
+
+def load_async(domain_name, task_name, task_kwargs=None, environment_kwargs=None,
+               process=False, executor=None):
+    """Returns an environment whose methods return awaitables.
+
+    ```python
+    env = suite.load_async('cheetah', 'run')
+    time_step = await env.reset()
+    time_step = await env.step(action)
+    ```
+
+    Args:
+      domain_name: A string containing the name of a domain.
+      task_name: A string containing the name of a task.
+      task_kwargs: Optional `dict` of keyword arguments for the task.
+      environment_kwargs: Optional `dict` specifying keyword arguments for the
+        environment.
+      process: Optional `bool`. If `True`, the environment runs in a worker
+        process instead of a thread pool. Default `False`.
+      executor: Optional `concurrent.futures.Executor` running the calls of a
+        thread-backed environment, defaults to that of the event loop.
+
+    Raises:
+      ValueError: If the domain or task doesn't exist.
+
+    Returns:
+      An `AsyncEnvironment` or an `AsyncProcessEnvironment` instance.
+    """
+    from contextual_control_suite.utils import async_env
+
+    if process:
+        # Checked here, since the worker only reports errors as `RuntimeError`.
+        if domain_name not in _MANIFEST:
+            raise ValueError('Domain {!r} does not exist.'.format(domain_name))
+        if task_name not in _MANIFEST[domain_name]:
+            raise ValueError('Level {!r} does not exist in domain {!r}.'.format(
+                task_name, domain_name))
+        return async_env.AsyncProcessEnvironment(domain_name, task_name, task_kwargs, environment_kwargs)
+    return async_env.AsyncEnvironment(
+        build_environment(domain_name, task_name, task_kwargs, environment_kwargs), executor=executor)
+
+
 def build_environment(domain_name, task_name, task_kwargs=None,
                       environment_kwargs=None, visualize_reward=False):
     """Returns an environment from the suite given a domain name and a task name.
@@ -128,4 +279,105 @@ def build_environment(domain_name, task_name, task_kwargs=None,
         task_kwargs = dict(task_kwargs, environment_kwargs=environment_kwargs)
     env = domain.SUITE[task_name](**task_kwargs)
     env.task.visualize_reward = visualize_reward
-    return env
\ No newline at end of file
+    return env
+
+
+# Tasks resolving the contexts of `context_schema` and `resolve_context`, by domain and task.
+_TASKS = {}
+
+
+def _get_task(domain_name, task_name):
+    """Returns a task of the suite without its physics, built once per process."""
+    if domain_name not in _DOMAINS:
+        raise ValueError('Domain {!r} does not exist.'.format(domain_name))
+
+    domain = _DOMAINS[domain_name]
+    if task_name not in domain.SUITE:
+        raise ValueError('Level {!r} does not exist in domain {!r}.'.format(
+            task_name, domain_name))
+
+    task = _TASKS.get((domain_name, task_name))
+    if task is None:
+        task = _TASKS[domain_name, task_name] = domain.TASKS[task_name]()
+    return task
+
+
+def context_schema(domain_name, task_name, reward_kwargs=None):
+    """Returns the `ContextSchema` listing the context parameters of a task.
+
+    ```python
+    schema = suite.context_schema('walker', 'run')
+    samples = contexts.uniform(schema, {'dynamics.length': (0.2, 0.4)}, 1000)
+    env.set_context(**schema.to_kwargs(samples[0]))
+    ```
+
+    Args:
+      domain_name: A string containing the name of a domain.
+      task_name: A string containing the name of a task.
+      reward_kwargs: Optional `dict` of reward parameters fixing the settings
+        that are not numeric, such as the sigmoids, for all contexts.
+
+    Raises:
+      ValueError: If the domain or task doesn't exist.
+
+    Returns:
+      A `ContextSchema` instance.
+    """
+    from contextual_control_suite.utils import contexts
+
+    task = _get_task(domain_name, task_name)
+    return contexts.ContextSchema.from_task(
+        task, getattr(_DOMAINS[domain_name], 'DYNAMICS_PARAMETERS', None), reward_kwargs)
+
+
+def resolve_context(domain_name, task_name, task_kwargs=None):
+    """Returns the canonical `contexts.Context` of a task under `task_kwargs`.
+
+    The context is resolved by the task alone, without building a model, and
+    cached, such that it is cheap enough to call for every environment.
+
+    ```python
+    context = suite.resolve_context('walker', 'run', {'dynamics_kwargs': {'length': 0.3}})
+    cache[context] = ...
+    ```
+
+    Args:
+      domain_name: A string containing the name of a domain.
+      task_name: A string containing the name of a task.
+      task_kwargs: Optional `dict` of keyword arguments for the task, of which
+        `reward_kwargs` and `dynamics_kwargs` make the context.
+
+    Raises:
+      ValueError: If the domain or task doesn't exist.
+    """
+    from contextual_control_suite.utils import contexts
+
+    task = _get_task(domain_name, task_name)
+    task_kwargs = task_kwargs or {}
+    return contexts.resolve_context(
+        task, domain_name, task_name, task_kwargs.get('reward_kwargs'), task_kwargs.get('dynamics_kwargs'))
+
+
+def set_model_cache_size(maxsize):
+    """Sets the number of compiled models kept by the suite, 0 disables caching."""
+    from contextual_control_suite.utils.models import MODEL_CACHE
+
+    MODEL_CACHE.resize(maxsize)
+
+
+def model_cache_stats():
+    """Returns a `dict` with the hit, miss and eviction counts of the model cache."""
+    from contextual_control_suite.utils.models import MODEL_CACHE
+
+    return MODEL_CACHE.stats()
+
+
+def set_model_store(directory):
+    """Sets the directory where compiled models are persisted, `None` disables it.
+
+    The store is shared by all processes using the same directory, including
+    worker processes started afterwards.
+    """
+    from contextual_control_suite.utils import store
+
+    store.set_model_store(directory)
@@ -1,3 +1,5 @@
+import functools
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
@@ -5,9 +7,19 @@ from dm_control.suite import common
 from lxml import etree
 from dm_control.suite.cartpole import Balance, Physics, _DEFAULT_TIME_LIMIT
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_make_model`, with their default and valid range.
+DYNAMICS_PARAMETERS = {
+    'length': contexts.Parameter(default=1.0, low=0.1, high=3.0),
+    'mass': contexts.Parameter(default=0.1, low=0.01, high=2.0),
+    'size': contexts.Parameter(default=0.045, low=0.01, high=0.2),
+}
+
 
 def get_model_and_assets(dynamics_kwargs=None):
     """Returns a tuple containing the model XML string and a dict of assets."""
@@ -19,11 +31,14 @@ def balance(time_limit=_DEFAULT_TIME_LIMIT, random=None,
             environment_kwargs=None, reward_kwargs=None,
             dynamics_kwargs=None):
     """Returns the Cartpole Balance task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('cartpole', 'balance', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = BalanceReward(swing_up=False, random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, time_limit=time_limit, **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS,
+        time_limit=time_limit, **environment_kwargs)
 
 
 @SUITE.add('benchmarking')
@@ -31,11 +46,14 @@ def swingup(time_limit=_DEFAULT_TIME_LIMIT, random=None,
             environment_kwargs=None, reward_kwargs=None,
             dynamics_kwargs=None):
     """Returns the Cartpole Swing-Up task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('cartpole', 'swingup', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = BalanceReward(swing_up=True, random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, time_limit=time_limit, **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS,
+        time_limit=time_limit, **environment_kwargs)
 
 
 def _make_model(dynamics_kwargs=None):
@@ -75,10 +93,18 @@ class BalanceReward(Balance):
             automatically (default).
         """
         super().__init__(swing_up, sparse=False, random=random)
-        assert isinstance(reward_kwargs, dict)
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        self.reward_parameters = contexts.resolve_reward(self, reward_kwargs).reward_parameters
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
 
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
         # default reward parameters in DM Control
-        default_reward_parameters = {
+        return {
             'centered': {
                 'sigmoid': 'gaussian',
                 'margin': 2,
@@ -96,24 +122,57 @@ class BalanceReward(Balance):
             }
         }
 
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         # update reward parameters
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
+        return utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
 
     def _get_reward(self, physics, sparse):
         """"""
         upright = (physics.pole_angle_cosine() + 1) / 2
 
-        centered = rewards.tolerance(physics.cart_position(),
-                                     **self.reward_parameters['centered'])
+        centered = self._reward_kernels['centered'](physics.cart_position())
         centered = (1 + centered) / 2
-        small_control = rewards.tolerance(physics.control(),
-                                          **self.reward_parameters['small_control'])[0]
+        small_control = self._reward_kernels['small_control'](physics.control())[0]
         small_control = (4 + small_control) / 5
-        small_velocity = rewards.tolerance(physics.angular_vel(),
-                                           **self.reward_parameters['small_velocity']).min()
+        small_velocity = self._reward_kernels['small_velocity'](physics.angular_vel()).min()
         small_velocity = (1 + small_velocity) / 2
         return upright.mean() * small_control * small_velocity * centered
 
     def get_reward(self, physics):
         """Returns a sparse or a smooth reward, as specified in the constructor."""
         return self._get_reward(physics, sparse=False)
+
+    def batch_reward(self, reward_kwargs, pole_angle_cosine, cart_position, control, angular_vel):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          pole_angle_cosine: An array of shape [T, P] holding `physics.pole_angle_cosine()`.
+          cart_position: An array of shape [T] holding `physics.cart_position()`.
+          control: An array of shape [T, 1] holding `physics.control()`.
+          angular_vel: An array of shape [T, P] holding `physics.angular_vel()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters = [self.resolve_reward_kwargs(kwargs) for kwargs in reward_kwargs]
+        upright = (np.asarray(pole_angle_cosine, dtype=np.float64) + 1) / 2
+
+        centered = utils.batch_tolerance(np.asarray(cart_position, dtype=np.float64)[:, None],
+                                         [p['centered'] for p in parameters], scalar=True)
+        centered = (1 + centered) / 2
+        small_control = utils.batch_tolerance(np.asarray(control, dtype=np.float64)[:, :, None],
+                                              [p['small_control'] for p in parameters])[:, 0]
+        small_control = (4 + small_control) / 5
+        small_velocity = utils.batch_tolerance(np.asarray(angular_vel, dtype=np.float64)[:, :, None],
+                                               [p['small_velocity'] for p in parameters]).min(axis=1)
+        small_velocity = (1 + small_velocity) / 2
+        return upright.mean(axis=1)[:, None] * small_control * small_velocity * centered
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'balance': functools.partial(BalanceReward, swing_up=False),
+    'swingup': functools.partial(BalanceReward, swing_up=True),
+}
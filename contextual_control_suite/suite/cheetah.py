@@ -1,4 +1,5 @@
 import copy
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
@@ -6,9 +7,17 @@ from dm_control.suite.cheetah import Cheetah, Physics, _DEFAULT_TIME_LIMIT, _RUN
 from dm_control.suite import common
 from lxml import etree
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_make_model`, with their default and valid range.
+DYNAMICS_PARAMETERS = {
+    'length': contexts.Parameter(default=0.5, low=0.1, high=1.5),
+}
+
 
 def get_model_and_assets(dynamics_kwargs=None):
   """Returns a tuple containing the model XML string and a dict of assets."""
@@ -19,11 +28,13 @@ def get_model_and_assets(dynamics_kwargs=None):
 def run(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None,
         reward_kwargs=None, dynamics_kwargs=None):
     """Returns the run task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('cheetah', 'run', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = CheetahReward(random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(physics, task, time_limit=time_limit,
-                               **environment_kwargs)
+    return ContextualEnvironment(physics, task, model_loader=model_loader,
+                                 dynamics_kwargs=dynamics_kwargs, time_limit=time_limit,
+                                 dynamics_parameters=DYNAMICS_PARAMETERS, **environment_kwargs)
 
 
 def _make_model(dynamics_kwargs=None):
@@ -60,8 +71,18 @@ class CheetahReward(Cheetah):
             automatically (default).
         """
         super().__init__(random=random)
-
-        default_reward_parameters = {
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        context = contexts.resolve_reward(self, reward_kwargs)
+        self.reward_parameters, self.speed_direction = context.reward_parameters, context.direction
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
+
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
+        return {
             'speed': {
                 'bounds': [_RUN_SPEED, float('inf')],
                 'margin': _RUN_SPEED,
@@ -70,20 +91,37 @@ class CheetahReward(Cheetah):
             }
         }
 
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters and the speed direction given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         # update reward parameters
         reward_kwargs_copy = copy.deepcopy(reward_kwargs)
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
+        reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
 
         # if margin is negative, change the speed direction
-        if self.reward_parameters['speed']['margin'] < 0:
-            self.reward_parameters['speed']['margin'] *= -1.0
-            self.speed_direction = -1.0
-        else:
-            self.speed_direction = 1.0
-
-        # manually overwrite the bounds
-        self.reward_parameters['speed']['bounds'] = [self.reward_parameters['speed']['margin'], float('inf')]
+        speed_direction = utils.set_direction(reward_parameters, 'speed')
+        return reward_parameters, speed_direction
 
     def get_reward(self, physics):
         """Returns a reward to the agent."""
-        return rewards.tolerance(self.speed_direction * physics.speed(), **self.reward_parameters['speed'])
+        return self._reward_kernels['speed'](self.speed_direction * physics.speed())
+
+    def batch_reward(self, reward_kwargs, speed):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          speed: An array of shape [T] holding `physics.speed()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters, direction = zip(*map(self.resolve_reward_kwargs, reward_kwargs))
+        speed = np.asarray(speed, dtype=np.float64)[:, None]
+        return utils.batch_tolerance(np.asarray(direction) * speed, [p['speed'] for p in parameters],
+                                     scalar=True)
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'run': CheetahReward,
+}
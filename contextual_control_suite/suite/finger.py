@@ -1,4 +1,5 @@
 import copy
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
@@ -6,9 +7,17 @@ from dm_control.suite.finger import Spin, Physics, _DEFAULT_TIME_LIMIT, _CONTROL
 from dm_control.suite import common
 from lxml import etree
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_make_model`, with their default and valid range.
+DYNAMICS_PARAMETERS = {
+    'length': contexts.Parameter(default=0.16, low=0.08, high=0.3),
+}
+
 
 def get_model_and_assets(dynamics_kwargs=None):
     """Returns a tuple containing the model XML string and a dict of assets."""
@@ -19,12 +28,14 @@ def get_model_and_assets(dynamics_kwargs=None):
 def spin(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
          dynamics_kwargs=None):
     """Returns the Spin task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('finger', 'spin', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = SpinReward(random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP,
-        **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS,
+        time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP, **environment_kwargs)
 
 
 # needs to be tweaked
@@ -58,6 +69,10 @@ def _make_model(dynamics_kwargs=None):
 class SpinReward(Spin):
     """A Finger `Task` to spin the stopped body."""
 
+    # Model fields set at every episode, saved by `env.snapshot` such that
+    # environments reset from initial state banks get them as well.
+    episode_model_fields = ('site_rgba', 'dof_damping')
+
     def __init__(self, random=None, reward_kwargs=None):
         """Initializes a new `Spin` instance.
         Args:
@@ -67,9 +82,19 @@ class SpinReward(Spin):
         """
 
         super().__init__(random=random)
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        context = contexts.resolve_reward(self, reward_kwargs)
+        self.reward_parameters, self.spin_direction = context.reward_parameters, context.direction
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
 
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
         # do we need bounds, sigmoid, value_at_margin (should it be the same as cheetah?)
-        default_reward_parameters = {
+        return {
             'spin': {
                 'bounds': [_SPIN_VELOCITY, float('inf')],
                 'margin': _SPIN_VELOCITY,
@@ -78,20 +103,39 @@ class SpinReward(Spin):
             }
         }
 
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters and the spin direction given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         # update reward parameters
         reward_kwargs_copy = copy.deepcopy(reward_kwargs)
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
+        reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
 
         # if margin is negative, change the spin direction
-        if self.reward_parameters['spin']['margin'] < 0:
-            self.reward_parameters['spin']['margin'] *= -1.0
-            self.spin_direction = -1.0
-        else:
-            self.spin_direction = 1.0
-
-        # manually overwrite the bounds
-        self.reward_parameters['spin']['bounds'] = [self.reward_parameters['spin']['margin'], float('inf')]
+        spin_direction = utils.set_direction(reward_parameters, 'spin')
+        return reward_parameters, spin_direction
 
     def get_reward(self, physics):
         """Returns a reward to the agent."""
-        return rewards.tolerance(self.spin_direction * physics.hinge_velocity()[0], **self.reward_parameters['spin'])
+        # Depending on the version of dm_control the hinge velocity is a scalar or an array.
+        hinge_velocity = np.ravel(physics.hinge_velocity())[0]
+        return self._reward_kernels['spin'](self.spin_direction * hinge_velocity)
+
+    def batch_reward(self, reward_kwargs, hinge_velocity):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          hinge_velocity: An array of shape [T] holding `physics.hinge_velocity()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters, direction = zip(*map(self.resolve_reward_kwargs, reward_kwargs))
+        hinge_velocity = np.asarray(hinge_velocity, dtype=np.float64).reshape(-1, 1)
+        return utils.batch_tolerance(np.asarray(direction) * hinge_velocity, [p['spin'] for p in parameters],
+                                     scalar=True)
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'spin': SpinReward,
+}
@@ -7,24 +7,35 @@ from dm_control.suite.fish import Swim, Physics, _DEFAULT_TIME_LIMIT, _CONTROL_T
 from dm_control.suite import common
 from lxml import etree
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_make_model`, with their default and valid range.
+DYNAMICS_PARAMETERS = {
+    'length': contexts.Parameter(default=0.001, low=0.0005, high=0.005),
+}
+
+
 def get_model_and_assets(dynamics_kwargs=None):
   """Returns a tuple containing the model XML string and a dict of assets."""
   return _make_model(dynamics_kwargs), common.ASSETS
 
 
-@SUITE.add('benchmarking')
+@SUITE.add('benchmarking', 'model_randomization')
 def swim(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None, dynamics_kwargs=None):
     """Returns the Fish Swim task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('fish', 'swim', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = SwimReward(random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, control_timestep=_CONTROL_TIMESTEP, time_limit=time_limit,
-        **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS,
+        control_timestep=_CONTROL_TIMESTEP, time_limit=time_limit, **environment_kwargs)
 
 
 def _make_model(dynamics_kwargs=None):
@@ -54,6 +65,9 @@ def _make_model(dynamics_kwargs=None):
 class SwimReward(Swim):
     """A Fish `Task` for swimming with smooth reward."""
 
+    # Model fields randomized at every episode, saved by `env.snapshot`.
+    episode_model_fields = ('geom_pos',)
+
     def __init__(self, random=None, reward_kwargs=None):
         """Initializes an instance of `Swim`.
         Args:
@@ -62,24 +76,55 @@ class SwimReward(Swim):
             automatically (default).
         """
         super().__init__(random=random)
+        self.set_reward_kwargs(reward_kwargs)
 
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        self.reward_parameters = contexts.resolve_reward(self, reward_kwargs).reward_parameters
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
 
-
-        default_reward_parameters = {
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
+        return {
             'swim': {
                 'bounds': [0, 0.045],
                 'margin': 2*0.045
             }
         }
 
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         # update reward parameters
         reward_kwargs_copy = copy.deepcopy(reward_kwargs)
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
-
+        return utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
 
     def get_reward(self, physics):
         """Returns a smooth reward."""
-        in_target = rewards.tolerance(np.linalg.norm(physics.mouth_to_target()),
-                                    **self.reward_parameters['swim'])
+        in_target = self._reward_kernels['swim'](np.linalg.norm(physics.mouth_to_target()))
         is_upright = 0.5 * (physics.upright() + 1)
-        return (7*in_target + is_upright) / 8
\ No newline at end of file
+        return (7*in_target + is_upright) / 8
+
+    def batch_reward(self, reward_kwargs, mouth_to_target, upright):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          mouth_to_target: An array of shape [T, 3] holding `physics.mouth_to_target()`.
+          upright: An array of shape [T] holding `physics.upright()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters = [self.resolve_reward_kwargs(kwargs) for kwargs in reward_kwargs]
+        # Norms are taken row by row to match `get_reward` to the last bit.
+        distance = np.array([np.linalg.norm(v) for v in np.asarray(mouth_to_target, dtype=np.float64)])
+        in_target = utils.batch_tolerance(distance[:, None], [p['swim'] for p in parameters], scalar=True)
+        is_upright = 0.5 * (np.asarray(upright, dtype=np.float64)[:, None] + 1)
+        return (7*in_target + is_upright) / 8
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'swim': SwimReward,
+}
@@ -1,32 +1,80 @@
 import copy
+import functools
+import mujoco
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
 from dm_control.suite.hopper import Hopper, Physics, get_model_and_assets, _DEFAULT_TIME_LIMIT, _CONTROL_TIMESTEP, _STAND_HEIGHT, _HOP_SPEED
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_edit_model`, with their default and valid range.
+# The defaults are rounded, e.g. the default torso mass is the one given by the
+# density of its geom, such that setting a parameter to its default changes the
+# model slightly.
+DYNAMICS_PARAMETERS = {
+    'thigh_length': contexts.Parameter(default=0.33, low=0.15, high=0.6),
+    'leg_length': contexts.Parameter(default=0.32, low=0.15, high=0.6),
+    'torso_mass': contexts.Parameter(default=4.515, low=1.0, high=15.0),
+    'damping': contexts.Parameter(default=0.05, low=0.0, high=1.0),
+}
+
+# The standing reward term, which is not part of the context.
+_standing_kernel = utils.tolerance_kernel(bounds=(_STAND_HEIGHT, 2))
+
 @SUITE.add('benchmarking')
-def stand(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None):
+def stand(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
+          dynamics_kwargs=None):
   """Returns a Hopper that strives to stand upright, balancing its pose."""
-  physics = Physics.from_xml_string(*get_model_and_assets())
+  model_loader = models.ModelLoader('hopper', 'stand', Physics, get_model_and_assets, edit_fn=_edit_model)
+  physics = model_loader.physics(dynamics_kwargs)
   task = HopperReward(hopping=False, random=random, reward_kwargs=reward_kwargs)
   environment_kwargs = environment_kwargs or {}
-  return control.Environment(
-      physics, task, time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP,
-      **environment_kwargs)
+  return ContextualEnvironment(
+      physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+      dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit,
+      control_timestep=_CONTROL_TIMESTEP, **environment_kwargs)
 
 
 @SUITE.add('benchmarking')
-def hop(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None):
+def hop(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
+        dynamics_kwargs=None):
   """Returns a Hopper that strives to hop forward."""
-  physics = Physics.from_xml_string(*get_model_and_assets())
+  model_loader = models.ModelLoader('hopper', 'hop', Physics, get_model_and_assets, edit_fn=_edit_model)
+  physics = model_loader.physics(dynamics_kwargs)
   task = HopperReward(hopping=True, random=random, reward_kwargs=reward_kwargs)
   environment_kwargs = environment_kwargs or {}
-  return control.Environment(
-      physics, task, time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP,
-      **environment_kwargs)
+  return ContextualEnvironment(
+      physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+      dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit,
+      control_timestep=_CONTROL_TIMESTEP, **environment_kwargs)
+
+
+def _edit_model(spec, dynamics_kwargs):
+  """Applies the dynamics parameters to the parsed model of the hopper."""
+  default_thigh_length = DYNAMICS_PARAMETERS['thigh_length'].default
+  default_leg_length = DYNAMICS_PARAMETERS['leg_length'].default
+  thigh_length = dynamics_kwargs.get('thigh_length', default_thigh_length)
+  leg_length = dynamics_kwargs.get('leg_length', default_leg_length)
+  if 'thigh_length' in dynamics_kwargs or 'leg_length' in dynamics_kwargs:
+    spec.geom('thigh').fromto = [0, 0, 0, 0, 0, -thigh_length]
+    spec.body('calf').pos = [0, 0, -thigh_length]
+    spec.geom('calf').fromto = [0, 0, 0, 0, 0, -leg_length]
+    spec.body('foot').pos = [0, 0, -leg_length]
+    # The torso is moved such that the foot starts at the same height.
+    spec.body('torso').pos = [0, 0, 1 + (thigh_length - default_thigh_length) + (leg_length - default_leg_length)]
+  if 'torso_mass' in dynamics_kwargs:
+    spec.geom('torso').mass = dynamics_kwargs['torso_mass']
+  if 'damping' in dynamics_kwargs:
+    # The root joints are not damped.
+    for joint in spec.joints:
+      if joint.type == mujoco.mjtJoint.mjJNT_HINGE and joint.name != 'rooty':
+        joint.damping[0] = dynamics_kwargs['damping']
 
 
 class HopperReward(Hopper):
@@ -42,8 +90,18 @@ class HopperReward(Hopper):
             automatically (default).
         """
         super().__init__(hopping, random=random)
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        context = contexts.resolve_reward(self, reward_kwargs)
+        self.reward_parameters, self.speed_direction = context.reward_parameters, context.direction
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
 
-        default_reward_parameters = {
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
+        return {
             'height': {
                 'bounds': [0.6, 2],
                 'sigmoid': 'linear',
@@ -63,30 +121,59 @@ class HopperReward(Hopper):
             }
         }
 
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters and the speed direction given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         reward_kwargs_copy = copy.deepcopy(reward_kwargs)
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
+        reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
 
         # if margin is negative, change the speed direction
-        if self.reward_parameters['speed']['margin'] < 0:
-            self.reward_parameters['speed']['margin'] *= -1.0
-            self.speed_direction = -1.0
-        else:
-            self.speed_direction = 1.0
-
-        # manually overwrite the bounds
-        self.reward_parameters['speed']['bounds'] = [self.reward_parameters['speed']['margin'], float('inf')]
+        speed_direction = utils.set_direction(reward_parameters, 'speed')
+        return reward_parameters, speed_direction
 
-        
     def get_reward(self, physics):
         """Returns a reward applicable to the performed task."""
         # standing = rewards.tolerance(physics.height(), **self.reward_parameters['height'])
-        standing = rewards.tolerance(physics.height(), (_STAND_HEIGHT, 2))
+        standing = _standing_kernel(physics.height())
+
+        if self._hopping:
+            hopping = self._reward_kernels['speed'](physics.speed())
+            return standing * hopping
+
+        else:
+            small_control = self._reward_kernels['control'](physics.control()).mean()
+            small_control = (small_control + 4) / 5
+            return standing * small_control
+
+    def batch_reward(self, reward_kwargs, height, speed, control):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          height: An array of shape [T] holding `physics.height()`.
+          speed: An array of shape [T] holding `physics.speed()`.
+          control: An array of shape [T, A] holding `physics.control()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters = [self.resolve_reward_kwargs(kwargs)[0] for kwargs in reward_kwargs]
+        standing = utils.batch_tolerance(np.asarray(height, dtype=np.float64)[:, None],
+                                         [{'bounds': (_STAND_HEIGHT, 2)}], scalar=True)
 
         if self._hopping:
-            hopping = rewards.tolerance(physics.speed(), **self.reward_parameters['speed'])
+            speed = np.asarray(speed, dtype=np.float64)[:, None]
+            hopping = utils.batch_tolerance(speed, [p['speed'] for p in parameters], scalar=True)
             return standing * hopping
 
         else:
-            small_control = rewards.tolerance(physics.control(), **self.reward_parameters['control']).mean()
+            control = np.asarray(control, dtype=np.float64)[:, :, None]
+            small_control = utils.batch_tolerance(control, [p['control'] for p in parameters]).mean(axis=1)
             small_control = (small_control + 4) / 5
             return standing * small_control
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'stand': functools.partial(HopperReward, hopping=False),
+    'hop': functools.partial(HopperReward, hopping=True),
+}
@@ -1,21 +1,46 @@
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
 from dm_control.suite.pendulum import SwingUp, Physics, get_model_and_assets, _DEFAULT_TIME_LIMIT
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_edit_model`, with their default and valid range.
+DYNAMICS_PARAMETERS = {
+    'length': contexts.Parameter(default=0.5, low=0.1, high=1.5),
+    'mass': contexts.Parameter(default=1.0, low=0.1, high=5.0),
+    'damping': contexts.Parameter(default=0.1, low=0.0, high=1.0),
+}
+
 
 @SUITE.add('benchmarking')
 def swingup(time_limit=_DEFAULT_TIME_LIMIT, random=None,
-            environment_kwargs=None, reward_kwargs=None):
+            environment_kwargs=None, reward_kwargs=None, dynamics_kwargs=None):
     """Returns pendulum swingup task ."""
-    physics = Physics.from_xml_string(*get_model_and_assets())
+    model_loader = models.ModelLoader('pendulum', 'swingup', Physics, get_model_and_assets,
+                                      edit_fn=_edit_model)
+    physics = model_loader.physics(dynamics_kwargs)
     task = SwingUpReward(random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, time_limit=time_limit, **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit, **environment_kwargs)
+
+
+def _edit_model(spec, dynamics_kwargs):
+    """Applies the dynamics parameters to the parsed model of the pendulum."""
+    if 'length' in dynamics_kwargs:
+        spec.geom('pole').fromto = [0, 0, 0, 0, 0, dynamics_kwargs['length']]
+        spec.geom('mass').pos = [0, 0, dynamics_kwargs['length']]
+    if 'mass' in dynamics_kwargs:
+        spec.geom('mass').mass = dynamics_kwargs['mass']
+    if 'damping' in dynamics_kwargs:
+        spec.joint('hinge').damping[0] = dynamics_kwargs['damping']
 
 
 class SwingUpReward(SwingUp):
@@ -31,9 +56,18 @@ class SwingUpReward(SwingUp):
            automatically (default).
        """
         super().__init__(random=random)
+        self.set_reward_kwargs(reward_kwargs)
 
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        self.reward_parameters = contexts.resolve_reward(self, reward_kwargs).reward_parameters
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
+
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
         # default reward parameters in DM Control
-        default_reward_parameters = {
+        return {
             'upright': {
                 'sigmoid': 'gaussian',
                 'margin': 1,
@@ -46,17 +80,43 @@ class SwingUpReward(SwingUp):
             }
         }
 
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         # update reward parameters
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
+        return utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
 
     def get_reward(self, physics):
         """Non-sparse reward function for the pendulum task."""
         upright = (1 - physics.pole_vertical()) / 2
-        upright = rewards.tolerance(upright,
-                                    **self.reward_parameters['upright'])
+        upright = self._reward_kernels['upright'](upright)
         # upright = (1 + upright) / 2
 
-        small_velocity = rewards.tolerance(physics.angular_velocity(),
-                                           **self.reward_parameters['small_velocity']).min()
+        small_velocity = self._reward_kernels['small_velocity'](physics.angular_velocity()).min()
         small_velocity = (1 + small_velocity) / 2
         return upright * small_velocity
+
+    def batch_reward(self, reward_kwargs, pole_vertical, angular_velocity):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          pole_vertical: An array of shape [T] holding `physics.pole_vertical()`.
+          angular_velocity: An array of shape [T, 1] holding `physics.angular_velocity()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters = [self.resolve_reward_kwargs(kwargs) for kwargs in reward_kwargs]
+        upright = (1 - np.asarray(pole_vertical, dtype=np.float64)[:, None]) / 2
+        upright = utils.batch_tolerance(upright, [p['upright'] for p in parameters], scalar=True)
+
+        small_velocity = utils.batch_tolerance(np.asarray(angular_velocity, dtype=np.float64)[:, :, None],
+                                               [p['small_velocity'] for p in parameters]).min(axis=1)
+        small_velocity = (1 + small_velocity) / 2
+        return upright * small_velocity
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'swingup': SwingUpReward,
+}
@@ -1,4 +1,7 @@
 import copy
+import functools
+import mujoco
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
@@ -7,44 +10,99 @@ from dm_control.suite.quadruped import Move, Escape, Physics, _upright_reward, m
 import contextual_control_suite.utils.rewards as utils
 from lxml import etree
 from dm_control.suite import common
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_edit_model`, with their default and valid range.
+# The defaults are rounded, e.g. the default torso mass is the one given by the
+# density of its geom, such that setting a parameter to its default changes the
+# model slightly.
+DYNAMICS_PARAMETERS = {
+    'torso_mass': contexts.Parameter(default=67.858, low=20.0, high=200.0),
+    'damping': contexts.Parameter(default=30.0, low=0.0, high=100.0),
+    'gain': contexts.Parameter(default=1000.0, low=200.0, high=3000.0),
+}
+
+# `_upright_reward` specialized to the deviation angles used by the tasks.
+_upright_kernels = {
+    deviation_angle: utils.tolerance_kernel(bounds=(np.cos(np.deg2rad(deviation_angle)), float('inf')),
+                                            sigmoid='linear',
+                                            margin=1 + np.cos(np.deg2rad(deviation_angle)),
+                                            value_at_margin=0)
+    for deviation_angle in (0, 20)
+}
+
+
+def get_model_and_assets(floor_size=None, terrain=False, rangefinders=False, walls_and_ball=False):
+    """Returns a tuple containing the model XML string and a dict of assets."""
+    return make_model(floor_size, terrain, rangefinders, walls_and_ball), common.ASSETS
+
 
 @SUITE.add()
-def walk(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None):
+def walk(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
+        dynamics_kwargs=None):
     """Returns the Walk task."""
-    xml_string = make_model(floor_size=_DEFAULT_TIME_LIMIT * _WALK_SPEED)
-    physics = Physics.from_xml_string(xml_string, common.ASSETS)
+    model_fn = functools.partial(get_model_and_assets, floor_size=_DEFAULT_TIME_LIMIT * _WALK_SPEED)
+    model_loader = models.ModelLoader('quadruped', 'walk', Physics, model_fn, edit_fn=_edit_model)
+    physics = model_loader.physics(dynamics_kwargs)
     task = MoveReward(desired_speed=_WALK_SPEED, random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(physics, task, time_limit=time_limit,
-                               control_timestep=_CONTROL_TIMESTEP,
-                               **environment_kwargs)
+    return ContextualEnvironment(physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+                                 dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit,
+                                 control_timestep=_CONTROL_TIMESTEP,
+                                 **environment_kwargs)
 
 
 @SUITE.add()
-def run(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None):
+def run(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
+        dynamics_kwargs=None):
     """Returns the Run task."""
-    xml_string = make_model(floor_size=_DEFAULT_TIME_LIMIT * _RUN_SPEED)
-    physics = Physics.from_xml_string(xml_string, common.ASSETS)
+    model_fn = functools.partial(get_model_and_assets, floor_size=_DEFAULT_TIME_LIMIT * _RUN_SPEED)
+    model_loader = models.ModelLoader('quadruped', 'run', Physics, model_fn, edit_fn=_edit_model)
+    physics = model_loader.physics(dynamics_kwargs)
     task = MoveReward(desired_speed=_RUN_SPEED, random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(physics, task, time_limit=time_limit,
-                               control_timestep=_CONTROL_TIMESTEP,
-                               **environment_kwargs)
+    return ContextualEnvironment(physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+                                 dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit,
+                                 control_timestep=_CONTROL_TIMESTEP,
+                                 **environment_kwargs)
 
 
-@SUITE.add()
-def escape(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None):
+@SUITE.add('model_randomization')
+def escape(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
+           dynamics_kwargs=None):
     """Returns the Escape task."""
-    xml_string = make_model(floor_size=40, terrain=True, rangefinders=True)
-    physics = Physics.from_xml_string(xml_string, common.ASSETS)
+    model_fn = functools.partial(get_model_and_assets, floor_size=40, terrain=True, rangefinders=True)
+    model_loader = models.ModelLoader('quadruped', 'escape', Physics, model_fn, edit_fn=_edit_model)
+    physics = model_loader.physics(dynamics_kwargs)
     task = EscapeReward(random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(physics, task, time_limit=time_limit,
-                               control_timestep=_CONTROL_TIMESTEP,
-                               **environment_kwargs)
+    return ContextualEnvironment(physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+                                 dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit,
+                                 control_timestep=_CONTROL_TIMESTEP,
+                                 **environment_kwargs)
+
+
+def _edit_model(spec, dynamics_kwargs):
+    """Applies the dynamics parameters to the parsed model generated by `make_model`.
+
+    The terrain of the Escape task is generated at every episode and is not
+    part of the parsed model.
+    """
+    if 'torso_mass' in dynamics_kwargs:
+        spec.geom('torso').mass = dynamics_kwargs['torso_mass']
+    if 'damping' in dynamics_kwargs:
+        for joint in spec.joints:
+            if joint.type == mujoco.mjtJoint.mjJNT_HINGE:
+                joint.damping[0] = dynamics_kwargs['damping']
+    if 'gain' in dynamics_kwargs:
+        # The actuators are position servos, their bias cancels the gain at the target.
+        for actuator in spec.actuators:
+            actuator.gainprm[0] = dynamics_kwargs['gain']
+            actuator.biasprm[1] = -dynamics_kwargs['gain']
 
 
 class MoveReward(Move):
@@ -61,43 +119,81 @@ class MoveReward(Move):
         self.desired_speed = desired_speed
 
         super().__init__(desired_speed, random=random)
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        context = contexts.resolve_reward(self, reward_kwargs)
+        self.reward_parameters, self.speed_direction = context.reward_parameters, context.direction
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
 
-        default_reward_parameters = {
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
+        return {
             'torso_velocity': {
                 'sigmoid': 'linear',
-                'margin': desired_speed,
+                'margin': self.desired_speed,
                 'value_at_margin': 0.5,
             }
         }
+
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters and the speed direction given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         reward_kwargs_copy = copy.deepcopy(reward_kwargs)
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
+        reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
 
         # if margin is negative, change the speed direction
-        if self.reward_parameters['torso_velocity']['margin'] < 0:
-            self.reward_parameters['torso_velocity']['margin'] *= -1.0
-            self.speed_direction = -1.0
-        else:
-            self.speed_direction = 1.0
-
-        # manually overwrite the bounds
-        self.reward_parameters['torso_velocity']['bounds'] = [self.reward_parameters['torso_velocity']['margin'], float('inf')]
+        speed_direction = utils.set_direction(reward_parameters, 'torso_velocity')
+        return reward_parameters, speed_direction
 
     def get_reward(self, physics):
         """Returns a reward to the agent."""
 
         # Move reward term.
-        move_reward = rewards.tolerance(self.speed_direction * physics.torso_velocity()[0],
-                                        **self.reward_parameters['torso_velocity'])
+        move_reward = self._reward_kernels['torso_velocity'](self.speed_direction * physics.torso_velocity()[0])
 
-        return _upright_reward(physics) * move_reward
+        return _upright_kernels[0](physics.torso_upright()) * move_reward
+
+    def batch_reward(self, reward_kwargs, torso_velocity, torso_upright):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          torso_velocity: An array of shape [T, 3] holding `physics.torso_velocity()`.
+          torso_upright: An array of shape [T] holding `physics.torso_upright()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters, direction = zip(*map(self.resolve_reward_kwargs, reward_kwargs))
+        velocity = np.asarray(torso_velocity, dtype=np.float64)[:, :1]
+        move_reward = utils.batch_tolerance(np.asarray(direction) * velocity,
+                                            [p['torso_velocity'] for p in parameters], scalar=True)
+
+        return _batch_upright_reward(torso_upright)[:, None] * move_reward
 
 
 class EscapeReward(Escape):
+    # Model fields randomized at every episode, saved by `env.snapshot`.
+    episode_model_fields = ('hfield_data',)
+
     def __init__(self,random=None, reward_kwargs=None):
 
         super().__init__(random=random)
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        self.reward_parameters = contexts.resolve_reward(self, reward_kwargs).reward_parameters
+        # Compiled in `get_reward`, the bounds depend on the size of the terrain.
+        self._escape_kernel = None
+        self._terrain_size = None
 
-        default_reward_parameters = {
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
+        return {
             'origin_distance': {
                 'sigmoid': 'linear',
                 'margin': 30,
@@ -105,14 +201,57 @@ class EscapeReward(Escape):
             }
         }
 
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
-        self.reward_parameters['origin_distance']['bounds'] = [physics.model.hfield_size[_HEIGHTFIELD_ID, 0], float('inf')]
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
+        return utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
 
     def get_reward(self, physics):
         """Returns a reward to the agent."""
 
-        # Escape reward term.
-        escape_reward = rewards.tolerance(
-            physics.origin_distance(), **self.reward_parameters['origin_distance'])
+        # Escape reward term, the bounds are given by the size of the terrain.
+        terrain_size = physics.model.hfield_size[_HEIGHTFIELD_ID, 0]
+        if terrain_size != self._terrain_size:
+            self._escape_kernel = utils.tolerance_kernel(
+                **dict(self.reward_parameters['origin_distance'], bounds=(terrain_size, float('inf'))))
+            self._terrain_size = terrain_size
+        escape_reward = self._escape_kernel(physics.origin_distance())
+
+        return _upright_kernels[20](physics.torso_upright()) * escape_reward
+
+    def batch_reward(self, reward_kwargs, origin_distance, torso_upright, terrain_size):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          origin_distance: An array of shape [T] holding `physics.origin_distance()`.
+          torso_upright: An array of shape [T] holding `physics.torso_upright()`.
+          terrain_size: The size of the terrain, `physics.model.hfield_size[0, 0]`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters = [dict(self.resolve_reward_kwargs(kwargs)['origin_distance'],
+                           bounds=(terrain_size, float('inf'))) for kwargs in reward_kwargs]
+        distance = np.asarray(origin_distance, dtype=np.float64)[:, None]
+        escape_reward = utils.batch_tolerance(distance, parameters, scalar=True)
+
+        return _batch_upright_reward(torso_upright, deviation_angle=20)[:, None] * escape_reward
+
+
+def _batch_upright_reward(torso_upright, deviation_angle=0):
+    """Returns `_upright_reward` for an array of `physics.torso_upright()` values."""
+    deviation = np.cos(np.deg2rad(deviation_angle))
+    return utils.batch_tolerance(
+        np.asarray(torso_upright, dtype=np.float64)[:, None],
+        [{'bounds': (deviation, float('inf')),
+          'sigmoid': 'linear',
+          'margin': 1 + deviation,
+          'value_at_margin': 0}], scalar=True)[:, 0]
+
 
-        return _upright_reward(physics, deviation_angle=20) * escape_reward
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'walk': functools.partial(MoveReward, desired_speed=_WALK_SPEED),
+    'run': functools.partial(MoveReward, desired_speed=_RUN_SPEED),
+    'escape': EscapeReward,
+}
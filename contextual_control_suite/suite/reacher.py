@@ -1,28 +1,64 @@
+import functools
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
 from dm_control.suite.reacher import Reacher, Physics, get_model_and_assets, _DEFAULT_TIME_LIMIT, _BIG_TARGET, _SMALL_TARGET
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
-@SUITE.add('benchmarking', 'easy')
-def easy(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None):
+# Dynamics parameters understood by `_edit_model`, with their default and valid range.
+DYNAMICS_PARAMETERS = {
+    'arm_length': contexts.Parameter(default=0.12, low=0.05, high=0.2),
+    'hand_length': contexts.Parameter(default=0.12, low=0.05, high=0.2),
+    'damping': contexts.Parameter(default=0.01, low=0.0, high=0.1),
+    'gear': contexts.Parameter(default=0.05, low=0.01, high=0.2),
+}
+
+@SUITE.add('benchmarking', 'easy', 'model_randomization')
+def easy(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
+         dynamics_kwargs=None):
   """Returns reacher with sparse reward with 5e-2 tol and randomized target."""
-  physics = Physics.from_xml_string(*get_model_and_assets())
+  model_loader = models.ModelLoader('reacher', 'easy', Physics, get_model_and_assets, edit_fn=_edit_model)
+  physics = model_loader.physics(dynamics_kwargs)
   task = ReacherReward(target_size=_BIG_TARGET, random=random, reward_kwargs=reward_kwargs)
   environment_kwargs = environment_kwargs or {}
-  return control.Environment(
-      physics, task, time_limit=time_limit, **environment_kwargs)
+  return ContextualEnvironment(
+      physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+      dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit, **environment_kwargs)
 
-@SUITE.add('benchmarking')
-def hard(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None):
+@SUITE.add('benchmarking', 'model_randomization')
+def hard(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None, reward_kwargs=None,
+         dynamics_kwargs=None):
   """Returns reacher with sparse reward with 1e-2 tol and randomized target."""
-  physics = Physics.from_xml_string(*get_model_and_assets())
+  model_loader = models.ModelLoader('reacher', 'hard', Physics, get_model_and_assets, edit_fn=_edit_model)
+  physics = model_loader.physics(dynamics_kwargs)
   task = ReacherReward(target_size=_SMALL_TARGET, random=random,reward_kwargs=reward_kwargs)
   environment_kwargs = environment_kwargs or {}
-  return control.Environment(
-      physics, task, time_limit=time_limit, **environment_kwargs)
+  return ContextualEnvironment(
+      physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+      dynamics_parameters=DYNAMICS_PARAMETERS, time_limit=time_limit, **environment_kwargs)
+
+
+def _edit_model(spec, dynamics_kwargs):
+  """Applies the dynamics parameters to the parsed model of the reacher."""
+  if 'arm_length' in dynamics_kwargs:
+    spec.geom('arm').fromto = [0, 0, 0, dynamics_kwargs['arm_length'], 0, 0]
+    spec.body('hand').pos = [dynamics_kwargs['arm_length'], 0, 0]
+  if 'hand_length' in dynamics_kwargs:
+    # The finger is a sphere centred slightly beyond the end of the hand.
+    spec.geom('hand').fromto = [0, 0, 0, dynamics_kwargs['hand_length'] - 0.02, 0, 0]
+    spec.body('finger').pos = [dynamics_kwargs['hand_length'], 0, 0]
+  if 'damping' in dynamics_kwargs:
+    for joint in spec.joints:
+      joint.damping[0] = dynamics_kwargs['damping']
+  if 'gear' in dynamics_kwargs:
+    for actuator in spec.actuators:
+      actuator.gear[0] = dynamics_kwargs['gear']
 
 
 class ReacherReward(Reacher):
@@ -30,6 +66,10 @@ class ReacherReward(Reacher):
     Contains reward parameters compared to the original DeepMind Control task.
     """
 
+    # Model fields set at every episode, saved by `env.snapshot`. The target
+    # size is not random, but must be restored with the initial state banks.
+    episode_model_fields = ('geom_pos', 'geom_size')
+
     def __init__(self, target_size, random=None, reward_kwargs=None):
         """Initialize an instance of `Reacher`.
         Args:
@@ -38,8 +78,17 @@ class ReacherReward(Reacher):
             automatically (default).
         """
         super().__init__(target_size, random=random)
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        self.reward_parameters = contexts.resolve_reward(self, reward_kwargs).reward_parameters
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
 
-        default_reward_parameters = {
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
+        return {
             'finger_to_target': {
                 'sigmoid': 'gaussian',
                 'margin' : 0.5,
@@ -47,8 +96,32 @@ class ReacherReward(Reacher):
             }
         }
 
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         # update reward parameters
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
+        return utils.set_reward_parameters(default_reward_parameters, reward_kwargs)
 
     def get_reward(self, physics):
-        return rewards.tolerance(physics.finger_to_target_dist(), **self.reward_parameters['finger_to_target'])
+        return self._reward_kernels['finger_to_target'](physics.finger_to_target_dist())
+
+    def batch_reward(self, reward_kwargs, finger_to_target_dist):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          finger_to_target_dist: An array of shape [T] holding
+            `physics.finger_to_target_dist()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters = [self.resolve_reward_kwargs(kwargs) for kwargs in reward_kwargs]
+        distance = np.asarray(finger_to_target_dist, dtype=np.float64)[:, None]
+        return utils.batch_tolerance(distance, [p['finger_to_target'] for p in parameters], scalar=True)
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'easy': functools.partial(ReacherReward, target_size=_BIG_TARGET),
+    'hard': functools.partial(ReacherReward, target_size=_SMALL_TARGET),
+}
@@ -1,4 +1,6 @@
 import copy
+import functools
+import numpy as np
 from dm_control.rl import control
 from dm_control.utils import containers
 from dm_control.utils import rewards
@@ -6,9 +8,20 @@ from dm_control.suite.walker import PlanarWalker, Physics, _DEFAULT_TIME_LIMIT,
 from dm_control.suite import common
 from lxml import etree
 import contextual_control_suite.utils.rewards as utils
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils.environment import ContextualEnvironment
 
 SUITE = containers.TaggedTasks()
 
+# Dynamics parameters understood by `_make_model`, with their default and valid range.
+DYNAMICS_PARAMETERS = {
+    'length': contexts.Parameter(default=0.3, low=0.1, high=0.6),
+}
+
+# The standing reward term, which is not part of the context.
+_standing_kernel = utils.tolerance_kernel(bounds=(_STAND_HEIGHT, float('inf')), margin=_STAND_HEIGHT / 2)
+
 
 def get_model_and_assets(dynamics_kwargs=None):
   """Returns a tuple containing the model XML string and a dict of assets."""
@@ -19,36 +32,42 @@ def get_model_and_assets(dynamics_kwargs=None):
 def stand(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None,
           reward_kwargs=None, dynamics_kwargs=None):
     """Returns the Stand task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('walker', 'stand', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = PlanarWalkerReward(move_speed=0, random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP,
-        **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS,
+        time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP, **environment_kwargs)
 
 
 @SUITE.add('benchmarking')
 def walk(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None,
          reward_kwargs=None, dynamics_kwargs=None):
     """Returns the Walk task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('walker', 'walk', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = PlanarWalkerReward(move_speed=_WALK_SPEED, random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP,
-        **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS,
+        time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP, **environment_kwargs)
 
 
 @SUITE.add('benchmarking')
 def run(time_limit=_DEFAULT_TIME_LIMIT, random=None, environment_kwargs=None,
         reward_kwargs=None, dynamics_kwargs=None):
     """Returns the Run task."""
-    physics = Physics.from_xml_string(*get_model_and_assets(dynamics_kwargs))
+    model_loader = models.ModelLoader('walker', 'run', Physics, get_model_and_assets)
+    physics = model_loader.physics(dynamics_kwargs)
     task = PlanarWalkerReward(move_speed=_RUN_SPEED, random=random, reward_kwargs=reward_kwargs)
     environment_kwargs = environment_kwargs or {}
-    return control.Environment(
-        physics, task, time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP,
-        **environment_kwargs)
+    return ContextualEnvironment(
+        physics, task, model_loader=model_loader, dynamics_kwargs=dynamics_kwargs,
+        dynamics_parameters=DYNAMICS_PARAMETERS,
+        time_limit=time_limit, control_timestep=_CONTROL_TIMESTEP, **environment_kwargs)
 
 
 def _make_model(dynamics_kwargs=None):
@@ -81,33 +100,39 @@ class PlanarWalkerReward(PlanarWalker):
             automatically (default).
         """
         super().__init__(move_speed, random=random)
-
-        default_reward_parameters = {
+        self.set_reward_kwargs(reward_kwargs)
+
+    def set_reward_kwargs(self, reward_kwargs=None):
+        """Resolves the reward parameters of the task from `reward_kwargs`."""
+        self.reward_kwargs = reward_kwargs
+        context = contexts.resolve_reward(self, reward_kwargs)
+        self.reward_parameters, self.speed_direction = context.reward_parameters, context.direction
+        self._reward_kernels = utils.compile_reward_parameters(self.reward_parameters)
+
+    def default_reward_parameters(self):
+        """Returns the reward parameters of the task when `reward_kwargs` is `None`."""
+        return {
             'horizontal_velocity': {
                 'sigmoid': 'linear',
-                'margin': move_speed / 2,
+                'margin': self._move_speed / 2,
                 'value_at_margin': 0.5
             },
         }
+
+    def resolve_reward_kwargs(self, reward_kwargs=None):
+        """Returns the reward parameters and the speed direction given by `reward_kwargs`."""
+        default_reward_parameters = self.default_reward_parameters()
         reward_kwargs_copy = copy.deepcopy(reward_kwargs)
-        self.reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
+        reward_parameters = utils.set_reward_parameters(default_reward_parameters, reward_kwargs_copy)
 
         # if margin is negative, change the speed direction
-        if self.reward_parameters['horizontal_velocity']['margin'] < 0:
-            self.reward_parameters['horizontal_velocity']['margin'] *= -1.0
-            self.speed_direction = -1.0
-        else:
-            self.speed_direction = 1.0
-
-        # manually overwrite the bounds
-        self.reward_parameters['horizontal_velocity']['bounds'] = [self.reward_parameters['horizontal_velocity']['margin'], float('inf')]
+        speed_direction = utils.set_direction(reward_parameters, 'horizontal_velocity')
+        return reward_parameters, speed_direction
 
     def get_reward(self, physics):
         """Returns a reward to the agent."""
 
-        standing = rewards.tolerance(physics.torso_height(),
-                                     bounds=(_STAND_HEIGHT, float('inf')),
-                                     margin=_STAND_HEIGHT / 2)
+        standing = _standing_kernel(physics.torso_height())
 
         upright = (1 + physics.torso_upright()) / 2
         stand_reward = (3*standing + upright) / 4
@@ -116,6 +141,42 @@ class PlanarWalkerReward(PlanarWalker):
             return stand_reward
 
         else:
-            move_reward = rewards.tolerance(self.speed_direction * physics.horizontal_velocity(),
-                                            **self.reward_parameters['horizontal_velocity'])
+            move_reward = self._reward_kernels['horizontal_velocity'](self.speed_direction * physics.horizontal_velocity())
             return stand_reward * (5 * move_reward + 1) / 6
+
+    def batch_reward(self, reward_kwargs, torso_height, torso_upright, horizontal_velocity):
+        """Returns the rewards of T states under K reward contexts.
+        Args:
+          reward_kwargs: A sequence of K `reward_kwargs` dicts.
+          torso_height: An array of shape [T] holding `physics.torso_height()`.
+          torso_upright: An array of shape [T] holding `physics.torso_upright()`.
+          horizontal_velocity: An array of shape [T] holding
+            `physics.horizontal_velocity()`.
+
+        Returns:
+          An array of shape [T, K], equal to `get_reward` under each context.
+        """
+        parameters, direction = zip(*map(self.resolve_reward_kwargs, reward_kwargs))
+
+        standing = utils.batch_tolerance(np.asarray(torso_height, dtype=np.float64)[:, None],
+                                         [{'bounds': (_STAND_HEIGHT, float('inf')),
+                                           'margin': _STAND_HEIGHT / 2}], scalar=True)[:, 0]
+
+        upright = (1 + np.asarray(torso_upright, dtype=np.float64)) / 2
+        stand_reward = ((3*standing + upright) / 4)[:, None]
+
+        if self._move_speed == 0:
+            return np.repeat(stand_reward, len(parameters), axis=1)
+
+        velocity = np.asarray(horizontal_velocity, dtype=np.float64)[:, None]
+        move_reward = utils.batch_tolerance(np.asarray(direction) * velocity,
+                                            [p['horizontal_velocity'] for p in parameters], scalar=True)
+        return stand_reward * (5 * move_reward + 1) / 6
+
+
+# Constructors of the tasks of `SUITE`, which build a task without its physics.
+TASKS = {
+    'stand': functools.partial(PlanarWalkerReward, move_speed=0),
+    'walk': functools.partial(PlanarWalkerReward, move_speed=_WALK_SPEED),
+    'run': functools.partial(PlanarWalkerReward, move_speed=_RUN_SPEED),
+}
@@ -0,0 +1,227 @@
+"""Asyncio interfaces of the environments of the suite.
+
+The methods of an `AsyncEnvironment` return awaitables and run the blocking
+call of the wrapped environment in a thread pool. MuJoCo releases the GIL
+while integrating the physics, so the steps of many environments overlap with
+each other and with the event loop, e.g. with the inference of a policy:
+
+```python
+envs = [suite.load_async('cheetah', 'run', {'dynamics_kwargs': {'length': l}}) for l in (0.4, 0.5, 0.6)]
+time_steps = await asyncio.gather(*(env.reset() for env in envs))
+time_steps = await asyncio.gather(*(env.step(a) for env, a in zip(envs, policy(time_steps))))
+```
+
+Calls on the same environment are queued when they are made, not when they
+are awaited, so they run one at a time in call order. The observations of
+their time steps are copied in the thread pool, since environments may reuse
+their observation arrays, e.g. with `reuse_observation`, which a queued step
+would overwrite before the previous one is awaited. An
+`AsyncProcessEnvironment` instead runs its environment in a worker process,
+for environments spending most of their step in Python.
+"""
+
+import asyncio
+import collections
+import multiprocessing
+import traceback
+
+import numpy as np
+
+
+class AsyncEnvironment:
+    """Runs the calls of an environment in a thread pool, one at a time."""
+
+    def __init__(self, env, executor=None):
+        """Initializes a new `AsyncEnvironment`.
+        Args:
+          env: The environment to wrap, e.g. a `ContextualEnvironment`.
+          executor: Optional `concurrent.futures.Executor` running the calls,
+            typically shared by many environments. Defaults to the default
+            executor of the event loop.
+        """
+        self._env = env
+        self._executor = executor
+        self._tail = None
+
+    @property
+    def env(self):
+        """The wrapped environment, which must not be used while calls are pending."""
+        return self._env
+
+    def action_spec(self):
+        return self._env.action_spec()
+
+    def observation_spec(self):
+        return self._env.observation_spec()
+
+    def reset(self):
+        """Returns an awaitable of the `TimeStep` of `env.reset()`."""
+        return self._call(_copy_time_step, self._env.reset)
+
+    def step(self, action):
+        """Returns an awaitable of the `TimeStep` of `env.step(action)`.
+
+        The action is copied, so its array may be reused once the call is made.
+        """
+        return self._call(_copy_time_step, self._env.step, np.array(action))
+
+    def set_context(self, reward_kwargs=None, dynamics_kwargs=None):
+        """Returns an awaitable completing once `env.set_context` returned."""
+        return self._call(self._env.set_context, reward_kwargs, dynamics_kwargs)
+
+    def close(self):
+        """Returns an awaitable closing the environment after the pending calls."""
+        return self._call(self._env.close)
+
+    def _call(self, function, *args):
+        loop = asyncio.get_running_loop()
+        previous = self._tail
+
+        async def run():
+            if previous is not None:
+                # The failure of a previous call is reported to its own caller.
+                await asyncio.wait([previous])
+            return await loop.run_in_executor(self._executor, function, *args)
+
+        self._tail = loop.create_task(run())
+        return self._tail
+
+
+def _copy_time_step(function, *args):
+    """Returns the `TimeStep` of `function(*args)` with a copy of its observation."""
+    time_step = function(*args)
+    observation = time_step.observation
+    if isinstance(observation, dict):
+        observation = type(observation)((name, np.array(value)) for name, value in observation.items())
+    else:
+        observation = np.array(observation)
+    return time_step._replace(observation=observation)
+
+
+def _process_worker(conn, domain_name, task_name, task_kwargs, environment_kwargs):
+    """Builds an environment and runs its methods on request of the parent."""
+    # Imported here such that the parent does not need the suite to unpickle.
+    from contextual_control_suite import suite
+
+    try:
+        env = suite.build_environment(domain_name, task_name, task_kwargs, environment_kwargs)
+        conn.send(('ok', (env.action_spec(), env.observation_spec())))
+    except Exception:  # pylint: disable=broad-except
+        conn.send(('error', traceback.format_exc()))
+        conn.close()
+        return
+
+    while True:
+        method, args = conn.recv()
+        try:
+            conn.send(('ok', getattr(env, method)(*args)))
+        except Exception:  # pylint: disable=broad-except
+            conn.send(('error', traceback.format_exc()))
+        if method == 'close':
+            break
+    conn.close()
+
+
+class AsyncProcessEnvironment:
+    """Runs an environment of the suite in a worker process.
+
+    Calls are sent to the worker as soon as they are made and their results are
+    read by the event loop when the pipe of the worker becomes readable, so no
+    thread is blocked while the worker steps.
+    """
+
+    def __init__(self, domain_name, task_name, task_kwargs=None, environment_kwargs=None,
+                 start_method=None):
+        """Initializes a new `AsyncProcessEnvironment` and builds its environment.
+        Args:
+          domain_name: A string containing the name of a domain.
+          task_name: A string containing the name of a task.
+          task_kwargs: Optional `dict` of keyword arguments for the task.
+          environment_kwargs: Optional `dict` specifying keyword arguments for the
+            environment.
+          start_method: Optional `multiprocessing` start method of the worker.
+
+        Raises:
+          RuntimeError: If the environment cannot be built.
+        """
+        mp_context = multiprocessing.get_context(start_method)
+        self._conn, child_conn = mp_context.Pipe()
+        self._process = mp_context.Process(
+            target=_process_worker,
+            args=(child_conn, domain_name, task_name, task_kwargs, environment_kwargs),
+            daemon=True)
+        self._process.start()
+        child_conn.close()
+        status, result = self._conn.recv()
+        if status == 'error':
+            self._process.join()
+            raise RuntimeError('The worker failed to build the environment:\n' + result)
+        self._action_spec, self._observation_spec = result
+        self._pending = collections.deque()
+        self._loop = None
+        self._closed = False
+
+    def action_spec(self):
+        return self._action_spec
+
+    def observation_spec(self):
+        return self._observation_spec
+
+    def reset(self):
+        """Returns an awaitable of the `TimeStep` of `env.reset()`."""
+        return self._call('reset')
+
+    def step(self, action):
+        """Returns an awaitable of the `TimeStep` of `env.step(action)`."""
+        return self._call('step', action)
+
+    def set_context(self, reward_kwargs=None, dynamics_kwargs=None):
+        """Returns an awaitable completing once `env.set_context` returned."""
+        return self._call('set_context', reward_kwargs, dynamics_kwargs)
+
+    def close(self):
+        """Returns an awaitable closing the environment and stopping the worker."""
+        future = self._call('close')
+        self._closed = True
+        return future
+
+    def _call(self, method, *args):
+        if self._closed:
+            raise RuntimeError('The environment has been closed.')
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+            loop.add_reader(self._conn.fileno(), self._receive)
+        elif self._loop is not loop:
+            raise RuntimeError('The environment is bound to another event loop.')
+        future = loop.create_future()
+        self._pending.append(future)
+        self._conn.send((method, args))
+        return future
+
+    def _receive(self):
+        while self._conn.poll():
+            try:
+                status, result = self._conn.recv()
+            except EOFError:
+                self._shutdown(RuntimeError('The worker exited unexpectedly.'))
+                return
+            future = self._pending.popleft()
+            if future.cancelled():
+                continue
+            if status == 'error':
+                future.set_exception(RuntimeError('The environment failed:\n' + result))
+            else:
+                future.set_result(result)
+        if self._closed and not self._pending:
+            self._shutdown()
+
+    def _shutdown(self, error=None):
+        self._closed = True
+        self._loop.remove_reader(self._conn.fileno())
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.cancelled():
+                future.set_exception(error)
+        self._conn.close()
+        self._process.join()
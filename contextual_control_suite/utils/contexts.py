@@ -0,0 +1,579 @@
+"""Context spaces of the tasks and vectorized samplers of contexts.
+
+A `ContextSchema` lists the numeric parameters of the context of a task: the
+margin and value at margin of every reward term, and the dynamics parameters
+understood by the model of the domain. Samplers return many contexts at once
+as a structured NumPy array with one float64 field per parameter, which is
+only turned into `reward_kwargs` and `dynamics_kwargs` when an environment
+needs them:
+
+```python
+schema = suite.context_schema('cheetah', 'run')
+samples = contexts.sobol(schema, {'reward.speed.margin': (-10, 10), 'dynamics.length': (0.3, 0.7)}, 1024)
+env.set_context(**schema.to_kwargs(samples[0]))
+```
+
+A `Context` is the resolved form of the `reward_kwargs` and `dynamics_kwargs`
+of a task. It is immutable and hashable, and contexts which are specified
+differently but mean the same compare equal and share a stable `digest`, on
+which caches, datasets and pools can be keyed:
+
+```python
+context = suite.resolve_context('cheetah', 'run', {'reward_kwargs': {'speed': {'margin': -10}}})
+assert context == env.context and context.direction == -1.0
+```
+"""
+
+import collections
+import itertools
+
+import numpy as np
+from dm_control.utils import rewards
+
+from contextual_control_suite.utils import models
+
+# A numeric context parameter, with its default value and valid closed range.
+Parameter = collections.namedtuple('Parameter', ['default', 'low', 'high'])
+
+# Sigmoids of `rewards.tolerance` accepting a value of 0 at the margin.
+_ZERO_VALUE_SIGMOIDS = ('cosine', 'linear', 'quadratic')
+
+# Open bounds of the value at margin, expressed as closed ranges.
+_ABOVE_ZERO = np.nextafter(0.0, 1.0)
+_BELOW_ONE = np.nextafter(1.0, 0.0)
+
+_REWARD_FIELDS = ('margin', 'value_at_margin')
+
+# Sigmoids of `rewards.tolerance`, in the order of their one-hot encoding.
+SIGMOIDS = ('gaussian', 'hyperbolic', 'long_tail', 'reciprocal', 'cosine', 'linear', 'quadratic', 'tanh_squared')
+
+# Features encoding a reward term, followed by the one-hot encoded sigmoid.
+# Infinite bounds are encoded as 0 with a finite flag of 0.
+_TERM_FEATURES = ('bounds.lower', 'bounds.upper', 'bounds.lower_finite', 'bounds.upper_finite',
+                  'margin', 'value_at_margin')
+
+# Keyword arguments of `rewards.tolerance` and their defaults, filled in by `Context`.
+_TOLERANCE_DEFAULTS = collections.OrderedDict([
+    ('bounds', (0.0, 0.0)), ('margin', 0.0), ('sigmoid', 'gaussian'),
+    ('value_at_margin', rewards._DEFAULT_VALUE_AT_MARGIN)])
+
+# Resolved contexts, keyed by the task and its unresolved kwargs.
+_CONTEXT_CACHE = models.ModelCache(maxsize=4096)
+
+
+def _directional_terms(task, reward_parameters):
+    """Returns the names of the reward terms of a task whose margin sets its direction."""
+    directional = []
+    for term in reward_parameters:
+        # A term is directional if the sign of its margin sets the direction.
+        _, backward = task.resolve_reward_kwargs({term: {'margin': -1.0}})
+        _, forward = task.resolve_reward_kwargs({term: {'margin': 1.0}})
+        if backward != forward:
+            directional.append(term)
+    return directional
+
+
+class ContextSchema:
+    """The numeric context parameters of a task, their defaults and valid ranges.
+
+    Parameters are named `reward.<term>.margin`, `reward.<term>.value_at_margin`
+    and `dynamics.<name>`. Non-numeric reward settings, such as the sigmoid or
+    the bounds of a term, are fixed by the schema and shared by all contexts.
+    The margin of a directional term, e.g. the speed of `cheetah`, may be
+    negative to reverse the direction.
+    """
+
+    def __init__(self, reward_parameters, dynamics_parameters=None, directional=()):
+        """Initializes a new `ContextSchema`.
+        Args:
+          reward_parameters: A `dict` of the resolved reward parameters of each
+            term, as returned by `resolve_reward_kwargs` of the task.
+          dynamics_parameters: Optional `dict` mapping the dynamics parameters of
+            the domain to a `Parameter`.
+          directional: Names of the reward terms whose margin sets a direction.
+        """
+        self._reward_parameters = {term: dict(parameters)
+                                   for term, parameters in reward_parameters.items()}
+        self._directional = frozenset(directional)
+        self._parameters = collections.OrderedDict()
+        for term, parameters in self._reward_parameters.items():
+            if term in self._directional:
+                # The bounds are overwritten according to the margin.
+                parameters.pop('bounds', None)
+                margin = Parameter(parameters['margin'], -np.inf, np.inf)
+            else:
+                margin = Parameter(parameters['margin'], 0.0, np.inf)
+            sigmoid = parameters.get('sigmoid', 'gaussian')
+            value_at_margin = Parameter(
+                parameters.get('value_at_margin', rewards._DEFAULT_VALUE_AT_MARGIN),
+                0.0 if sigmoid in _ZERO_VALUE_SIGMOIDS else _ABOVE_ZERO, _BELOW_ONE)
+            self._parameters['reward.{}.margin'.format(term)] = margin
+            self._parameters['reward.{}.value_at_margin'.format(term)] = value_at_margin
+        for name, parameter in sorted((dynamics_parameters or {}).items()):
+            self._parameters['dynamics.' + name] = Parameter(*parameter)
+        self._has_dynamics = bool(dynamics_parameters)
+        self._dtype = np.dtype([(name, np.float64) for name in self._parameters])
+
+        self._encoding_names = tuple(
+            'reward.{}.{}'.format(term, feature)
+            for term in self._reward_parameters
+            for feature in _TERM_FEATURES + tuple('sigmoid.' + sigmoid for sigmoid in SIGMOIDS)) + tuple(
+            name for name in self._parameters if name.startswith('dynamics.'))
+
+    @classmethod
+    def from_task(cls, task, dynamics_parameters=None, reward_kwargs=None):
+        """Returns the schema of a contextual task.
+
+        Args:
+          task: A task instance implementing `resolve_reward_kwargs`.
+          dynamics_parameters: Optional `dict` mapping the dynamics parameters of
+            the domain to a `Parameter`.
+          reward_kwargs: Optional `reward_kwargs` fixing the non-numeric reward
+            settings of the schema, e.g. `{'speed': {'sigmoid': 'gaussian'}}`.
+        """
+        resolved = task.resolve_reward_kwargs(reward_kwargs)
+        if isinstance(resolved, tuple):
+            reward_parameters, direction = resolved
+        else:
+            reward_parameters, direction = resolved, None
+
+        directional = [] if direction is None else _directional_terms(task, reward_parameters)
+        for term in directional:
+            reward_parameters[term]['margin'] *= direction
+        return cls(reward_parameters, dynamics_parameters, directional)
+
+    @property
+    def names(self):
+        return tuple(self._parameters)
+
+    @property
+    def parameters(self):
+        return self._parameters
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def encoding_names(self):
+        """Names of the features of `encode`, in order."""
+        return self._encoding_names
+
+    def encode(self, reward_parameters, dynamics_kwargs=None, direction=1.0):
+        """Returns a fixed-size numeric encoding of a resolved context.
+
+        Every reward term, in the order of the schema, is encoded by its bounds,
+        whether they are finite, its margin, its value at margin and its one-hot
+        encoded sigmoid, followed by the dynamics parameters in the order of the
+        schema. The margins of directional terms are multiplied by `direction`,
+        and missing dynamics parameters take their default value.
+
+        Args:
+          reward_parameters: A `dict` of the resolved reward parameters of each
+            term, e.g. `task.reward_parameters`.
+          dynamics_kwargs: Optional `dict` of dynamics parameters.
+          direction: The direction of the directional terms, -1.0 or 1.0.
+
+        Raises:
+          ValueError: If the reward terms or dynamics parameters differ from the
+            schema, or a sigmoid is unknown.
+
+        Returns:
+          A float64 array of size `len(encoding_names)`.
+        """
+        if set(reward_parameters) != set(self._reward_parameters):
+            raise ValueError('Expected the reward terms {}, got {}.'.format(
+                sorted(self._reward_parameters), sorted(reward_parameters)))
+        encoding = []
+        for term in self._reward_parameters:
+            parameters = reward_parameters[term]
+            lower, upper = parameters.get('bounds', (0.0, 0.0))
+            margin = parameters.get('margin', 0.0)
+            if term in self._directional:
+                margin *= direction
+            sigmoid = parameters.get('sigmoid', 'gaussian')
+            if sigmoid not in SIGMOIDS:
+                raise ValueError('Unknown sigmoid type {!r}.'.format(sigmoid))
+            encoding += [lower if np.isfinite(lower) else 0.0, upper if np.isfinite(upper) else 0.0,
+                         float(np.isfinite(lower)), float(np.isfinite(upper)), margin,
+                         parameters.get('value_at_margin', rewards._DEFAULT_VALUE_AT_MARGIN)]
+            encoding += [float(sigmoid == name) for name in SIGMOIDS]
+
+        dynamics_kwargs = dynamics_kwargs or {}
+        self._check_names('dynamics.' + name for name in dynamics_kwargs)
+        for name, parameter in self._parameters.items():
+            if name.startswith('dynamics.'):
+                encoding.append(dynamics_kwargs.get(name[len('dynamics.'):], parameter.default))
+        return np.array(encoding, dtype=np.float64)
+
+    def default(self, num_contexts=None):
+        """Returns the default context, or `num_contexts` copies of it."""
+        shape = () if num_contexts is None else (num_contexts,)
+        contexts = np.empty(shape, dtype=self._dtype)
+        for name, parameter in self._parameters.items():
+            contexts[name] = parameter.default
+        return contexts
+
+    def validate(self, contexts):
+        """Checks that `contexts` follow the schema.
+
+        Args:
+          contexts: A structured array with the `dtype` of the schema.
+
+        Raises:
+          ValueError: If the fields of `contexts` differ from the schema, or a
+            value is out of its range or not a number.
+        """
+        if contexts.dtype.names != self._dtype.names:
+            raise ValueError('Expected the fields {}, got {}.'.format(self.names, contexts.dtype.names))
+        for name, parameter in self._parameters.items():
+            values = contexts[name]
+            invalid = ~((parameter.low <= values) & (values <= parameter.high))
+            if np.any(invalid):
+                value = values[invalid].flat[0]
+                raise ValueError('{!r} must be in [{}, {}], got {}.'.format(
+                    name, parameter.low, parameter.high, value))
+
+    def from_kwargs(self, reward_kwargs=None, dynamics_kwargs=None):
+        """Returns the context given by `reward_kwargs` and `dynamics_kwargs`.
+
+        Raises:
+          ValueError: If a key is not a parameter of the schema, or a value is
+            out of its range.
+        """
+        context = self.default()
+        for term, parameters in (reward_kwargs or {}).items():
+            if not isinstance(parameters, dict):
+                raise ValueError('Reward parameters of {!r} must be a dict.'.format(term))
+            for key, value in parameters.items():
+                self._set(context, 'reward.{}.{}'.format(term, key), value)
+        for key, value in (dynamics_kwargs or {}).items():
+            self._set(context, 'dynamics.' + key, value)
+        self.validate(context)
+        return context
+
+    def to_kwargs(self, context):
+        """Returns a `dict` with the `reward_kwargs` and `dynamics_kwargs` of a context.
+
+        The result can be passed to `env.set_context`, or used as `task_kwargs`.
+        """
+        reward_kwargs = {}
+        for term, parameters in self._reward_parameters.items():
+            reward_kwargs[term] = dict(parameters, **{
+                key: float(context['reward.{}.{}'.format(term, key)]) for key in _REWARD_FIELDS})
+        kwargs = {'reward_kwargs': reward_kwargs}
+        if self._has_dynamics:
+            kwargs['dynamics_kwargs'] = {name[len('dynamics.'):]: float(context[name])
+                                         for name in self._parameters if name.startswith('dynamics.')}
+        return kwargs
+
+    def _set(self, context, name, value):
+        if name not in self._parameters:
+            raise ValueError('{!r} is not a numeric context parameter, expected one of {}. Other '
+                             'reward settings are fixed by the schema.'.format(name, self.names))
+        context[name] = value
+
+    def _check_names(self, names):
+        for name in names:
+            if name not in self._parameters:
+                raise ValueError('Unknown context parameter {!r}, expected one of {}.'.format(
+                    name, self.names))
+
+
+def _freeze_term(term, parameters):
+    unknown = set(parameters) - set(_TOLERANCE_DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown reward parameters {} of {!r}.'.format(sorted(unknown), term))
+    frozen = []
+    for name, default in _TOLERANCE_DEFAULTS.items():
+        value = parameters.get(name, default)
+        if name == 'bounds':
+            value = tuple(float(bound) for bound in value)
+        elif name != 'sigmoid':
+            value = float(value)
+        frozen.append((name, value))
+    return tuple(frozen)
+
+
+class Context:
+    """A resolved context of a task, immutable and hashable.
+
+    Contexts compare equal whenever they resolve to the same reward and
+    dynamics, whether the reward terms are given one by one or with `'ALL'`,
+    numbers as integers or floats, bounds as lists or tuples, or whether the
+    defaults of `rewards.tolerance` are omitted or spelled out: every reward
+    term holds all of its arguments. The direction of directional rewards is
+    kept apart from the margins, which are non-negative. Dynamics parameters
+    are kept as given: the declared defaults of the domains are rounded, so a
+    parameter set to its default still changes the model.
+
+    Tasks resolve their reward through `resolve_reward`, whose contexts have
+    no domain, task or dynamics until `with_dynamics` is called.
+    """
+
+    __slots__ = ('_domain_name', '_task_name', '_reward', '_direction', '_directional', '_dynamics',
+                 '_hash', '_digest')
+
+    def __init__(self, domain_name, task_name, reward_parameters, direction=None, directional=(),
+                 dynamics_kwargs=None):
+        """Initializes a new `Context`.
+        Args:
+          domain_name: A string containing the name of the domain.
+          task_name: A string containing the name of the task.
+          reward_parameters: A `dict` of the resolved reward parameters of each
+            term, as returned by `resolve_reward_kwargs` of the task.
+          direction: The direction returned by `resolve_reward_kwargs`, `None`
+            if the task has no directional reward.
+          directional: Names of the reward terms whose margin sets the direction.
+          dynamics_kwargs: Optional `dict` of dynamics parameters.
+
+        Raises:
+          ValueError: If a reward term has an argument unknown to `rewards.tolerance`.
+        """
+        dynamics = tuple(sorted((name, float(value)) for name, value in (dynamics_kwargs or {}).items()))
+        reward = tuple((term, _freeze_term(term, parameters))
+                       for term, parameters in sorted(reward_parameters.items()))
+        direction = None if direction is None else float(direction)
+        directional = tuple(sorted(directional))
+        values = (domain_name, task_name, reward, direction, directional, dynamics)
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_hash', hash(values))
+        object.__setattr__(self, '_digest', models.canonical_key(*values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Contexts are immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('Contexts are immutable.')
+
+    def __reduce__(self):
+        return (Context, (self._domain_name, self._task_name, self.reward_parameters, self._direction,
+                          self._directional, dict(self._dynamics)))
+
+    def __eq__(self, other):
+        if not isinstance(other, Context):
+            return NotImplemented
+        return self._hash == other._hash and self._values() == other._values()
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return 'Context({!r}, {!r}, reward_kwargs={!r}, dynamics_kwargs={!r})'.format(
+            self._domain_name, self._task_name, self.reward_kwargs, self.dynamics_kwargs)
+
+    @property
+    def domain_name(self):
+        return self._domain_name
+
+    @property
+    def task_name(self):
+        return self._task_name
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @property
+    def digest(self):
+        """A hex digest of the context, stable across processes and sessions."""
+        return self._digest
+
+    @property
+    def reward_parameters(self):
+        """A new `dict` of the resolved reward parameters of each term."""
+        return {term: {name: list(value) if name == 'bounds' else value for name, value in parameters}
+                for term, parameters in self._reward}
+
+    @property
+    def reward_kwargs(self):
+        """A new `dict` of `reward_kwargs` resolving to this context.
+
+        The margins of directional terms carry the direction as their sign.
+        """
+        reward_kwargs = self.reward_parameters
+        for term in self._directional:
+            # The bounds are overwritten according to the margin.
+            del reward_kwargs[term]['bounds']
+            reward_kwargs[term]['margin'] *= self._direction
+        return reward_kwargs
+
+    @property
+    def dynamics_kwargs(self):
+        """A new `dict` of the dynamics parameters of the context."""
+        return dict(self._dynamics)
+
+    def with_dynamics(self, domain_name, task_name, dynamics_kwargs=None):
+        """Returns the context with the same reward for a task under `dynamics_kwargs`."""
+        return Context(domain_name, task_name, self.reward_parameters, self._direction, self._directional,
+                       dynamics_kwargs)
+
+    def to_kwargs(self):
+        """Returns a `dict` with the `reward_kwargs` and `dynamics_kwargs` of the context.
+
+        The result can be passed to `env.set_context`, or used as `task_kwargs`.
+        """
+        return {'reward_kwargs': self.reward_kwargs, 'dynamics_kwargs': self.dynamics_kwargs}
+
+    def _values(self):
+        return (self._domain_name, self._task_name, self._reward, self._direction, self._directional,
+                self._dynamics)
+
+
+def resolve_reward(task, reward_kwargs=None):
+    """Returns the `Context` holding the reward of a task under `reward_kwargs`.
+
+    Rewards are cached by the class of the task, its default reward parameters
+    and the canonical form of `reward_kwargs`, such that `resolve_reward_kwargs`
+    only runs once per distinct reward in a process. The `reward_parameters` of
+    the context are new `dict`s, which tasks may keep.
+
+    Args:
+      task: A task instance implementing `default_reward_parameters` and
+        `resolve_reward_kwargs`.
+      reward_kwargs: Optional `dict` of reward parameters.
+    """
+    def resolve_fn():
+        resolved = task.resolve_reward_kwargs(reward_kwargs)
+        if isinstance(resolved, tuple):
+            reward_parameters, direction = resolved
+            directional = _directional_terms(task, reward_parameters)
+        else:
+            reward_parameters, direction, directional = resolved, None, ()
+        return Context(None, None, reward_parameters, direction, directional)
+
+    task_class = type(task)
+    key = models.canonical_key(task_class.__module__, task_class.__qualname__,
+                               task.default_reward_parameters(), reward_kwargs)
+    return _CONTEXT_CACHE.get_or_compile(key, resolve_fn)
+
+
+def resolve_context(task, domain_name, task_name, reward_kwargs=None, dynamics_kwargs=None):
+    """Returns the `Context` of a task under the given kwargs.
+
+    Contexts are cached by the canonical form of their kwargs, and their reward
+    is resolved by `resolve_reward`.
+
+    Args:
+      task: A task instance implementing `default_reward_parameters` and
+        `resolve_reward_kwargs`, it does not need a physics.
+      domain_name: A string containing the name of the domain.
+      task_name: A string containing the name of the task.
+      reward_kwargs: Optional `dict` of reward parameters.
+      dynamics_kwargs: Optional `dict` of dynamics parameters.
+    """
+    key = models.canonical_key(domain_name, task_name, reward_kwargs, dynamics_kwargs)
+    return _CONTEXT_CACHE.get_or_compile(
+        key, lambda: resolve_reward(task, reward_kwargs).with_dynamics(domain_name, task_name, dynamics_kwargs))
+
+
+def _random_state(random):
+    if not isinstance(random, np.random.RandomState):
+        random = np.random.RandomState(random)
+    return random
+
+
+def _ranges(schema, ranges):
+    schema._check_names(ranges)
+    names = list(ranges)
+    low, high = np.array([ranges[name] for name in names], dtype=np.float64).reshape(-1, 2).T
+    if np.any(low > high):
+        raise ValueError('Every range must satisfy low <= high, got {}.'.format(ranges))
+    return names, low, high
+
+
+def _fill(schema, names, values):
+    """Returns default contexts whose `names` fields are set to the columns of `values`."""
+    contexts = schema.default(len(values))
+    for i, name in enumerate(names):
+        contexts[name] = values[:, i]
+    schema.validate(contexts)
+    return contexts
+
+
+def uniform(schema, ranges, num_contexts, random=None):
+    """Returns contexts sampled uniformly within the given ranges.
+
+    Args:
+      schema: A `ContextSchema`.
+      ranges: A `dict` mapping parameter names to `(low, high)` pairs, the
+        other parameters keep their default.
+      num_contexts: Number of contexts to sample.
+      random: Optional, either a `numpy.random.RandomState` instance, an
+        integer seed or None.
+
+    Returns:
+      A structured array of shape `[num_contexts]` with the `dtype` of `schema`.
+    """
+    names, low, high = _ranges(schema, ranges)
+    values = _random_state(random).uniform(low, high, size=(num_contexts, len(names)))
+    return _fill(schema, names, values)
+
+
+def log_uniform(schema, ranges, num_contexts, random=None):
+    """Returns contexts whose logarithm is sampled uniformly within the given ranges.
+
+    Negative ranges are supported, in which case the logarithm of the absolute
+    value is uniform. A range must not contain 0. See `uniform` for the
+    arguments.
+    """
+    names, low, high = _ranges(schema, ranges)
+    sign = np.sign(low)
+    if np.any(sign == 0) or np.any(sign != np.sign(high)):
+        raise ValueError('Log-uniform ranges must not contain 0, got {}.'.format(ranges))
+    log_low, log_high = np.log(np.abs(low)), np.log(np.abs(high))
+    values = _random_state(random).uniform(np.minimum(log_low, log_high), np.maximum(log_low, log_high),
+                                           size=(num_contexts, len(names)))
+    return _fill(schema, names, sign * np.exp(values))
+
+
+def grid(schema, values):
+    """Returns the Cartesian product of the given parameter values.
+
+    Args:
+      schema: A `ContextSchema`.
+      values: A `dict` mapping parameter names to sequences of values, the
+        other parameters keep their default. The last parameter varies fastest.
+
+    Returns:
+      A structured array with one context per combination of values.
+    """
+    schema._check_names(values)
+    names = list(values)
+    axes = np.meshgrid(*(np.asarray(values[name], dtype=np.float64) for name in names), indexing='ij')
+    columns = np.stack([axis.ravel() for axis in axes], axis=-1) if names else np.zeros((1, 0))
+    return _fill(schema, names, columns)
+
+
+def sobol(schema, ranges, num_contexts, scramble=True, random=None):
+    """Returns contexts from a Sobol sequence scaled to the given ranges.
+
+    Sobol sequences cover the ranges more evenly than uniform samples, their
+    balance properties hold when `num_contexts` is a power of 2. See `uniform`
+    for the other arguments.
+    """
+    # Imported here since scipy is slow to import.
+    from scipy.stats import qmc
+
+    names, low, high = _ranges(schema, ranges)
+    sampler = qmc.Sobol(len(names), scramble=scramble, seed=_random_state(random).randint(2 ** 31 - 1))
+    return _fill(schema, names, low + sampler.random(num_contexts) * (high - low))
+
+
+def fixed(schema, contexts):
+    """Returns the given contexts as a structured array.
+
+    Args:
+      schema: A `ContextSchema`.
+      contexts: A sequence of `dict`s mapping parameter names to values, the
+        missing parameters keep their default.
+    """
+    contexts = list(contexts)
+    names = sorted(set(itertools.chain.from_iterable(contexts)))
+    schema._check_names(names)
+    result = schema.default(len(contexts))
+    for name in names:
+        result[name] = [context.get(name, schema.parameters[name].default) for context in contexts]
+    schema.validate(result)
+    return result
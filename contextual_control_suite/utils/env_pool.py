@@ -0,0 +1,194 @@
+"""A pool of built environments reused across episodes sharing a context.
+
+Training loops sampling a context per episode would otherwise build, run and
+discard one environment per episode. An `EnvironmentPool` keeps the idle
+environments keyed by their canonical `(domain, task, context)` and hands them
+out again, already reset, whenever the same context is requested:
+
+```python
+envs = env_pool.EnvironmentPool(max_size=32, max_bytes=2 ** 30)
+for task_kwargs in contexts:
+    with envs.borrow('cheetah', 'run', task_kwargs) as (env, time_step):
+        while not time_step.last():
+            time_step = env.step(policy(time_step))
+print(envs.stats())
+```
+"""
+
+import collections
+import contextlib
+import threading
+
+import numpy as np
+
+from contextual_control_suite.utils import models
+
+_DEFAULT_POOL_SIZE = 64
+
+
+def environment_nbytes(env):
+    """Returns the number of bytes allocated by MuJoCo for an environment."""
+    model, data = env.physics.model.ptr, env.physics.data.ptr
+    return model.nbuffer + data.nbuffer + data.narena
+
+
+class EnvironmentPool:
+    """A thread-safe LRU pool of idle environments keyed by their context."""
+
+    def __init__(self, max_size=_DEFAULT_POOL_SIZE, max_bytes=None, environment_kwargs=None):
+        """Initializes a new `EnvironmentPool`.
+        Args:
+          max_size: Maximum number of idle environments to keep. A size of 0
+            disables pooling.
+          max_bytes: Optional maximum number of bytes allocated by MuJoCo for the
+            idle environments, as returned by `environment_nbytes`.
+          environment_kwargs: Optional `dict` specifying keyword arguments for all
+            environments.
+        """
+        self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._environment_kwargs = environment_kwargs
+        # Idle environments in least recently released order, by `id`.
+        self._idle = collections.OrderedDict()
+        self._idle_by_key = collections.defaultdict(list)
+        self._checked_out = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def key(self, domain_name, task_name, task_kwargs=None, visualize_reward=False):
+        """Returns the key under which environments of a context are pooled.
+
+        The reward and dynamics kwargs are keyed by the digest of their resolved
+        `contexts.Context`, so equivalent contexts share their environments. The
+        `random` entry of `task_kwargs` is not part of the context.
+        """
+        # Imported here to avoid a circular import with the suite package.
+        from contextual_control_suite import suite
+
+        context = suite.resolve_context(domain_name, task_name, task_kwargs)
+        task_kwargs = {k: v for k, v in (task_kwargs or {}).items()
+                       if k not in ('random', 'reward_kwargs', 'dynamics_kwargs')}
+        return models.canonical_key(context.digest, task_kwargs, self._environment_kwargs, visualize_reward)
+
+    def checkout(self, domain_name, task_name, task_kwargs=None, visualize_reward=False):
+        """Returns a reset environment of the given context, reusing an idle one if any.
+
+        Args:
+          domain_name: A string containing the name of a domain.
+          task_name: A string containing the name of a task.
+          task_kwargs: Optional `dict` of keyword arguments for the task. If it
+            specifies `random`, a reused environment is reseeded with it.
+          visualize_reward: Optional `bool`, see `suite.load`.
+
+        Raises:
+          ValueError: If the domain or task doesn't exist.
+
+        Returns:
+          A tuple of the environment and the `TimeStep` returned by its `reset`.
+          The environment must be given back with `release`.
+        """
+        # Imported here to avoid a circular import with the suite package.
+        from contextual_control_suite import suite
+
+        key = self.key(domain_name, task_name, task_kwargs, visualize_reward)
+        with self._lock:
+            env = None
+            if key in self._idle_by_key:
+                env = self._pop_idle(key, self._idle_by_key[key][-1])
+                self._hits += 1
+            else:
+                self._misses += 1
+
+        if env is None:
+            env = suite.build_environment(domain_name, task_name, task_kwargs,
+                                          self._environment_kwargs, visualize_reward)
+        else:
+            random = (task_kwargs or {}).get('random')
+            if random is not None:
+                env.task._random = (random if isinstance(random, np.random.RandomState)
+                                    else np.random.RandomState(random))
+        time_step = env.reset()
+
+        with self._lock:
+            self._checked_out[id(env)] = key
+        return env, time_step
+
+    def release(self, env):
+        """Gives back an environment obtained from `checkout`.
+
+        Raises:
+          ValueError: If the environment is not checked out from this pool.
+        """
+        with self._lock:
+            key = self._checked_out.pop(id(env), None)
+            if key is None:
+                raise ValueError('The environment is not checked out from this pool.')
+            nbytes = environment_nbytes(env)
+            self._idle[id(env)] = (key, env, nbytes)
+            self._idle_by_key[key].append(env)
+            self._nbytes += nbytes
+            self._evict()
+
+    @contextlib.contextmanager
+    def borrow(self, domain_name, task_name, task_kwargs=None, visualize_reward=False):
+        """A context manager around `checkout` and `release`."""
+        env, time_step = self.checkout(domain_name, task_name, task_kwargs, visualize_reward)
+        try:
+            yield env, time_step
+        finally:
+            self.release(env)
+
+    def resize(self, max_size=None, max_bytes=None):
+        """Changes the bounds of the pool, evicting the oldest environments if needed.
+
+        `max_size` is kept if `None`, while a `max_bytes` of `None` removes the
+        memory bound.
+        """
+        with self._lock:
+            if max_size is not None:
+                self._max_size = max_size
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Closes all idle environments and resets the statistics."""
+        with self._lock:
+            for _, env, _ in self._idle.values():
+                env.close()
+            self._idle.clear()
+            self._idle_by_key.clear()
+            self._nbytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def stats(self):
+        """Returns a `dict` with the hit, miss and eviction counts of the pool."""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'idle': len(self._idle),
+                'checked_out': len(self._checked_out),
+                'idle_bytes': self._nbytes,
+                'max_size': self._max_size,
+                'max_bytes': self._max_bytes,
+            }
+
+    def _evict(self):
+        while self._idle and (len(self._idle) > max(self._max_size, 0) or
+                              (self._max_bytes is not None and self._nbytes > self._max_bytes)):
+            key, env, _ = next(iter(self._idle.values()))
+            self._pop_idle(key, env).close()
+            self._evictions += 1
+
+    def _pop_idle(self, key, env):
+        _, _, nbytes = self._idle.pop(id(env))
+        self._nbytes -= nbytes
+        key_envs = self._idle_by_key[key]
+        key_envs.remove(env)
+        if not key_envs:
+            del self._idle_by_key[key]
+        return env
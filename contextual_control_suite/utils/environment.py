@@ -0,0 +1,819 @@
+"""Control environments whose context can be changed in place."""
+
+import collections
+import copy
+import functools
+import time
+
+import dm_env
+import mujoco
+from dm_env import specs
+import numpy as np
+from dm_control.mujoco.wrapper.mjbindings import mjlib
+from dm_control.rl import control
+
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import initial_states as initial_states_lib
+from contextual_control_suite.utils import profiling
+from contextual_control_suite.utils import rendering
+
+# Physics state saved in snapshots: time, positions, velocities, activations,
+# controls, applied forces, mocap poses, user data and warm-start accelerations.
+_PHYSICS_STATE = mujoco.mjtState.mjSTATE_INTEGRATION
+
+# Attributes of the tasks whose reward depends on a direction of motion.
+_DIRECTION_ATTRIBUTES = ('speed_direction', 'spin_direction')
+
+# Snapshots start with the step count, whether the episode ended, the reward
+# direction and the position, cached gaussian flag and cached gaussian of the
+# Mersenne Twister of the task, followed by its 624 keys.
+_HEADER_SIZE = 6
+_RNG_KEYS = 624
+# The physics state follows, see `ContextualEnvironment.physics_state`.
+_STATE_OFFSET = _HEADER_SIZE + _RNG_KEYS
+
+_SnapshotLayout = collections.namedtuple('_SnapshotLayout', ['size', 'physics', 'fields'])
+
+# Position of an observation field in flat observations, the field is stored
+# in C order in `flat[slice]` and has the given shape in the task observation.
+ObservationField = collections.namedtuple('ObservationField', ['slice', 'shape'])
+
+# Key of the context encoding in observations augmented with the context.
+CONTEXT_OBSERVATION_KEY = 'context'
+
+
+def _unchecked_step(physics):
+    """Returns a callable advancing `physics` like `Physics.step`, without checking its state."""
+    if physics.legacy_step:
+        return physics._step_with_up_to_date_position_velocity  # pylint: disable=protected-access
+    return functools.partial(mujoco.mj_step, physics.model.ptr, physics.data.ptr)
+
+
+def _control_step(physics, task, action, n_sub_steps, step_count, step_limit, observe, profiler=None,
+                  step_physics=None):
+    """Runs control step `step_count` of a task, as in `control.Environment.step`.
+
+    Args:
+      physics: The `Physics` of the task.
+      task: The task of the episode.
+      action: The action of the step.
+      n_sub_steps: Number of physics steps per control step.
+      step_count: Number of control steps of the episode, including this one.
+      step_limit: Number of control steps after which the episode ends.
+      observe: A callable without arguments returning the observation.
+      profiler: Optional `profiling.StepProfiler` recording the duration of
+        the phases of the step.
+      step_physics: Optional callable advancing the physics by a number of
+        steps, `physics.step` by default.
+
+    Returns:
+      A tuple of the reward, the observation and the discount of the step,
+      which is `None` unless the episode ends.
+    """
+    if step_physics is None:
+        step_physics = physics.step
+    if profiler is None:
+        task.before_step(action, physics)
+        step_physics(n_sub_steps)
+        task.after_step(physics)
+        reward = task.get_reward(physics)
+        observation = observe()
+    else:
+        clock = time.perf_counter_ns
+        t0 = clock()
+        task.before_step(action, physics)
+        t1 = clock()
+        step_physics(n_sub_steps)
+        t2 = clock()
+        task.after_step(physics)
+        t3 = clock()
+        reward = task.get_reward(physics)
+        t4 = clock()
+        observation = observe()
+        t5 = clock()
+        profiler.record_step(t0, t1, t2, t3, t4, t5)
+
+    if step_count >= step_limit:
+        discount = 1.0
+    else:
+        discount = task.get_termination(physics)
+    return reward, observation, discount
+
+
+class ContextualEnvironment(control.Environment):
+    """A `control.Environment` supporting in-place changes of its context."""
+
+    def __init__(self, physics, task, model_loader=None, dynamics_kwargs=None, dynamics_parameters=None,
+                 flat_observation=False, reuse_observation=False, context_observation=False, initial_states=None,
+                 **kwargs):
+        """Initializes a new `ContextualEnvironment`.
+        Args:
+          physics: Instance of `Physics`, built by `model_loader` if provided.
+          task: Instance of a contextual `Task` implementing `set_reward_kwargs`.
+          model_loader: Optional `models.ModelLoader` used to build `physics`. If
+            `None`, the dynamics context of the environment cannot be changed.
+          dynamics_kwargs: Optional `dict` of the dynamics parameters `physics` was
+            built with.
+          dynamics_parameters: Optional `dict` mapping the dynamics parameters of
+            the domain to a `contexts.Parameter`, used by `context_schema`.
+          flat_observation: If True, observations are flattened into a single
+            float64 array under the key `'observations'`, laid out as described
+            by `observation_layout`.
+          reuse_observation: If True, flat observations are instead written into
+            a single preallocated float32 array, which is overwritten on every
+            call to `reset` and `step`. Requires `flat_observation`.
+          context_observation: If True, `context_encoding` is added to the
+            observations under the key `'context'`. It is only recomputed when
+            the context changes.
+          initial_states: Optional number of initial states sampled once per
+            dynamics context into an `initial_states.InitialStateBank`, from
+            which `reset` restores its states instead of calling
+            `initialize_episode`. Banks are shared by all environments of the
+            process, see `initial_states.get_bank`.
+          **kwargs: Keyword arguments forwarded to `control.Environment`.
+        """
+        if reuse_observation and not flat_observation:
+            raise ValueError('`reuse_observation` requires `flat_observation`.')
+        super().__init__(physics, task, flat_observation=flat_observation, **kwargs)
+        self._reuse_observation = reuse_observation
+        self._model_loader = model_loader
+        self._dynamics_kwargs = dynamics_kwargs
+        self._dynamics_fields = None
+        self._step_n_buffers = None
+        self._snapshot_layout = None
+        self._rng_keys = np.zeros(_RNG_KEYS, dtype=np.uint32)
+        self._profiler = None
+        self._observation_layout = None
+        self._flat_buffer = None
+        self._dynamics_parameters = dynamics_parameters
+        self._context_observation = context_observation
+        self._context_schema = None
+        self._context_encoding = None
+        self._context = None
+        self._initial_states = initial_states
+        self._initial_state_bank = None
+
+    @property
+    def reward_parameters(self):
+        return self._task.reward_parameters
+
+    @property
+    def dynamics_kwargs(self):
+        return self._dynamics_kwargs
+
+    @property
+    def model_loader(self):
+        """The `models.ModelLoader` which built the physics, or `None`."""
+        return self._model_loader
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @property
+    def context_schema(self):
+        """The `contexts.ContextSchema` of the task."""
+        if self._context_schema is None:
+            self._context_schema = contexts.ContextSchema.from_task(self._task, self._dynamics_parameters)
+        return self._context_schema
+
+    @property
+    def context(self):
+        """The current `contexts.Context` of the environment, resolved once per context."""
+        if self._context is None:
+            domain_name = task_name = None
+            if self._model_loader is not None:
+                domain_name, task_name = self._model_loader.domain_name, self._model_loader.task_name
+            self._context = contexts.resolve_context(
+                self._task, domain_name, task_name, self._task.reward_kwargs, self._dynamics_kwargs)
+        return self._context
+
+    @property
+    def context_encoding(self):
+        """The numeric encoding of the current context, see `contexts.ContextSchema.encode`.
+
+        The read-only array is computed once per context.
+        """
+        if self._context_encoding is None:
+            self._context_encoding = self.encode_context(self._task.reward_kwargs, self._dynamics_kwargs)
+            self._context_encoding.flags.writeable = False
+        return self._context_encoding
+
+    def encode_context(self, reward_kwargs=None, dynamics_kwargs=None):
+        """Returns the numeric encoding of a context of the task, without applying it."""
+        resolved = self._task.resolve_reward_kwargs(reward_kwargs)
+        if isinstance(resolved, tuple):
+            reward_parameters, direction = resolved
+        else:
+            reward_parameters, direction = resolved, 1.0
+        return self.context_schema.encode(reward_parameters, dynamics_kwargs, direction)
+
+    @property
+    def observation_layout(self):
+        """An `OrderedDict` mapping every field of the task observation to its `ObservationField`.
+
+        Fields are stored one after the other in the order of the observation of
+        the task, e.g. `flat[layout['velocity'].slice]` holds the velocity when
+        `flat_observation` is True. The context encoding comes last if
+        `context_observation` is True.
+        """
+        return self._get_observation_layout()
+
+    def reset(self):
+        """Starts a new episode and returns the first `TimeStep`."""
+        self._reset_next_step = False
+        self._step_count = 0
+        bank = self._get_initial_state_bank()
+        if bank is None:
+            with self._physics.reset_context():
+                self._task.initialize_episode(self._physics)
+        else:
+            self._set_physics_state(self._physics, bank.draw(self._task.random))
+
+        observation = self._get_observation()
+
+        return dm_env.TimeStep(
+            step_type=dm_env.StepType.FIRST,
+            reward=None,
+            discount=None,
+            observation=observation)
+
+    def step(self, action):
+        """Updates the environment using the action and returns a `TimeStep`."""
+        return self._step(action)
+
+    def _step(self, action, profiler=None):
+        if self._reset_next_step:
+            return self.reset()
+
+        self._step_count += 1
+        reward, observation, discount = _control_step(
+            self._physics, self._task, action, self._n_sub_steps, self._step_count, self._step_limit,
+            self._get_observation, profiler)
+
+        if discount is not None:
+            self._reset_next_step = True
+            return dm_env.TimeStep(dm_env.StepType.LAST, reward, discount, observation)
+        return dm_env.TimeStep(dm_env.StepType.MID, reward, 1.0, observation)
+
+    def observation_spec(self):
+        """Returns the observation specification of the environment."""
+        if not self._flat_observation:
+            spec = collections.OrderedDict(super().observation_spec())
+            if self._context_observation:
+                spec[CONTEXT_OBSERVATION_KEY] = specs.Array(
+                    shape=self.context_encoding.shape, dtype=np.float64, name=CONTEXT_OBSERVATION_KEY)
+            return spec
+        flat = self._get_flat_buffers()[0]
+        return collections.OrderedDict([(control.FLAT_OBSERVATION_KEY, specs.Array(
+            shape=flat.shape, dtype=flat.dtype, name=control.FLAT_OBSERVATION_KEY))])
+
+    def set_context(self, reward_kwargs=None, dynamics_kwargs=None):
+        """Changes the reward and/or dynamics context of the environment.
+
+        Reward parameters take effect immediately. Dynamics parameters are applied
+        by overwriting the affected fields of the compiled model, so the `Physics`
+        is not rebuilt. The first time a dynamics context is seen its model is
+        compiled once into the shared model cache, afterwards switching to it only
+        copies a handful of arrays. Pass an empty `dict` to restore the default
+        dynamics. The change is typically followed by a call to `reset`.
+
+        Args:
+          reward_kwargs: Optional `dict` of reward parameters, interpreted the same
+            way as when constructing the task. `None` keeps the current ones.
+          dynamics_kwargs: Optional `dict` of dynamics parameters. `None` keeps
+            the current ones.
+
+        Raises:
+          ValueError: If dynamics parameters are given for a domain without
+            dynamics contexts.
+        """
+        if reward_kwargs is not None:
+            self._task.set_reward_kwargs(reward_kwargs)
+            self._context_encoding = None
+            self._context = None
+
+        if dynamics_kwargs is not None:
+            if self._model_loader is None:
+                raise ValueError('This environment does not support dynamics contexts.')
+            if self._dynamics_fields is None:
+                self._dynamics_fields = self._model_loader.context_fields(self._dynamics_kwargs)
+            self._dynamics_fields = self._model_loader.apply(
+                self._physics.model, dynamics_kwargs, self._dynamics_fields)
+            self._dynamics_kwargs = dynamics_kwargs
+            self._context_encoding = None
+            self._context = None
+            self._initial_state_bank = None
+            self._physics.forward()
+
+        if self._context_observation and self._flat_buffer is not None:
+            self._write_flat_context()
+
+    def step_n(self, actions):
+        """Advances the environment by up to K control steps in a single call.
+
+        Equivalent to calling `step` with each row of `actions` in turn, stopping
+        after the step that ends the episode. If the previous episode already
+        ended, the first step resets the environment instead, in which case its
+        step type is `FIRST`, its reward 0, its discount 1 and its action is
+        ignored. The results are written into preallocated arrays, which are
+        overwritten on every call.
+
+        Unlike `step`, the physics state is checked once for all the steps of the
+        call and the observations are written directly into the stacked arrays,
+        so a `PhysicsError` is only raised at the end of the call.
+
+        Args:
+          actions: An array of shape `[K, ...]` holding one action per step.
+
+        Returns:
+          A `TimeStep` whose step type, reward, discount and observations are
+          stacked arrays of length `n <= K`, the number of steps taken.
+        """
+        num_steps = len(actions)
+        step_type, reward, discount, observation, fields, context = self._get_step_n_buffers(num_steps)
+        physics, task = self._physics, self._task
+        n_sub_steps, step_limit = self._n_sub_steps, self._step_limit
+
+        n = 0
+        if self._reset_next_step and num_steps:
+            time_step = self.reset()
+            for name, value in time_step.observation.items():
+                observation[name][0] = value
+            step_type[0] = dm_env.StepType.FIRST
+            reward[0] = 0.0
+            discount[0] = 1.0
+            n = 1
+        first = n
+        if context is not None:
+            context[first:num_steps] = self.context_encoding
+
+        def observe():
+            for name, value in task.get_observation(physics).items():
+                fields[name][n] = value
+
+        step_physics = _unchecked_step(physics)
+        step_discount = None
+        # An episode only starts at the first step, so no reset happens within
+        # the check and the warnings of the physics only grow.
+        with physics.check_invalid_state():
+            while n < num_steps:
+                self._step_count += 1
+                reward[n], _, step_discount = _control_step(
+                    physics, task, actions[n], n_sub_steps, self._step_count, step_limit, observe,
+                    step_physics=step_physics)
+                n += 1
+                if step_discount is not None:
+                    self._reset_next_step = True
+                    break
+
+        step_type[first:n] = dm_env.StepType.MID
+        discount[first:n] = 1.0
+        if step_discount is not None:
+            step_type[n - 1] = dm_env.StepType.LAST
+            discount[n - 1] = step_discount
+
+        return dm_env.TimeStep(
+            step_type=step_type[:n], reward=reward[:n], discount=discount[:n],
+            observation=collections.OrderedDict((name, value[:n]) for name, value in observation.items()))
+
+    def enable_profiling(self, profiler=None):
+        """Starts timing the phases of every call to `step`.
+
+        Profiling replaces `step` of this instance by an instrumented copy, so a
+        disabled profiler costs nothing. `step_n` is not instrumented.
+
+        Args:
+          profiler: Optional `profiling.StepProfiler` to record into, e.g. to
+            aggregate several environments. A new one is created by default.
+
+        Returns:
+          The `profiling.StepProfiler` recording the steps.
+        """
+        self._profiler = profiling.StepProfiler() if profiler is None else profiler
+        self.step = self._profiled_step
+        return self._profiler
+
+    def disable_profiling(self):
+        """Stops timing the steps, the recorded timings remain in `profiler`."""
+        self.__dict__.pop('step', None)
+
+    def _profiled_step(self, action):
+        """`step`, recording the duration of its phases."""
+        return self._step(action, self._profiler)
+
+    @property
+    def snapshot_size(self):
+        """The number of elements of the snapshots of this environment."""
+        return _STATE_OFFSET + self._get_snapshot_layout().size
+
+    @property
+    def physics_state_size(self):
+        """The number of elements of the physics states of this environment."""
+        return self._get_snapshot_layout().size
+
+    @property
+    def initial_state_bank(self):
+        """The `initial_states.InitialStateBank` resets are drawn from, if any."""
+        return self._initial_state_bank
+
+    def set_initial_state_bank(self, bank):
+        """Makes `reset` restore initial states drawn from a bank, or `None` to stop.
+
+        The index of the state is drawn from the random number generator of the
+        task, so episodes are reproducible from its seed. The bank is dropped when
+        the dynamics context changes, unless the environment was built with
+        `initial_states`, in which case the bank of the new context is used.
+
+        Raises:
+          ValueError: If the bank was sampled for another task or dynamics context.
+        """
+        if bank is not None:
+            key = self.initial_state_key()
+            if bank.key != key or bank.state_size != self.physics_state_size:
+                raise ValueError('The bank was sampled for another task or dynamics context.')
+        self._initial_state_bank = bank
+
+    def initial_state_key(self):
+        """Returns the key of the task and dynamics context identifying its initial states."""
+        if self._model_loader is None:
+            return None
+        return self._model_loader.key(self._dynamics_kwargs)
+
+    def physics_state(self, out=None):
+        """Returns the physics state and the model fields randomized by the task as a flat array.
+
+        This is the part of a snapshot written by `initialize_episode`, i.e. an
+        initial state of an `initial_states.InitialStateBank` when taken right
+        after `reset`.
+
+        Args:
+          out: Optional float64 array of size `physics_state_size` to write into.
+
+        Returns:
+          A float64 array of size `physics_state_size`.
+        """
+        layout = self._get_snapshot_layout()
+        if out is None:
+            out = np.empty(layout.size, dtype=np.float64)
+        elif out.shape != (layout.size,) or out.dtype != np.float64:
+            raise ValueError('Expected a float64 array of shape ({},), got {} {}.'.format(
+                layout.size, out.dtype, out.shape))
+        self._get_physics_state(self._physics, out)
+        return out
+
+    def set_physics_state(self, state):
+        """Restores a physics state returned by `physics_state`."""
+        layout = self._get_snapshot_layout()
+        if state.shape != (layout.size,):
+            raise ValueError('Expected a physics state of shape ({},), got {}.'.format(
+                layout.size, state.shape))
+        self._set_physics_state(self._physics, state)
+
+    def snapshot(self, out=None):
+        """Returns the state of the physics and of the task as a flat array.
+
+        The snapshot holds the physics state, the state of the random number
+        generator of the task, the step counter, the direction of directional
+        rewards and the model fields randomized by the task at every episode.
+        Restoring it with `restore` makes the environment continue exactly as it
+        would have from the time of the snapshot. The context of the environment
+        is not part of the snapshot, snapshots should be restored under the
+        context they were taken in.
+
+        Args:
+          out: Optional float64 array of size `snapshot_size` to write into.
+
+        Returns:
+          A float64 array of size `snapshot_size`.
+        """
+        size = self.snapshot_size
+        if out is None:
+            out = np.empty(size, dtype=np.float64)
+        elif out.shape != (size,) or out.dtype != np.float64:
+            raise ValueError('Expected a float64 array of shape ({},), got {} {}.'.format(
+                size, out.dtype, out.shape))
+
+        _, keys, position, has_gauss, cached_gaussian = self._task.random.get_state()
+        direction = np.nan
+        for name in _DIRECTION_ATTRIBUTES:
+            direction = getattr(self._task, name, direction)
+        out[:_HEADER_SIZE] = (self._step_count, self._reset_next_step, direction,
+                              position, has_gauss, cached_gaussian)
+        out[_HEADER_SIZE:_STATE_OFFSET] = keys
+        self._get_physics_state(self._physics, out[_STATE_OFFSET:])
+        return out
+
+    def restore(self, snapshot):
+        """Restores a snapshot returned by `snapshot`, without allocating arrays."""
+        size = self.snapshot_size
+        if snapshot.shape != (size,):
+            raise ValueError('Expected a snapshot of shape ({},), got {}.'.format(size, snapshot.shape))
+
+        self._step_count = int(snapshot[0])
+        self._reset_next_step = bool(snapshot[1])
+        for name in _DIRECTION_ATTRIBUTES:
+            if hasattr(self._task, name):
+                setattr(self._task, name, float(snapshot[2]))
+        np.copyto(self._rng_keys, snapshot[_HEADER_SIZE:_STATE_OFFSET], casting='unsafe')
+        self._task.random.set_state(('MT19937', self._rng_keys, int(snapshot[3]),
+                                     int(snapshot[4]), float(snapshot[5])))
+        self._set_physics_state(self._physics, snapshot[_STATE_OFFSET:])
+
+    def _get_initial_state_bank(self):
+        if self._initial_state_bank is None and self._initial_states:
+            self._initial_state_bank = initial_states_lib.get_bank(self, self._initial_states)
+        return self._initial_state_bank
+
+    def _get_physics_state(self, physics, out):
+        layout = self._get_snapshot_layout()
+        model, data = physics.model.ptr, physics.data.ptr
+        mujoco.mj_getState(model, data, out[layout.physics], _PHYSICS_STATE)
+        for name, index in layout.fields:
+            out[index] = getattr(model, name).ravel()
+
+    def _set_physics_state(self, physics, state):
+        layout = self._get_snapshot_layout()
+        model, data = physics.model.ptr, physics.data.ptr
+        mujoco.mj_setState(model, data, state[layout.physics], _PHYSICS_STATE)
+        for name, index in layout.fields:
+            np.copyto(getattr(model, name).reshape(-1), state[index], casting='unsafe')
+            if name == 'hfield_data' and physics._contexts:
+                # Height fields are re-uploaded to the rendering context.
+                with physics.contexts.gl.make_current() as ctx:
+                    for hfield_id in range(model.nhfield):
+                        ctx.call(mjlib.mjr_uploadHField, physics.model.ptr,
+                                 physics.contexts.mujoco.ptr, hfield_id)
+        physics.forward()
+
+    def _get_snapshot_layout(self):
+        """Returns the layout of the physics state, which follows the header in snapshots."""
+        if self._snapshot_layout is None:
+            model = self._physics.model.ptr
+            physics = slice(0, mujoco.mj_stateSize(model, _PHYSICS_STATE))
+            offset = physics.stop
+            fields = []
+            for name in getattr(self._task, 'episode_model_fields', ()):
+                size = getattr(model, name).size
+                fields.append((name, slice(offset, offset + size)))
+                offset += size
+            self._snapshot_layout = _SnapshotLayout(offset, physics, tuple(fields))
+        return self._snapshot_layout
+
+    def _get_observation_layout(self):
+        if self._observation_layout is None:
+            layout = collections.OrderedDict()
+            offset = 0
+            for name, value in self._task.get_observation(self._physics).items():
+                shape = np.shape(value)
+                size = int(np.prod(shape))
+                layout[name] = ObservationField(slice(offset, offset + size), shape)
+                offset += size
+            if self._context_observation:
+                size = self.context_encoding.size
+                layout[CONTEXT_OBSERVATION_KEY] = ObservationField(slice(offset, offset + size), (size,))
+            self._observation_layout = layout
+        return self._observation_layout
+
+    def _get_flat_buffers(self):
+        """Returns the flat observation array and a view of it per field."""
+        if self._flat_buffer is None:
+            layout = self._get_observation_layout()
+            size = sum(field.slice.stop - field.slice.start for field in layout.values())
+            flat = np.zeros(size, dtype=np.float32 if self._reuse_observation else np.float64)
+            # The context is only written when it changes.
+            views = tuple((name, flat[field.slice].reshape(field.shape)) for name, field in layout.items()
+                          if name != CONTEXT_OBSERVATION_KEY)
+            self._flat_buffer = (flat, views, collections.OrderedDict([(control.FLAT_OBSERVATION_KEY, flat)]))
+            if self._context_observation:
+                self._write_flat_context()
+        return self._flat_buffer
+
+    def _write_flat_context(self):
+        flat = self._flat_buffer[0]
+        flat[self._get_observation_layout()[CONTEXT_OBSERVATION_KEY].slice] = self.context_encoding
+
+    def _get_observation(self):
+        """Returns the observation of the task, flattened and augmented as configured."""
+        observation = self._task.get_observation(self._physics)
+        if self._flat_observation:
+            return self._write_flat_observation(observation)
+        if self._context_observation:
+            observation[CONTEXT_OBSERVATION_KEY] = self.context_encoding
+        return observation
+
+    def _write_flat_observation(self, observation):
+        """Copies the fields of a task observation into the flat observation array."""
+        flat, views, flat_observation = self._get_flat_buffers()
+        for name, view in views:
+            view[...] = observation[name]
+        if self._reuse_observation:
+            return flat_observation
+        return collections.OrderedDict([(control.FLAT_OBSERVATION_KEY, flat.copy())])
+
+    def _get_step_n_buffers(self, num_steps):
+        """Returns the arrays written by `step_n`, grown to hold `num_steps` steps.
+
+        Besides the stacked step types, rewards, discounts and observations, a
+        view of the stacked observations is returned per field of the task
+        observation, and one of the context encoding if it is observed.
+        """
+        if self._step_n_buffers is None or len(self._step_n_buffers[0]) < num_steps:
+            observation = collections.OrderedDict(
+                (name, np.zeros((num_steps,) + spec.shape, dtype=spec.dtype))
+                for name, spec in self.observation_spec().items())
+            if self._flat_observation:
+                flat = observation[control.FLAT_OBSERVATION_KEY]
+                views = {name: flat[:, field.slice].reshape((num_steps,) + field.shape)
+                         for name, field in self._get_observation_layout().items()}
+            else:
+                views = dict(observation)
+            context = views.pop(CONTEXT_OBSERVATION_KEY, None)
+            self._step_n_buffers = (
+                np.zeros(num_steps, dtype=np.int8),
+                np.zeros(num_steps, dtype=np.float64),
+                np.zeros(num_steps, dtype=np.float64),
+                observation, views, context)
+        return self._step_n_buffers
+
+
+class BatchEnvironment:
+    """A batch of environments sharing a single compiled model.
+
+    Every member owns its own `MjData` and task instance, while the `MjModel` of
+    the wrapped environment is shared by all of them. Members are stepped in a
+    single call and the results are written into preallocated stacked arrays,
+    which are overwritten on every call. Members whose episode ended are reset
+    on the following call to `step`, in which case their step type is `FIRST`,
+    their reward 0 and their discount 1.
+
+    With `render_kwargs`, every member is rendered after being reset or
+    stepped into the `frames` array of shape `[num_envs, height, width, 3]`.
+    """
+
+    def __init__(self, env, num_envs, random=None, render_kwargs=None):
+        """Initializes a new `BatchEnvironment`.
+        Args:
+          env: A `ContextualEnvironment` whose physics and task are replicated.
+            It is used as the first member of the batch.
+          num_envs: Number of environments in the batch.
+          random: Optional, either a `numpy.random.RandomState` instance, an
+            integer seed or None, used to seed the tasks of the other members.
+          render_kwargs: Optional `dict` of keyword arguments of a
+            `rendering.BatchRenderer` rendering the members, e.g. `height`,
+            `width`, `camera_id` and `threaded`.
+        """
+        if num_envs < 1:
+            raise ValueError('A batch needs at least one environment, got {}.'.format(num_envs))
+        if not isinstance(random, np.random.RandomState):
+            random = np.random.RandomState(random)
+
+        self._physics = [env.physics]
+        self._tasks = [env.task]
+        for _ in range(num_envs - 1):
+            self._physics.append(env.physics.copy(share_model=True))
+            task = copy.deepcopy(env.task)
+            task._random = np.random.RandomState(random.randint(2 ** 31 - 1))
+            self._tasks.append(task)
+
+        self._env = env
+        self._num_envs = num_envs
+        self._n_sub_steps = env._n_sub_steps
+        self._step_limit = env._step_limit
+        self._step_count = np.zeros(num_envs, dtype=np.int64)
+        self._reset_next_step = np.ones(num_envs, dtype=bool)
+
+        self._step_type = np.full(num_envs, dm_env.StepType.FIRST, dtype=np.int8)
+        self._reward = np.zeros(num_envs, dtype=np.float64)
+        self._discount = np.ones(num_envs, dtype=np.float64)
+        self._observation = collections.OrderedDict(
+            (name, np.zeros((num_envs,) + spec.shape, dtype=spec.dtype))
+            for name, spec in env.observation_spec().items())
+        # Views of the rows of flat observations, per member and field.
+        self._flat_views = None
+        if env._flat_observation:
+            flat = self._observation[control.FLAT_OBSERVATION_KEY]
+            self._flat_views = [
+                tuple((name, flat[i, field.slice].reshape(field.shape))
+                      for name, field in env.observation_layout.items() if name != CONTEXT_OBSERVATION_KEY)
+                for i in range(num_envs)]
+        # All members share the context of `env`, which is written once.
+        self._context_encodings = np.tile(env.context_encoding, (num_envs, 1))
+        self._context_encodings.flags.writeable = False
+        if env._context_observation:
+            if env._flat_observation:
+                flat[:, env.observation_layout[CONTEXT_OBSERVATION_KEY].slice] = self._context_encodings
+            else:
+                self._observation[CONTEXT_OBSERVATION_KEY][:] = self._context_encodings
+
+        self._renderer = None
+        if render_kwargs is not None:
+            self._renderer = rendering.BatchRenderer(num_envs, **render_kwargs)
+
+    @property
+    def num_envs(self):
+        return self._num_envs
+
+    @property
+    def physics(self):
+        return self._physics
+
+    @property
+    def tasks(self):
+        return self._tasks
+
+    @property
+    def context_encodings(self):
+        """The context encodings of the members, stacked into an array of shape `[num_envs, E]`."""
+        return self._context_encodings
+
+    @property
+    def frames(self):
+        """The frames of the members, or `None` without `render_kwargs`."""
+        return None if self._renderer is None else self._renderer.frames
+
+    def action_spec(self):
+        """Returns the action specification of a single member."""
+        return self._env.action_spec()
+
+    def observation_spec(self):
+        """Returns the observation specification of a single member."""
+        return self._env.observation_spec()
+
+    def reset(self):
+        """Starts a new episode in every member and returns the stacked `TimeStep`."""
+        for i in range(self._num_envs):
+            self._reset(i)
+            if self._renderer is not None:
+                self._renderer.submit(i, self._physics[i])
+        if self._renderer is not None:
+            self._renderer.wait()
+        return self._time_step()
+
+    def step(self, actions, render=True):
+        """Steps every member with its row of `actions`, shaped `[num_envs, ...]`.
+
+        `render=False` leaves the frames untouched, e.g. for the steps of an
+        action repeat whose frames are never observed.
+        """
+        render = render and self._renderer is not None
+        for i in range(self._num_envs):
+            self._step(i, actions[i])
+            if render:
+                # Rendered while the next member is stepped with `threaded=True`.
+                self._renderer.submit(i, self._physics[i])
+        if render:
+            self._renderer.wait()
+        return self._time_step()
+
+    def close(self):
+        """Releases the renderer of the batch, if any."""
+        if self._renderer is not None:
+            self._renderer.close()
+
+    def _step(self, i, action):
+        if self._reset_next_step[i]:
+            self._reset(i)
+            return
+
+        physics, task = self._physics[i], self._tasks[i]
+        self._step_count[i] += 1
+        self._reward[i], observation, discount = _control_step(
+            physics, task, action, self._n_sub_steps, self._step_count[i], self._step_limit,
+            lambda: task.get_observation(physics))
+        self._write_observation(i, observation)
+
+        if discount is None:
+            self._step_type[i] = dm_env.StepType.MID
+            self._discount[i] = 1.0
+        else:
+            self._step_type[i] = dm_env.StepType.LAST
+            self._discount[i] = discount
+            self._reset_next_step[i] = True
+
+    def _reset(self, i):
+        physics, task = self._physics[i], self._tasks[i]
+        self._reset_next_step[i] = False
+        self._step_count[i] = 0
+        bank = self._env._get_initial_state_bank()
+        if bank is None:
+            with physics.reset_context():
+                task.initialize_episode(physics)
+        else:
+            self._env._set_physics_state(physics, bank.draw(task.random))
+        self._write_observation(i, task.get_observation(physics))
+        self._step_type[i] = dm_env.StepType.FIRST
+        self._reward[i] = 0.0
+        self._discount[i] = 1.0
+
+    def _write_observation(self, i, observation):
+        if self._flat_views is not None:
+            for name, view in self._flat_views[i]:
+                view[...] = observation[name]
+            return
+        for name, value in observation.items():
+            self._observation[name][i] = value
+
+    def _time_step(self):
+        return dm_env.TimeStep(step_type=self._step_type, reward=self._reward,
+                               discount=self._discount, observation=self._observation)
@@ -0,0 +1,229 @@
+"""Parallel evaluation of a policy on a grid of contexts.
+
+Every job is a `(domain_name, task_name, task_kwargs)` triple evaluated for a
+number of episodes. Jobs sharing a domain, task and dynamics context are split
+into chunks of about `len(jobs) / num_workers` jobs, which run one after the
+other in the same worker, such that their model is compiled once per chunk
+while all workers are busy, and each job is seeded from its index, such that
+the returns do not depend on how the jobs are scheduled:
+
+```python
+jobs = [('cheetah', 'run', {'reward_kwargs': {'speed': {'margin': m}}, 'dynamics_kwargs': {'length': l}})
+        for m in (-10, -5, 5, 10) for l in (0.4, 0.5, 0.6)]
+results = evaluation.evaluate(policy, jobs, num_episodes=10, num_workers=8, seed=0)
+print(results.format_table())
+```
+"""
+
+import collections
+import multiprocessing
+import math
+import os
+import queue
+import traceback
+
+import numpy as np
+
+from contextual_control_suite.utils import models
+
+# Seconds between two checks that the workers are alive while waiting for an episode.
+_POLL_INTERVAL = 1.0
+
+# The return and length of one episode of job `job`, run with `seed`.
+EpisodeResult = collections.namedtuple('EpisodeResult', ['job', 'episode', 'episode_return', 'length', 'seed'])
+
+
+class EvaluationResults:
+    """The returns of every episode of every job, aggregated into a table."""
+
+    def __init__(self, jobs, num_episodes):
+        """Initializes a new `EvaluationResults`.
+        Args:
+          jobs: The sequence of `(domain_name, task_name, task_kwargs)` triples.
+          num_episodes: Number of episodes per job.
+        """
+        self._jobs = list(jobs)
+        self._returns = np.full((len(self._jobs), num_episodes), np.nan)
+        self._lengths = np.zeros((len(self._jobs), num_episodes), dtype=np.int64)
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    @property
+    def returns(self):
+        """An array of shape `[num_jobs, num_episodes]`, NaN for missing episodes."""
+        return self._returns
+
+    @property
+    def lengths(self):
+        return self._lengths
+
+    def add(self, result):
+        """Records an `EpisodeResult`."""
+        self._returns[result.job, result.episode] = result.episode_return
+        self._lengths[result.job, result.episode] = result.length
+
+    def table(self):
+        """Returns one `dict` per job with its context and return statistics."""
+        rows = []
+        for (domain_name, task_name, task_kwargs), returns in zip(self._jobs, self._returns):
+            task_kwargs = task_kwargs or {}
+            returns = returns[~np.isnan(returns)]
+            rows.append({
+                'domain': domain_name,
+                'task': task_name,
+                'reward_kwargs': task_kwargs.get('reward_kwargs'),
+                'dynamics_kwargs': task_kwargs.get('dynamics_kwargs'),
+                'episodes': len(returns),
+                'mean': float(returns.mean()) if len(returns) else float('nan'),
+                'std': float(returns.std()) if len(returns) else float('nan'),
+                'min': float(returns.min()) if len(returns) else float('nan'),
+                'max': float(returns.max()) if len(returns) else float('nan'),
+            })
+        return rows
+
+    def format_table(self):
+        """Returns the table as aligned text, one line per job."""
+        lines = ['{:<10} {:<10} {:<40} {:>8} {:>10} {:>10}'.format(
+            'domain', 'task', 'context', 'episodes', 'mean', 'std')]
+        for row in self.table():
+            context = {key: row[key] for key in ('reward_kwargs', 'dynamics_kwargs') if row[key]}
+            lines.append('{:<10} {:<10} {:<40} {:>8} {:>10.2f} {:>10.2f}'.format(
+                row['domain'], row['task'], str(context), row['episodes'], row['mean'], row['std']))
+        return '\n'.join(lines)
+
+
+def job_seed(seed, job):
+    """Returns the seed of the task of job `job`, independent of the scheduling."""
+    return int(np.random.SeedSequence([seed, job]).generate_state(1)[0])
+
+
+def evaluate_iter(policy, jobs, num_episodes, num_workers=None, seed=0, environment_kwargs=None,
+                  start_method=None):
+    """Evaluates `policy` on every job and yields each `EpisodeResult` once finished.
+
+    Args:
+      policy: A callable mapping a `TimeStep` to an action. Each worker uses
+        its own copy, which must not carry state from one episode to the next
+        for the results to be reproducible.
+      jobs: A sequence of `(domain_name, task_name, task_kwargs)` triples,
+        `task_kwargs` may be `None`.
+      num_episodes: Number of episodes per job.
+      num_workers: Optional number of worker processes, defaults to the number
+        of CPUs. 0 evaluates the jobs in this process.
+      seed: Integer from which the seed of every job is derived, unless its
+        `task_kwargs` specify `random`.
+      environment_kwargs: Optional `dict` specifying keyword arguments for all
+        environments.
+      start_method: Optional `multiprocessing` start method of the workers.
+
+    Raises:
+      RuntimeError: If a job fails or a worker dies.
+
+    Yields:
+      `EpisodeResult`s, in the order they finish.
+    """
+    jobs = [(domain_name, task_name, dict(task_kwargs or {})) for domain_name, task_name, task_kwargs in jobs]
+    for i, (_, _, task_kwargs) in enumerate(jobs):
+        task_kwargs.setdefault('random', job_seed(seed, i))
+
+    # Jobs sharing a compiled model run in the same worker.
+    groups = collections.defaultdict(list)
+    for i, (domain_name, task_name, task_kwargs) in enumerate(jobs):
+        key = models.canonical_key(domain_name, task_name, task_kwargs.get('dynamics_kwargs'))
+        groups[key].append((i,) + jobs[i])
+    groups = list(groups.values())
+
+    if num_workers == 0:
+        for group in groups:
+            yield from _run_group(policy, group, num_episodes, environment_kwargs)
+        return
+
+    # Groups are split such that a grid sharing few models still keeps every worker busy.
+    num_workers = num_workers or os.cpu_count() or 1
+    chunk_size = math.ceil(len(jobs) / num_workers)
+    chunks = [group[i:i + chunk_size] for group in groups for i in range(0, len(group), chunk_size)]
+
+    mp_context = multiprocessing.get_context(start_method)
+    results = mp_context.Queue()
+    with mp_context.Pool(min(num_workers, len(chunks)), initializer=_init_worker,
+                         initargs=(policy, num_episodes, environment_kwargs, results)) as pool:
+        pending = pool.map_async(_run_worker_chunk, chunks, chunksize=1)
+        # The process ids of the workers running a chunk.
+        running = set()
+        remaining = len(jobs) * num_episodes
+        while remaining:
+            try:
+                status, result = results.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                if pending.ready():
+                    pending.get()
+                    raise RuntimeError('The workers finished without returning every episode.')
+                if not running <= {process.pid for process in multiprocessing.active_children()}:
+                    raise RuntimeError('A worker died while running a job.')
+                continue
+            if status == 'error':
+                raise RuntimeError('A job failed:\n' + result)
+            if status == 'start':
+                running.add(result)
+            elif status == 'done':
+                running.discard(result)
+            else:
+                remaining -= 1
+                yield result
+
+
+def evaluate(policy, jobs, num_episodes, num_workers=None, seed=0, environment_kwargs=None,
+             callback=None, start_method=None):
+    """Evaluates `policy` on every job and returns the `EvaluationResults`.
+
+    See `evaluate_iter` for the arguments. `callback`, if given, is called
+    with every `EpisodeResult` as soon as it is available.
+    """
+    jobs = list(jobs)
+    results = EvaluationResults(jobs, num_episodes)
+    for result in evaluate_iter(policy, jobs, num_episodes, num_workers=num_workers, seed=seed,
+                                environment_kwargs=environment_kwargs, start_method=start_method):
+        results.add(result)
+        if callback is not None:
+            callback(result)
+    return results
+
+
+def _run_group(policy, group, num_episodes, environment_kwargs):
+    """Runs the episodes of a group of jobs sharing a compiled model."""
+    # Imported here to avoid a circular import with the suite package.
+    from contextual_control_suite import suite
+
+    for job, domain_name, task_name, task_kwargs in group:
+        env = suite.build_environment(domain_name, task_name, task_kwargs, environment_kwargs)
+        for episode in range(num_episodes):
+            time_step = env.reset()
+            episode_return = 0.0
+            length = 0
+            while not time_step.last():
+                time_step = env.step(policy(time_step))
+                episode_return += time_step.reward
+                length += 1
+            yield EpisodeResult(job, episode, episode_return, length, task_kwargs['random'])
+
+
+_WORKER_ARGS = None
+
+
+def _init_worker(policy, num_episodes, environment_kwargs, results):
+    global _WORKER_ARGS
+    _WORKER_ARGS = (policy, num_episodes, environment_kwargs, results)
+
+
+def _run_worker_chunk(chunk):
+    policy, num_episodes, environment_kwargs, results = _WORKER_ARGS
+    # The parent checks that the workers running a chunk are alive.
+    results.put(('start', os.getpid()))
+    try:
+        for result in _run_group(policy, chunk, num_episodes, environment_kwargs):
+            results.put(('ok', result))
+    except Exception:  # pylint: disable=broad-except
+        results.put(('error', traceback.format_exc()))
+    results.put(('done', os.getpid()))
@@ -0,0 +1,166 @@
+"""Banks of initial states sampled once per task and dynamics context.
+
+`initialize_episode` randomizes the initial pose of most tasks, and some of
+them settle the physics or retry collision checks until the pose is valid,
+e.g. walker, hopper and quadruped, which costs many steps per reset. An
+`InitialStateBank` stores the physics states of N episodes initialized once,
+and an environment using it resets by copying the state of an index drawn from
+the random number generator of its task:
+
+```python
+env = suite.load('quadruped', 'run', environment_kwargs={'initial_states': 1000})
+time_step = env.reset()
+```
+
+Banks are keyed by the task and dynamics context, cached in memory and, with
+`set_directory`, saved to disk such that all processes reset from the same
+states.
+"""
+
+import os
+import tempfile
+
+import mujoco
+import numpy as np
+
+import contextual_control_suite
+from contextual_control_suite.utils import models
+
+# Environment variable setting the directory of the banks in every process.
+DIRECTORY_ENV_VAR = 'CONTEXTUAL_CONTROL_SUITE_INITIAL_STATES'
+
+_BANK_CACHE = models.ModelCache()
+
+
+class InitialStateBank:
+    """A read-only array of initial physics states of a task and dynamics context."""
+
+    def __init__(self, states, key):
+        """Initializes a new `InitialStateBank`.
+        Args:
+          states: A float64 array of shape `[num_states, physics_state_size]` of
+            states returned by `ContextualEnvironment.physics_state`.
+          key: The `ContextualEnvironment.initial_state_key` of the states.
+        """
+        states = np.asarray(states, dtype=np.float64)
+        if states.ndim != 2 or not len(states):
+            raise ValueError('Expected a non-empty array of shape [num_states, size], got {}.'.format(states.shape))
+        states.flags.writeable = False
+        self._states = states
+        self._key = key
+
+    @classmethod
+    def sample(cls, env, num_states, seed=0):
+        """Samples the initial states of `num_states` episodes of an environment.
+
+        The episodes are initialized by the task with a generator seeded with
+        `seed`, which replaces its own generator during sampling, so banks
+        sampled by different processes are identical.
+
+        Args:
+          env: A `ContextualEnvironment`, whose physics state is overwritten.
+          num_states: Number of initial states.
+          seed: Seed of the episodes.
+        """
+        physics, task = env.physics, env.task
+        states = np.empty((num_states, env.physics_state_size), dtype=np.float64)
+        random = task._random
+        task._random = np.random.RandomState(seed)
+        try:
+            for state in states:
+                with physics.reset_context():
+                    task.initialize_episode(physics)
+                env.physics_state(state)
+        finally:
+            task._random = random
+        return cls(states, env.initial_state_key())
+
+    @classmethod
+    def load(cls, path):
+        """Loads a bank saved with `save`."""
+        with np.load(path) as data:
+            return cls(data['states'], str(data['key']))
+
+    def save(self, path):
+        """Saves the bank into an `.npz` file, written atomically."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, states=self._states, key=self._key)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def states(self):
+        return self._states
+
+    @property
+    def state_size(self):
+        return self._states.shape[1]
+
+    def __len__(self):
+        return len(self._states)
+
+    def draw(self, random):
+        """Returns a state of the bank, indexed by a draw of a `RandomState`."""
+        return self._states[random.randint(len(self._states))]
+
+
+def get_directory():
+    """Returns the directory where banks are saved, or `None` if disabled."""
+    directory = os.environ.get(DIRECTORY_ENV_VAR)
+    if not directory:
+        return None
+    # States depend on the versions of the tasks and of MuJoCo.
+    return os.path.join(os.path.abspath(os.path.expanduser(directory)), 'ccs-{}-mujoco-{}'.format(
+        contextual_control_suite.__version__, mujoco.__version__))
+
+
+def set_directory(directory):
+    """Sets the directory where banks are saved, `None` disables it.
+
+    The directory is exported to the environment, such that worker processes
+    started afterwards load the same banks.
+    """
+    if directory is None:
+        os.environ.pop(DIRECTORY_ENV_VAR, None)
+    else:
+        os.environ[DIRECTORY_ENV_VAR] = os.path.abspath(os.path.expanduser(directory))
+
+
+def get_bank(env, num_states, seed=0):
+    """Returns the bank of `num_states` initial states of the context of an environment.
+
+    The bank is sampled on first use, or loaded from the directory set with
+    `set_directory` if it was saved there, and cached for the process.
+
+    Raises:
+      ValueError: If the environment was not built by a `models.ModelLoader`.
+    """
+    key = env.initial_state_key()
+    if key is None:
+        raise ValueError('Initial state banks need an environment built by a model loader.')
+    bank_key = models.canonical_key(key, num_states, seed)
+
+    def sample_fn():
+        directory = get_directory()
+        if directory is None:
+            return InitialStateBank.sample(env, num_states, seed)
+        path = os.path.join(directory, bank_key + '.npz')
+        if os.path.exists(path):
+            bank = InitialStateBank.load(path)
+            if bank.key == key and bank.state_size == env.physics_state_size:
+                return bank
+        bank = InitialStateBank.sample(env, num_states, seed)
+        os.makedirs(directory, exist_ok=True)
+        bank.save(path)
+        return bank
+
+    return _BANK_CACHE.get_or_compile(bank_key, sample_fn)
@@ -0,0 +1,318 @@
+"""Caching of compiled MuJoCo models across environments sharing a context."""
+
+import collections.abc
+import copy
+import hashlib
+import json
+import numbers
+import threading
+
+import mujoco
+import numpy as np
+from dm_control.mujoco import wrapper
+
+from contextual_control_suite.utils import store
+
+_DEFAULT_CACHE_SIZE = 128
+
+# Fields of `mjStatistic` derived from the geometry of the model.
+_STAT_FIELDS = ('meaninertia', 'meanmass', 'meansize', 'extent', 'center')
+
+_ARRAY_FIELDS = None
+
+
+def _canonicalize(value):
+    """Converts a (possibly nested) context into a JSON-serializable form.
+
+    Mappings are sorted by key, sequences become lists and all real numbers are
+    converted to floats such that e.g. `1`, `1.0` and `np.float32(1)` agree.
+    """
+    if isinstance(value, collections.abc.Mapping):
+        return {str(k): _canonicalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, numbers.Real):
+        return float(value)
+    if hasattr(value, 'tolist'):
+        return _canonicalize(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(v) for v in value]
+    if value is None:
+        return None
+    raise TypeError('Cannot canonicalize a value of type {!r}.'.format(type(value)))
+
+
+def canonical_key(*parts):
+    """Returns a stable hex digest identifying the given context parts.
+
+    ```python
+    canonical_key('cheetah', 'run', {'length': 0.5})
+    ```
+    """
+    payload = json.dumps(_canonicalize(list(parts)), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ModelCache:
+    """A thread-safe LRU cache of compiled `MjModel` instances."""
+
+    def __init__(self, maxsize=_DEFAULT_CACHE_SIZE):
+        """Initializes a new `ModelCache`.
+        Args:
+          maxsize: Maximum number of compiled models to keep. A size of 0 disables
+            caching.
+        """
+        self._maxsize = maxsize
+        self._models = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def resize(self, maxsize):
+        """Changes the capacity of the cache, evicting the oldest models if needed."""
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """Removes all models and resets the statistics."""
+        with self._lock:
+            self._models.clear()
+            self._hits = self._misses = self._evictions = 0
+
+    def stats(self):
+        """Returns a `dict` with the hit, miss and eviction counts of the cache."""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'size': len(self._models),
+                'maxsize': self._maxsize,
+            }
+
+    def get_or_compile(self, key, compile_fn):
+        """Returns the model stored under `key`, compiling it on a miss.
+
+        The returned model is shared with the cache and must not be modified.
+
+        Args:
+          key: A hashable key, typically obtained from `canonical_key`.
+          compile_fn: A callable without arguments returning a `wrapper.MjModel`.
+
+        Returns:
+          A `wrapper.MjModel` instance.
+        """
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self._hits += 1
+                return model
+            self._misses += 1
+
+        # Compile outside of the lock such that other contexts are not blocked.
+        model = compile_fn()
+
+        with self._lock:
+            if self._maxsize > 0:
+                self._models[key] = model
+                self._models.move_to_end(key)
+                self._evict()
+        return model
+
+    def _evict(self):
+        while len(self._models) > max(self._maxsize, 0):
+            self._models.popitem(last=False)
+            self._evictions += 1
+
+
+# The process-wide cache used by all environments of the suite.
+MODEL_CACHE = ModelCache()
+
+# Names of the fields that differ between a dynamics context and the defaults.
+_FIELDS_CACHE = ModelCache(maxsize=4 * _DEFAULT_CACHE_SIZE)
+
+# Parsed default models of the loaders editing their models, by domain and task.
+_SPEC_CACHE = ModelCache()
+
+
+def _array_fields(model):
+    """Returns the names of all array fields of a `mujoco.MjModel`."""
+    global _ARRAY_FIELDS
+    if _ARRAY_FIELDS is None:
+        _ARRAY_FIELDS = tuple(name for name in dir(mujoco.MjModel)
+                              if not name.startswith('_')
+                              and isinstance(getattr(model, name, None), np.ndarray))
+    return _ARRAY_FIELDS
+
+
+def model_diff(model, other):
+    """Returns the names of the fields whose values differ between two models.
+
+    Fields of `mjStatistic` are reported with a `stat.` prefix.
+
+    Args:
+      model: A `wrapper.MjModel` instance.
+      other: A `wrapper.MjModel` instance.
+
+    Raises:
+      ValueError: If the models do not share the same structure, in which case
+        one cannot be turned into the other by editing its fields.
+
+    Returns:
+      A tuple of field names.
+    """
+    model, other = model.ptr, other.ptr
+    fields = []
+    for name in _array_fields(model):
+        value, other_value = getattr(model, name), getattr(other, name)
+        if value.shape != other_value.shape:
+            raise ValueError('Field {!r} differs in shape, the models have a different '
+                             'structure.'.format(name))
+        if not np.array_equal(value, other_value):
+            fields.append(name)
+    for name in _STAT_FIELDS:
+        if not np.array_equal(getattr(model.stat, name), getattr(other.stat, name)):
+            fields.append('stat.' + name)
+    return tuple(fields)
+
+
+def parse_model(xml_string, assets=None):
+    """Parses a model into a `mujoco.MjSpec` with its builtin textures shrunk.
+
+    Textures are generated by the compiler and dominate its run time, while
+    they never depend on the dynamics. The returned spec, and its default model,
+    compile in a few milliseconds into models whose other fields are identical
+    to those of the full model.
+
+    Returns:
+      A tuple of the `mujoco.MjSpec` and its compiled `wrapper.MjModel`.
+    """
+    if isinstance(xml_string, bytes):
+        xml_string = xml_string.decode('utf-8')
+    spec = mujoco.MjSpec.from_string(xml_string, assets)
+    for texture in spec.textures:
+        if texture.builtin != mujoco.mjtBuiltin.mjBUILTIN_NONE:
+            texture.width = texture.height = 1
+    return spec, wrapper.MjModel(spec.copy().compile())
+
+
+def copy_model_fields(source, target, fields):
+    """Copies the given fields of `source` into `target` in place."""
+    source, target = source.ptr, target.ptr
+    for name in fields:
+        if name.startswith('stat.'):
+            name = name[len('stat.'):]
+            setattr(target.stat, name, getattr(source.stat, name))
+        else:
+            np.copyto(getattr(target, name), getattr(source, name))
+
+
+class ModelLoader:
+    """Builds the `Physics` of a task from a cached compiled model."""
+
+    def __init__(self, domain_name, task_name, physics_class, model_fn, cache=None, edit_fn=None):
+        """Initializes a new `ModelLoader`.
+        Args:
+          domain_name: A string containing the name of the domain.
+          task_name: A string containing the name of the task.
+          physics_class: The `Physics` subclass of the domain.
+          model_fn: A callable returning a tuple with the model XML string and a
+            dict of assets. It is called without arguments for the default
+            dynamics and, unless `edit_fn` is given, with the `dynamics_kwargs`
+            otherwise.
+          cache: Optional `ModelCache`, defaults to `MODEL_CACHE`.
+          edit_fn: Optional callable applying `dynamics_kwargs` in place to a
+            `mujoco.MjSpec` of the default model, called as
+            `edit_fn(spec, dynamics_kwargs)`. The model of a context is then
+            derived from the compiled default model, see `derive`.
+        """
+        self.domain_name = domain_name
+        self.task_name = task_name
+        self.physics_class = physics_class
+        self._model_fn = model_fn
+        self._cache = MODEL_CACHE if cache is None else cache
+        self._edit_fn = edit_fn
+
+    @property
+    def derives_models(self):
+        """Whether models of non-default dynamics are derived, and hence never stored."""
+        return self._edit_fn is not None
+
+    def key(self, dynamics_kwargs=None):
+        """Returns the cache key of the model for the given dynamics."""
+        return canonical_key(self.domain_name, self.task_name, dynamics_kwargs)
+
+    def compile(self, dynamics_kwargs=None, key=None):
+        """Returns the shared compiled model for the given dynamics."""
+        def compile_fn():
+            if dynamics_kwargs is not None and self._edit_fn is not None:
+                return self.derive(dynamics_kwargs)
+            if dynamics_kwargs is None:
+                xml_string, assets = self._model_fn()
+            else:
+                xml_string, assets = self._model_fn(dynamics_kwargs)
+            model_store = store.get_model_store()
+            if model_store is not None:
+                return model_store.load_or_compile(xml_string, assets)
+            return wrapper.MjModel.from_xml_string(xml_string, assets=assets)
+        key = self.key(dynamics_kwargs) if key is None else key
+        return self._cache.get_or_compile(key, compile_fn)
+
+    def derive(self, dynamics_kwargs):
+        """Returns a new model for the given dynamics, derived from the default one.
+
+        The dynamics are applied by `edit_fn` to a cached parse of the default
+        model, compiled without its textures. The fields in which the result
+        differs from the default are then copied into a copy of the compiled
+        default model, so the XML is neither regenerated nor fully recompiled.
+        """
+        spec, default = _SPEC_CACHE.get_or_compile(self.key(), lambda: parse_model(*self._model_fn()))
+        spec = spec.copy()
+        self._edit_fn(spec, dynamics_kwargs)
+        edited = wrapper.MjModel(spec.compile())
+        model = copy.copy(self.compile())
+        copy_model_fields(edited, model, model_diff(default, edited))
+        return model
+
+    def context_fields(self, dynamics_kwargs=None, key=None):
+        """Returns the names of the model fields changed by the given dynamics."""
+        if dynamics_kwargs is None:
+            return ()
+        key = self.key(dynamics_kwargs) if key is None else key
+        return _FIELDS_CACHE.get_or_compile(
+            key, lambda: model_diff(self.compile(), self.compile(dynamics_kwargs, key)))
+
+    def apply(self, model, dynamics_kwargs, previous_fields=()):
+        """Applies a dynamics context to a compiled model in place.
+
+        The model must have been built by this loader. Only the fields changed by
+        either the new or the previous context are overwritten, such that the
+        result is identical to a model compiled for `dynamics_kwargs`.
+
+        Args:
+          model: A `wrapper.MjModel` instance to modify.
+          dynamics_kwargs: A `dict` with the new dynamics parameters.
+          previous_fields: The fields changed by the context `model` was built
+            for, as returned by `context_fields`.
+
+        Returns:
+          The names of the fields changed by `dynamics_kwargs`.
+        """
+        key = self.key(dynamics_kwargs)
+        fields = self.context_fields(dynamics_kwargs, key)
+        copy_model_fields(self.compile(dynamics_kwargs, key), model,
+                          set(fields).union(previous_fields))
+        return fields
+
+    def physics(self, dynamics_kwargs=None):
+        """Returns a new `Physics` owning a private copy of the compiled model."""
+        return self.physics_class.from_model(copy.copy(self.compile(dynamics_kwargs)))
@@ -0,0 +1,111 @@
+"""Worker pools forked from a parent holding the compiled models.
+
+A `WarmPool` imports the suite and compiles the models of a declared set of
+`(domain_name, task_name, dynamics_kwargs)` entries once, in the parent, and
+then forks its workers. The workers inherit the imported modules and the
+model cache copy-on-write, so they start immediately and building an
+environment for a declared entry skips compilation. Since compiled models
+are never written to, their memory stays shared by all workers:
+
+```python
+entries = [('walker', 'run', {'length': length}) for length in (0.2, 0.3, 0.4)]
+with pool.WarmPool(entries, num_workers=32) as workers:
+    returns = workers.map(run_episode, jobs)
+```
+"""
+
+import gc
+import multiprocessing
+
+from contextual_control_suite.utils import models
+
+
+def prewarm(entries):
+    """Compiles the models of the given entries into the model cache.
+
+    Args:
+      entries: An iterable of `(domain_name, task_name, dynamics_kwargs)`
+        triples, `dynamics_kwargs` may be `None` for the default dynamics.
+
+    The cache is grown if it cannot hold all the models.
+
+    Returns:
+      The number of distinct models of the entries.
+    """
+    # Imported here to avoid a circular import with the suite package.
+    from contextual_control_suite import suite
+
+    entries = list(entries)
+    keys = {models.canonical_key(domain_name, task_name, dynamics_kwargs)
+            for domain_name, task_name, dynamics_kwargs in entries}
+    stats = models.MODEL_CACHE.stats()
+    if stats['maxsize'] < stats['size'] + len(keys):
+        # Otherwise the first entries would be evicted by the last ones.
+        models.MODEL_CACHE.resize(stats['size'] + len(keys))
+    for domain_name, task_name, dynamics_kwargs in entries:
+        task_kwargs = {} if dynamics_kwargs is None else {'dynamics_kwargs': dynamics_kwargs}
+        suite.build_environment(domain_name, task_name, task_kwargs)
+    return len(keys)
+
+
+class WarmPool:
+    """A `multiprocessing.Pool` forked after compiling the models of its entries.
+
+    The workers must not create rendering contexts before the fork, which is
+    why only models are compiled in the parent. The pool requires the `fork`
+    start method, available on Linux and macOS.
+    """
+
+    def __init__(self, entries=(), num_workers=None, initializer=None, initargs=()):
+        """Initializes a new `WarmPool` and forks its workers.
+        Args:
+          entries: An iterable of `(domain_name, task_name, dynamics_kwargs)`
+            triples whose models are compiled before forking.
+          num_workers: Optional number of worker processes, defaults to the number
+            of CPUs.
+          initializer: Optional callable run by every worker after the fork.
+          initargs: Arguments of `initializer`.
+        """
+        self._num_models = prewarm(entries)
+        # Objects created so far are moved out of the reach of the garbage
+        # collector, whose traversals would otherwise copy their pages.
+        gc.collect()
+        gc.freeze()
+        try:
+            self._pool = multiprocessing.get_context('fork').Pool(
+                num_workers, initializer=initializer, initargs=initargs)
+        finally:
+            gc.unfreeze()
+
+    @property
+    def num_models(self):
+        """The number of compiled models inherited by the workers."""
+        return self._num_models
+
+    def apply_async(self, func, args=(), kwds=None, callback=None, error_callback=None):
+        return self._pool.apply_async(func, args, kwds or {}, callback, error_callback)
+
+    def map(self, func, iterable, chunksize=None):
+        return self._pool.map(func, iterable, chunksize)
+
+    def imap(self, func, iterable, chunksize=1):
+        return self._pool.imap(func, iterable, chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return self._pool.imap_unordered(func, iterable, chunksize)
+
+    def close(self):
+        """Prevents new tasks from being submitted and lets the workers exit."""
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        """Stops the workers immediately."""
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.terminate()
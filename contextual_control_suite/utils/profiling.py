@@ -0,0 +1,126 @@
+"""Timing of the phases of environment steps, exportable as Chrome trace events."""
+
+import bisect
+import json
+import os
+import threading
+
+import numpy as np
+
+# The phases of `control.Environment.step`, in the order they are executed.
+PHASES = ('before_step', 'physics', 'after_step', 'get_reward', 'get_observation')
+
+# Upper edges of the histogram bins in nanoseconds, four per decade from 100ns
+# to 1s. The last bin counts the durations above 1s.
+_BIN_EDGES_NS = tuple(int(edge) for edge in np.round(10 ** np.arange(2, 9.01, 0.25)))
+
+
+class StepProfiler:
+    """Counters, timing histograms and trace events of the phases of `step`.
+
+    Durations are accumulated per phase in logarithmic histograms, and the most
+    recent phases are kept as trace events in a preallocated ring buffer, which
+    can be exported in the Chrome trace event format and opened in
+    `chrome://tracing` or Perfetto.
+    """
+
+    def __init__(self, trace_capacity=65536):
+        """Initializes a new `StepProfiler`.
+        Args:
+          trace_capacity: Number of phases kept as trace events, the oldest are
+            overwritten first. 0 disables the trace.
+        """
+        self._trace_capacity = trace_capacity
+        self._trace_phase = np.zeros(trace_capacity, dtype=np.int8)
+        self._trace_start = np.zeros(trace_capacity, dtype=np.int64)
+        self._trace_duration = np.zeros(trace_capacity, dtype=np.int64)
+        self._pid = os.getpid()
+        self._tid = threading.get_ident()
+        self.reset()
+
+    def reset(self):
+        """Clears all counters, histograms and trace events."""
+        self._counts = [0] * len(PHASES)
+        self._totals = [0] * len(PHASES)
+        self._minimums = [None] * len(PHASES)
+        self._maximums = [0] * len(PHASES)
+        self._histograms = [[0] * (len(_BIN_EDGES_NS) + 1) for _ in PHASES]
+        self._num_events = 0
+
+    def record_step(self, *times):
+        """Records the phases of a step from the `len(PHASES) + 1` times delimiting them."""
+        capacity = self._trace_capacity
+        for phase in range(len(PHASES)):
+            start = times[phase]
+            duration = times[phase + 1] - start
+            self._counts[phase] += 1
+            self._totals[phase] += duration
+            if self._minimums[phase] is None or duration < self._minimums[phase]:
+                self._minimums[phase] = duration
+            if duration > self._maximums[phase]:
+                self._maximums[phase] = duration
+            self._histograms[phase][bisect.bisect_left(_BIN_EDGES_NS, duration)] += 1
+            if capacity:
+                i = self._num_events % capacity
+                self._trace_phase[i] = phase
+                self._trace_start[i] = start
+                self._trace_duration[i] = duration
+                self._num_events += 1
+
+    def stats(self):
+        """Returns a `dict` with the count and durations in seconds of every phase.
+
+        Percentiles are estimated from the histograms, as the upper edge of the
+        bin holding them.
+        """
+        stats = {}
+        for phase, name in enumerate(PHASES):
+            count = self._counts[phase]
+            histogram = self._histograms[phase]
+            stats[name] = {
+                'count': count,
+                'total_s': self._totals[phase] * 1e-9,
+                'mean_s': self._totals[phase] * 1e-9 / count if count else 0.0,
+                'min_s': (self._minimums[phase] or 0) * 1e-9,
+                'max_s': self._maximums[phase] * 1e-9,
+                'p50_s': self._percentile(histogram, 0.5),
+                'p99_s': self._percentile(histogram, 0.99),
+                'histogram': list(histogram),
+            }
+        return stats
+
+    @staticmethod
+    def histogram_edges():
+        """Returns the upper edges of the histogram bins in seconds."""
+        return [edge * 1e-9 for edge in _BIN_EDGES_NS] + [float('inf')]
+
+    def trace_events(self):
+        """Returns the recorded phases as a list of Chrome trace events."""
+        num_events = min(self._num_events, self._trace_capacity)
+        first = self._num_events - num_events
+        order = (np.arange(first, self._num_events) % self._trace_capacity) if num_events else []
+        return [{
+            'name': PHASES[self._trace_phase[i]],
+            'cat': 'step',
+            'ph': 'X',
+            'ts': int(self._trace_start[i]) / 1e3,
+            'dur': int(self._trace_duration[i]) / 1e3,
+            'pid': self._pid,
+            'tid': self._tid,
+        } for i in order]
+
+    def export_chrome_trace(self, path):
+        """Writes the recorded phases to `path` in the Chrome trace event format."""
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ns'}, f)
+
+    def _percentile(self, histogram, q):
+        count = sum(histogram)
+        if not count:
+            return 0.0
+        cumulative = 0
+        for i, n in enumerate(histogram):
+            cumulative += n
+            if cumulative >= q * count:
+                return self.histogram_edges()[i]
+        return float('inf')
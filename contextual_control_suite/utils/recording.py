@@ -0,0 +1,368 @@
+"""Streaming recording of trajectories into chunked, memory-mappable datasets.
+
+A `TrajectoryRecorder` wraps an environment and records every `TimeStep` it
+returns, together with the action, the physics state and the encoded context,
+as one row of a columnar dataset. Rows are collected in preallocated chunks
+which are written by a background thread, one `.npy` file per column, such
+that memory stays bounded however long the recording. A `TrajectoryDataset`
+memory-maps the chunks and samples transitions without loading them:
+
+```python
+with recording.TrajectoryRecorder(suite.load('cheetah', 'run'), 'data/cheetah') as env:
+    time_step = env.reset()
+    while not time_step.last():
+        time_step = env.step(policy(time_step))
+
+dataset = recording.TrajectoryDataset('data/cheetah')
+batch = dataset.sample(256, random=0)
+```
+"""
+
+import json
+import os
+import queue
+import shutil
+import threading
+
+import dm_env
+import mujoco
+import numpy as np
+
+# Physics state of the rows: time, positions, velocities, activations and
+# plugin states, which can be restored with `mujoco.mj_setState`.
+PHYSICS_STATE = mujoco.mjtState.mjSTATE_FULLPHYSICS
+
+_METADATA_FILE = 'metadata.json'
+_CHUNK_FORMAT = 'chunk-{:06d}'
+_OBSERVATION_PREFIX = 'observation.'
+_FORMAT_VERSION = 1
+
+
+class TrajectoryRecorder:
+    """An environment wrapper streaming its trajectories to disk.
+
+    Every row holds a `TimeStep` returned by `reset` or `step`: its step type,
+    reward, discount and observation fields, the action that led to it, the
+    physics state after it, the context encoding of the environment and the
+    index of its episode. Rows returned by `reset` have an action of zeros, a
+    reward of 0 and a discount of 1. Other attributes are forwarded to the
+    wrapped environment.
+
+    At most `max_pending_chunks` full chunks wait for the writer thread, after
+    which `step` blocks until one is written.
+    """
+
+    def __init__(self, env, directory, chunk_size=4096, max_pending_chunks=2):
+        """Initializes a new `TrajectoryRecorder`.
+        Args:
+          env: A `ContextualEnvironment`, e.g. returned by `suite.load`.
+          directory: Path of the dataset directory, created if needed. Chunks
+            are appended to an existing dataset with the same columns.
+          chunk_size: Number of rows per chunk.
+          max_pending_chunks: Number of full chunks buffered in memory while
+            waiting to be written.
+
+        Raises:
+          ValueError: If the directory holds a dataset with different columns.
+        """
+        self._env = env
+        self._directory = directory
+        self._chunk_size = chunk_size
+        self._columns = _columns(env)
+        os.makedirs(directory, exist_ok=True)
+        self._num_chunks = _write_metadata(directory, self._columns, env.context_schema.encoding_names)
+        self._episode = _last_episode(directory, self._num_chunks)
+
+        self._observation_names = [name[len(_OBSERVATION_PREFIX):] for name in self._columns
+                                   if name.startswith(_OBSERVATION_PREFIX)]
+        self._state_size = mujoco.mj_stateSize(env.physics.model.ptr, PHYSICS_STATE)
+        self._free = queue.Queue()
+        for _ in range(max_pending_chunks + 1):
+            self._free.put(self._new_chunk())
+        self._pending = queue.Queue(maxsize=max_pending_chunks)
+        self._error = None
+        self._chunk = self._free.get()
+        self._num_rows = 0
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def reset(self):
+        """Starts a new episode and records its first `TimeStep`."""
+        time_step = self._env.reset()
+        self._episode += 1
+        self._record(time_step, None)
+        return time_step
+
+    def step(self, action):
+        """Steps the environment and records the `TimeStep`."""
+        time_step = self._env.step(action)
+        if time_step.first():
+            # The environment was reset instead of stepped.
+            self._episode += 1
+            action = None
+        self._record(time_step, action)
+        return time_step
+
+    def flush(self):
+        """Writes the rows recorded so far and waits for all chunks to be written."""
+        self._check_writer()
+        if self._num_rows:
+            self._submit()
+        self._pending.join()
+        self._check_writer()
+
+    def close(self):
+        """Flushes the recorded rows and stops the writer thread."""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            self._pending.put(None)
+            self._writer.join()
+
+    def __getattr__(self, name):
+        return getattr(self._env, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _new_chunk(self):
+        return {name: np.zeros((self._chunk_size,) + tuple(shape), dtype=dtype)
+                for name, (dtype, shape) in self._columns.items()}
+
+    def _record(self, time_step, action):
+        if self._closed:
+            raise RuntimeError('The recorder has been closed.')
+        chunk, i = self._chunk, self._num_rows
+        chunk['step_type'][i] = time_step.step_type
+        chunk['episode'][i] = self._episode
+        if time_step.first():
+            chunk['action'][i] = 0
+            chunk['reward'][i] = 0.0
+            chunk['discount'][i] = 1.0
+        else:
+            chunk['action'][i] = action
+            chunk['reward'][i] = time_step.reward
+            chunk['discount'][i] = time_step.discount
+        for name in self._observation_names:
+            chunk[_OBSERVATION_PREFIX + name][i] = time_step.observation[name]
+        chunk['context'][i] = self._env.context_encoding
+        physics = self._env.physics
+        mujoco.mj_getState(physics.model.ptr, physics.data.ptr, chunk['physics_state'][i], PHYSICS_STATE)
+
+        self._num_rows += 1
+        if self._num_rows == self._chunk_size:
+            self._submit()
+
+    def _submit(self):
+        """Hands the current chunk to the writer and takes a free one."""
+        self._check_writer()
+        self._pending.put((self._num_chunks, self._chunk, self._num_rows))
+        self._num_chunks += 1
+        self._chunk = self._free.get()
+        self._num_rows = 0
+
+    def _check_writer(self):
+        if self._error is not None:
+            raise RuntimeError('Writing a chunk failed.') from self._error
+
+    def _write_chunks(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                return
+            index, chunk, num_rows = item
+            try:
+                if self._error is None:
+                    _write_chunk(self._directory, index, chunk, num_rows)
+            except Exception as error:  # pylint: disable=broad-except
+                self._error = error
+            finally:
+                self._free.put(chunk)
+                self._pending.task_done()
+
+
+class TrajectoryDataset:
+    """A memory-mapped dataset written by `TrajectoryRecorder`.
+
+    Columns are memory-mapped chunk by chunk, so only the sampled rows are
+    read from disk. Chunks written after the dataset was opened are picked up
+    by `refresh`.
+    """
+
+    def __init__(self, directory):
+        """Initializes a new `TrajectoryDataset`.
+        Args:
+          directory: Path of a dataset directory written by `TrajectoryRecorder`.
+        """
+        self._directory = directory
+        with open(os.path.join(directory, _METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self._columns = {name: (np.dtype(dtype), tuple(shape)) for name, (dtype, shape) in metadata['columns'].items()}
+        self._context_names = tuple(metadata['context_names'])
+        self._chunks = []
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._transitions = np.zeros(0, dtype=np.int64)
+        self.refresh()
+
+    @property
+    def columns(self):
+        """A `dict` mapping every column to its dtype and row shape."""
+        return self._columns
+
+    @property
+    def context_names(self):
+        """Names of the features of the `context` column."""
+        return self._context_names
+
+    @property
+    def num_transitions(self):
+        return len(self._transitions)
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def refresh(self):
+        """Memory-maps the chunks written since the last call."""
+        while True:
+            path = os.path.join(self._directory, _CHUNK_FORMAT.format(len(self._chunks)))
+            if not os.path.isdir(path):
+                break
+            chunk = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in self._columns}
+            self._chunks.append(chunk)
+            self._offsets = np.append(self._offsets, self._offsets[-1] + len(chunk['step_type']))
+
+        # A row starts a transition if the following row continues its episode.
+        step_type = self.column('step_type')
+        self._transitions = np.flatnonzero(step_type[1:] != dm_env.StepType.FIRST)
+
+    def column(self, name, indices=None):
+        """Returns the rows `indices` of a column, or all of its rows."""
+        if indices is None:
+            if not self._chunks:
+                dtype, shape = self._columns[name]
+                return np.zeros((0,) + shape, dtype=dtype)
+            return np.concatenate([chunk[name] for chunk in self._chunks])
+        indices = np.asarray(indices, dtype=np.int64)
+        dtype, shape = self._columns[name]
+        out = np.empty(indices.shape + shape, dtype=dtype)
+        chunk_indices = np.searchsorted(self._offsets, indices, side='right') - 1
+        for c in np.unique(chunk_indices):
+            mask = chunk_indices == c
+            out[mask] = self._chunks[c][name][indices[mask] - self._offsets[c]]
+        return out
+
+    def rows(self, indices):
+        """Returns a `dict` with the rows `indices` of every column."""
+        return {name: self.column(name, indices) for name in self._columns}
+
+    def sample(self, batch_size, random=None):
+        """Returns `batch_size` transitions sampled uniformly.
+
+        Args:
+          batch_size: Number of transitions.
+          random: Optional, either a `numpy.random.RandomState` instance, an
+            integer seed or None.
+
+        Returns:
+          A `dict` holding the `observation`, `physics_state`, `context` and
+          `episode` of the first row of each transition and the `action`,
+          `reward`, `discount`, `step_type` and `next_observation` of the row
+          following it. Observations are `dict`s of their fields.
+        """
+        if not len(self._transitions):
+            raise ValueError('The dataset holds no transitions.')
+        if not isinstance(random, np.random.RandomState):
+            random = np.random.RandomState(random)
+        indices = self._transitions[random.randint(len(self._transitions), size=batch_size)]
+        next_indices = indices + 1
+        observation_names = [name for name in self._columns if name.startswith(_OBSERVATION_PREFIX)]
+        return {
+            'observation': {name[len(_OBSERVATION_PREFIX):]: self.column(name, indices)
+                            for name in observation_names},
+            'physics_state': self.column('physics_state', indices),
+            'context': self.column('context', indices),
+            'episode': self.column('episode', indices),
+            'action': self.column('action', next_indices),
+            'reward': self.column('reward', next_indices),
+            'discount': self.column('discount', next_indices),
+            'step_type': self.column('step_type', next_indices),
+            'next_observation': {name[len(_OBSERVATION_PREFIX):]: self.column(name, next_indices)
+                                 for name in observation_names},
+        }
+
+
+def _columns(env):
+    """Returns the dtype and row shape of every column recorded from `env`."""
+    action_spec = env.action_spec()
+    columns = {
+        'step_type': ('int8', ()),
+        'episode': ('int64', ()),
+        'action': (action_spec.dtype.name, action_spec.shape),
+        'reward': ('float64', ()),
+        'discount': ('float64', ()),
+    }
+    for name, spec in env.observation_spec().items():
+        columns[_OBSERVATION_PREFIX + name] = (np.dtype(spec.dtype).name, tuple(spec.shape))
+    columns['context'] = ('float64', (len(env.context_schema.encoding_names),))
+    columns['physics_state'] = ('float64', (mujoco.mj_stateSize(env.physics.model.ptr, PHYSICS_STATE),))
+    return {name: (np.dtype(dtype), tuple(shape)) for name, (dtype, shape) in columns.items()}
+
+
+def _write_metadata(directory, columns, context_names):
+    """Writes the metadata of a new dataset, or checks that of an existing one.
+
+    Returns:
+      The number of chunks already in the dataset.
+    """
+    metadata = {
+        'version': _FORMAT_VERSION,
+        'columns': {name: [dtype.str, list(shape)] for name, (dtype, shape) in columns.items()},
+        'context_names': list(context_names),
+    }
+    path = os.path.join(directory, _METADATA_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            existing = json.load(f)
+        if existing != metadata:
+            raise ValueError('{} holds a dataset with different columns.'.format(directory))
+    else:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    num_chunks = 0
+    while os.path.isdir(os.path.join(directory, _CHUNK_FORMAT.format(num_chunks))):
+        num_chunks += 1
+    return num_chunks
+
+
+def _last_episode(directory, num_chunks):
+    """Returns the index of the last episode of the existing chunks, or -1."""
+    if not num_chunks:
+        return -1
+    episodes = np.load(os.path.join(directory, _CHUNK_FORMAT.format(num_chunks - 1), 'episode.npy'),
+                       mmap_mode='r')
+    return int(episodes[-1]) if len(episodes) else -1
+
+
+def _write_chunk(directory, index, chunk, num_rows):
+    """Writes the first `num_rows` rows of a chunk, then atomically publishes it."""
+    path = os.path.join(directory, _CHUNK_FORMAT.format(index))
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    for name, values in chunk.items():
+        np.save(os.path.join(temp_path, name + '.npy'), values[:num_rows])
+    os.replace(temp_path, path)
@@ -0,0 +1,196 @@
+"""Batched offscreen rendering of many environments into one frame stack.
+
+`physics.render` creates one OpenGL context, and uploads the textures and
+meshes of the model, for every `Physics` instance, and renders one frame per
+call. A `BatchRenderer` owns a single offscreen context, shares the uploaded
+assets between all models of the same task and renders every environment of a
+batch into the rows of a preallocated `uint8` array of shape
+`[num_envs, height, width, 3]`, which is returned without copies:
+
+```python
+renderer = rendering.BatchRenderer(env.num_envs, height=84, width=84, camera_id=0)
+frames = renderer.render(env.physics)
+```
+
+With `threaded=True` the OpenGL calls run in a rendering thread. The scene of
+an environment is captured by `submit` on the calling thread, which can then
+step the next environment while the frame is being rendered.
+"""
+
+import concurrent.futures
+import hashlib
+
+import mujoco
+import numpy as np
+from dm_control import _render
+from dm_control.mujoco import wrapper
+
+# Default size of the frames, in pixels.
+DEFAULT_HEIGHT = 84
+DEFAULT_WIDTH = 84
+
+_MAX_GEOM = 1000
+
+
+def _render_signature(model):
+    """Returns a digest of the model fields uploaded into a `MjrContext`.
+
+    Models sharing it can be rendered with the same context: the contexts of a
+    task never change its textures, materials, meshes or heightfield sizes.
+    """
+    digest = hashlib.sha1(bytes(model.names))
+    for name in ('tex_width', 'tex_height', 'tex_adr', 'mat_texid', 'mat_texuniform', 'mat_texrepeat',
+                 'mesh_vertnum', 'mesh_vertadr', 'hfield_nrow', 'hfield_ncol', 'hfield_size'):
+        digest.update(np.ascontiguousarray(getattr(model, name)).tobytes())
+    return digest.hexdigest()
+
+
+class BatchRenderer:
+    """Renders a fixed number of environments with a single offscreen context."""
+
+    def __init__(self, num_envs, height=DEFAULT_HEIGHT, width=DEFAULT_WIDTH, camera_id=0, threaded=False,
+                 frames=None):
+        """Initializes a new `BatchRenderer`.
+        Args:
+          num_envs: Number of environments rendered per call.
+          height: Height of the frames, in pixels.
+          width: Width of the frames, in pixels.
+          camera_id: Optional ID or name of the camera, -1 for the free camera.
+          threaded: Whether to run the OpenGL calls in a rendering thread.
+          frames: Optional `uint8` array of shape `[num_envs, height, width, 3]`
+            the frames are written into, e.g. a view of shared memory.
+        """
+        if frames is None:
+            frames = np.zeros((num_envs, height, width, 3), dtype=np.uint8)
+        elif frames.shape != (num_envs, height, width, 3) or frames.dtype != np.uint8:
+            raise ValueError('Expected frames of shape {} and dtype uint8, got {} and {}.'.format(
+                (num_envs, height, width, 3), frames.shape, frames.dtype))
+        self._frames = frames
+        self._height = height
+        self._width = width
+        self._camera_id = camera_id
+        self._viewport = mujoco.MjrRect(0, 0, width, height)
+        # OpenGL state, only accessed from the thread of the context. It is made
+        # current through dm_control, which tracks the current context of every
+        # thread for `physics.render`.
+        self._gl_context = None
+        self._contexts = {}
+        self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+        # Scenes are captured per environment, such that a frame can be rendered
+        # while the next environment is stepped.
+        self._scenes = [None] * num_envs
+        # The options of `physics.render`, which e.g. hide the rangefinder rays.
+        self._option = wrapper.MjvOption()
+        self._camera = mujoco.MjvCamera()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if threaded else None
+        self._pending = []
+        self._closed = False
+
+    @property
+    def frames(self):
+        """The frame stack, overwritten by every call to `render` or `submit`."""
+        return self._frames
+
+    def submit(self, i, physics):
+        """Captures the scene of `physics` and renders it into row `i` of the frames.
+
+        Without a rendering thread the frame is rendered immediately, otherwise
+        the frames are only complete after the next call to `wait`.
+        """
+        if self._closed:
+            raise RuntimeError('The renderer has been closed.')
+        model, data = physics.model.ptr, physics.data.ptr
+        scene = self._scenes[i]
+        if scene is None or scene[0] is not model:
+            scene = self._scenes[i] = (model, mujoco.MjvScene(model, maxgeom=_MAX_GEOM), _render_signature(model))
+        _, mjv_scene, signature = scene
+        self._update_camera(model)
+        mujoco.mjv_updateScene(model, data, self._option, None, self._camera,
+                               mujoco.mjtCatBit.mjCAT_ALL, mjv_scene)
+        if self._executor is None:
+            self._render(i, model, mjv_scene, signature)
+        else:
+            self._pending.append(self._executor.submit(self._render, i, model, mjv_scene, signature))
+
+    def wait(self):
+        """Waits for the submitted frames and returns the frame stack."""
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+        return self._frames
+
+    def render(self, physics):
+        """Renders a sequence of `Physics` into the frame stack and returns it."""
+        for i, member in enumerate(physics):
+            self.submit(i, member)
+        return self.wait()
+
+    def close(self):
+        """Releases the OpenGL resources of the renderer."""
+        if self._closed:
+            return
+        self.wait()
+        self._closed = True
+        if self._executor is None:
+            self._free()
+        else:
+            self._executor.submit(self._free).result()
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _update_camera(self, model):
+        camera_id = self._camera_id
+        if isinstance(camera_id, str):
+            camera_id = mujoco.mj_name2id(model, mujoco.mjtObj.mjOBJ_CAMERA, camera_id)
+            if camera_id == -1:
+                raise ValueError('The model has no camera named {!r}.'.format(self._camera_id))
+        if camera_id == -1:
+            mujoco.mjv_defaultFreeCamera(model, self._camera)
+        else:
+            self._camera.type = mujoco.mjtCamera.mjCAMERA_FIXED
+            self._camera.fixedcamid = camera_id
+
+    def _context(self, model, signature):
+        context = self._contexts.get(signature)
+        if context is None:
+            if self._width > model.vis.global_.offwidth or self._height > model.vis.global_.offheight:
+                raise ValueError('Frames of {}x{} exceed the offscreen buffer of the model, {}x{}.'.format(
+                    self._width, self._height, model.vis.global_.offwidth, model.vis.global_.offheight))
+            context = self._contexts[signature] = mujoco.MjrContext(model, mujoco.mjtFontScale.mjFONTSCALE_150)
+            mujoco.mjr_setBuffer(mujoco.mjtFramebuffer.mjFB_OFFSCREEN, context)
+        return context
+
+    def _render(self, i, model, scene, signature):
+        if self._gl_context is None:
+            if _render.Renderer is None:
+                raise RuntimeError('No OpenGL backend is available, see `MUJOCO_GL`.')
+            self._gl_context = _render.Renderer(max_width=self._width, max_height=self._height)
+        with self._gl_context.make_current() as ctx:
+            ctx.call(self._render_on_gl_thread, i, model, scene, signature)
+
+    def _render_on_gl_thread(self, i, model, scene, signature):
+        context = self._context(model, signature)
+        # Heightfields may differ between the models sharing a context, e.g. the
+        # terrain generated at every episode of quadruped Escape.
+        for hfield_id in range(model.nhfield):
+            mujoco.mjr_uploadHField(model, context, hfield_id)
+        mujoco.mjr_setBuffer(mujoco.mjtFramebuffer.mjFB_OFFSCREEN, context)
+        mujoco.mjr_render(self._viewport, scene, context)
+        mujoco.mjr_readPixels(self._buffer, None, self._viewport, context)
+        # OpenGL returns the rows bottom to top.
+        np.copyto(self._frames[i], self._buffer[::-1])
+
+    def _free(self):
+        if self._gl_context is None:
+            return
+        with self._gl_context.make_current() as ctx:
+            for context in self._contexts.values():
+                ctx.call(context.free)
+        self._contexts.clear()
+        self._gl_context.free()
+        self._gl_context = None
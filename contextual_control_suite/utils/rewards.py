@@ -1,4 +1,8 @@
 import collections.abc
+import math
+
+import numpy as np
+from dm_control.utils import rewards
 
 
 def set_reward_parameters(default_reward_parameters, reward_kwargs):
@@ -12,6 +16,7 @@ def set_reward_parameters(default_reward_parameters, reward_kwargs):
     if 'ALL' in reward_kwargs.keys():
         reward_parameters = dict()
         for k in default_reward_parameters.keys():
+            # All terms share the parameters, including the changes of `set_direction`.
             reward_parameters[k] = reward_kwargs['ALL']
     else:
         reward_parameters = update(default_reward_parameters, reward_kwargs)
@@ -26,3 +31,214 @@ def update(d, u):
         else:
             d[k] = v
     return d
+
+
+def set_direction(reward_parameters, key):
+    """Turns a negative margin of `reward_parameters[key]` into a direction.
+
+    The margin is made positive and the bounds are overwritten with
+    `[margin, inf]`, such that the reward is maximized when moving at least as
+    fast as the margin in the returned direction.
+
+    Returns:
+      -1.0 if the margin was negative, 1.0 otherwise.
+    """
+    parameters = reward_parameters[key]
+    if parameters['margin'] < 0:
+        parameters['margin'] *= -1.0
+        direction = -1.0
+    else:
+        direction = 1.0
+
+    # manually overwrite the bounds
+    parameters['bounds'] = [parameters['margin'], float('inf')]
+    return direction
+
+
+_pow = np.frompyfunc(math.pow, 2, 1)
+
+
+def _scalar_sigmoids(x, value_at_1, sigmoid):
+    """`rewards._sigmoids` of an array, as if evaluated on each element separately.
+
+    Squaring a scalar goes through `pow`, which may differ in the last bit from
+    the exact multiplication used for arrays, so the sigmoids squaring their
+    input are evaluated with `math.pow` to reproduce the scalar results.
+    """
+    if sigmoid not in ('gaussian', 'long_tail', 'quadratic', 'tanh_squared'):
+        return rewards._sigmoids(x, value_at_1, sigmoid)
+
+    # Validates `value_at_1`.
+    rewards._sigmoids(0.0, value_at_1, sigmoid)
+
+    if sigmoid == 'gaussian':
+        scale = np.sqrt(-2 * np.log(value_at_1))
+        return np.exp(-0.5 * _square(x*scale))
+
+    elif sigmoid == 'long_tail':
+        scale = np.sqrt(1/value_at_1 - 1)
+        return 1 / (_square(x*scale) + 1)
+
+    elif sigmoid == 'quadratic':
+        scale = np.sqrt(1-value_at_1)
+        scaled_x = x*scale
+        return np.where(abs(scaled_x) < 1, 1 - _square(scaled_x), 0.0)
+
+    else:
+        scale = np.arctanh(np.sqrt(1-value_at_1))
+        return 1 - _square(np.tanh(x*scale))
+
+
+def _square(x):
+    return _pow(x, 2.0).astype(np.float64)
+
+
+def batch_tolerance(x, parameters, scalar=False):
+    """Evaluates `rewards.tolerance` under many parameter settings at once.
+
+    The result is identical to calling `rewards.tolerance(x[..., k], **parameters[k])`
+    for every setting `k`.
+
+    Args:
+      x: A numpy array whose last axis has size 1 or K.
+      parameters: A sequence of K `dict`s of keyword arguments for
+        `rewards.tolerance`.
+      scalar: Whether to reproduce `rewards.tolerance` evaluated on each element
+        as a scalar, rather than on an array.
+
+    Raises:
+      ValueError: If `bounds[0] > bounds[1]` or `margin` is negative.
+
+    Returns:
+      A numpy array of shape `x.shape[:-1] + (K,)`.
+    """
+    sigmoids = _scalar_sigmoids if scalar else rewards._sigmoids
+    x = np.asarray(x, dtype=np.float64)
+    lower = np.empty(len(parameters))
+    upper = np.empty(len(parameters))
+    margin = np.empty(len(parameters))
+    groups = collections.defaultdict(list)
+    for k, params in enumerate(parameters):
+        lower[k], upper[k] = params.get('bounds', (0.0, 0.0))
+        margin[k] = params.get('margin', 0.0)
+        if margin[k] != 0:
+            groups[params.get('sigmoid', 'gaussian'),
+                   params.get('value_at_margin', rewards._DEFAULT_VALUE_AT_MARGIN)].append(k)
+    if np.any(lower > upper):
+        raise ValueError('Lower bound must be <= upper bound.')
+    if np.any(margin < 0):
+        raise ValueError('`margin` must be non-negative.')
+
+    x = np.broadcast_to(x, x.shape[:-1] + (len(parameters),))
+    in_bounds = np.logical_and(lower <= x, x <= upper)
+    value = np.where(in_bounds, 1.0, 0.0)
+    for (sigmoid, value_at_margin), columns in groups.items():
+        xk, lk, uk = x[..., columns], lower[columns], upper[columns]
+        d = np.where(xk < lk, lk - xk, xk - uk) / margin[columns]
+        value[..., columns] = np.where(in_bounds[..., columns], 1.0,
+                                       sigmoids(d, value_at_margin, sigmoid))
+    return value
+
+
+def tolerance_kernel(bounds=(0.0, 0.0), margin=0.0, sigmoid='gaussian',
+                     value_at_margin=rewards._DEFAULT_VALUE_AT_MARGIN):
+    """Returns `rewards.tolerance` specialized to the given parameters.
+
+    The parameters are validated and the scale of the sigmoid is computed once,
+    such that the returned function only evaluates `x`. Scalars are evaluated
+    with float arithmetic, calling numpy only for transcendental functions, and
+    arrays with the numpy operations of `rewards.tolerance`. In both cases the
+    result is bit-identical to `rewards.tolerance(x, bounds, margin, sigmoid,
+    value_at_margin)`.
+
+    Raises:
+      ValueError: If `bounds[0] > bounds[1]`, `margin` is negative, or
+        `value_at_margin` or `sigmoid` are invalid.
+    """
+    lower, upper = bounds
+    if lower > upper:
+        raise ValueError('Lower bound must be <= upper bound.')
+    if margin < 0:
+        raise ValueError('`margin` must be non-negative.')
+
+    if margin == 0:
+        def kernel(x):
+            if isinstance(x, np.ndarray):
+                return np.where(np.logical_and(lower <= x, x <= upper), 1.0, 0.0)
+            return 1.0 if lower <= x <= upper else 0.0
+        return kernel
+
+    array_sigmoid, scalar_sigmoid = _sigmoid_kernels(value_at_margin, sigmoid)
+
+    def kernel(x):
+        if isinstance(x, np.ndarray):
+            in_bounds = np.logical_and(lower <= x, x <= upper)
+            d = np.where(x < lower, lower - x, x - upper) / margin
+            return np.where(in_bounds, 1.0, array_sigmoid(d))
+        if lower <= x <= upper:
+            return 1.0
+        return float(scalar_sigmoid(((lower - x) if x < lower else (x - upper)) / margin))
+    return kernel
+
+
+def compile_reward_parameters(reward_parameters):
+    """Returns a `dict` mapping every reward term to its `tolerance_kernel`."""
+    return {term: tolerance_kernel(**parameters) for term, parameters in reward_parameters.items()}
+
+
+def _sigmoid_kernels(value_at_1, sigmoid):
+    """Returns the array and scalar versions of `rewards._sigmoids` with a fixed scale.
+
+    Scalars are squared with `math.pow`, as numpy does for scalars.
+    """
+    # Validates `value_at_1` and `sigmoid`.
+    rewards._sigmoids(0.0, value_at_1, sigmoid)
+
+    if sigmoid == 'gaussian':
+        scale = float(np.sqrt(-2 * np.log(value_at_1)))
+        return (lambda x: np.exp(-0.5 * (x*scale)**2),
+                lambda x: np.exp(-0.5 * math.pow(x*scale, 2.0)))
+
+    elif sigmoid == 'hyperbolic':
+        scale = float(np.arccosh(1/value_at_1))
+        return (lambda x: 1 / np.cosh(x*scale),
+                lambda x: 1 / np.cosh(x*scale))
+
+    elif sigmoid == 'long_tail':
+        scale = float(np.sqrt(1/value_at_1 - 1))
+        return (lambda x: 1 / ((x*scale)**2 + 1),
+                lambda x: 1 / (math.pow(x*scale, 2.0) + 1))
+
+    elif sigmoid == 'reciprocal':
+        scale = float(1/value_at_1 - 1)
+        return (lambda x: 1 / (abs(x)*scale + 1),
+                lambda x: 1 / (abs(x)*scale + 1))
+
+    elif sigmoid == 'cosine':
+        scale = float(np.arccos(2*value_at_1 - 1) / np.pi)
+
+        def array_cosine(x):
+            scaled_x = x*scale
+            with np.errstate(invalid='ignore'):
+                cos_pi_scaled_x = np.cos(np.pi*scaled_x)
+            return np.where(abs(scaled_x) < 1, (1 + cos_pi_scaled_x)/2, 0.0)
+
+        def scalar_cosine(x):
+            scaled_x = x*scale
+            return (1 + np.cos(np.pi*scaled_x))/2 if abs(scaled_x) < 1 else 0.0
+        return array_cosine, scalar_cosine
+
+    elif sigmoid == 'linear':
+        scale = float(1-value_at_1)
+        return (lambda x: np.where(abs(x*scale) < 1, 1 - x*scale, 0.0),
+                lambda x: 1 - x*scale if abs(x*scale) < 1 else 0.0)
+
+    elif sigmoid == 'quadratic':
+        scale = float(np.sqrt(1-value_at_1))
+        return (lambda x: np.where(abs(x*scale) < 1, 1 - (x*scale)**2, 0.0),
+                lambda x: 1 - math.pow(x*scale, 2.0) if abs(x*scale) < 1 else 0.0)
+
+    else:
+        scale = float(np.arctanh(np.sqrt(1-value_at_1)))
+        return (lambda x: 1 - np.tanh(x*scale)**2,
+                lambda x: 1 - math.pow(np.tanh(x*scale), 2.0))
@@ -0,0 +1,496 @@
+"""A local server hosting environments shared by the processes of one machine.
+
+Trainers running on the same machine connect to an `EnvironmentServer` over a
+Unix-domain socket instead of building their own copies of the environments.
+Each client opens handles on `(domain, task, task_kwargs)` contexts, which the
+server hosts in an `EnvironmentPool`, and steps any number of its handles per
+request. Requests are framed by a 5-byte header, actions and the rewards,
+discounts and step types of the results are sent as packed arrays, and the
+observations are written by the server into a shared-memory row per handle,
+which the client reads without copies:
+
+```commandline
+python -m contextual_control_suite.utils.server /tmp/ccs.sock --max-envs 256
+```
+
+```python
+with server.EnvironmentClient('/tmp/ccs.sock') as client:
+    envs, time_steps = zip(*(client.open('cheetah', 'run', {'dynamics_kwargs': {'length': l}})
+                             for l in (0.4, 0.5, 0.6)))
+    time_steps = client.step(envs, actions)
+```
+
+The server runs in a single thread: it reads the requests of every ready
+connection, executes them as one batch and queues the responses, which are sent
+as the sockets of the clients accept them. It stops reading from a connection
+with `max_pending` unprocessed requests or unsent responses, so a client sending
+faster than the server steps, or not reading its responses, is throttled by its
+socket without stalling the other clients.
+"""
+
+import argparse
+import json
+import os
+import selectors
+import socket
+import struct
+import threading
+import traceback
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import dm_env
+from dm_env import specs
+import numpy as np
+
+from contextual_control_suite.utils import env_pool
+
+# Operation codes of the requests.
+_OPEN, _RESET, _STEP, _CLOSE = range(1, 5)
+# Status codes of the responses.
+_OK, _ERROR = 0, 1
+
+# Operation or status code and length of the payload, in bytes.
+_HEADER = struct.Struct('<BI')
+_COUNT = struct.Struct('<I')
+
+# Names of the shared-memory segments created by the servers of this process.
+_CREATED_SEGMENTS = set()
+
+
+def _pack_handles(handles):
+    return _COUNT.pack(len(handles)) + np.asarray(handles, dtype=np.uint32).tobytes()
+
+
+def _unpack_handles(payload):
+    (count,) = _COUNT.unpack_from(payload)
+    handles = np.frombuffer(payload, dtype=np.uint32, count=count, offset=_COUNT.size)
+    return handles, _COUNT.size + handles.nbytes
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError('The connection was closed.')
+        view = view[received:]
+    return buffer
+
+
+class _Handle:
+    """An environment of the server, checked out for one connection."""
+
+    def __init__(self, key, env, time_step):
+        self.key = key
+        self.env = env
+        self.action_spec = env.action_spec()
+        self.action_size = int(np.prod(self.action_spec.shape, dtype=np.int64))
+        # Name, offset and shape of every observation field in the flat row.
+        self.layout = []
+        offset = 0
+        for name, value in time_step.observation.items():
+            value = np.asarray(value)
+            self.layout.append((name, offset, value.shape))
+            offset += value.size
+        self.memory = shared_memory.SharedMemory(create=True, size=max(offset, 1) * 8)
+        _CREATED_SEGMENTS.add(self.memory.name)
+        self.row = np.ndarray((offset,), dtype=np.float64, buffer=self.memory.buf)
+        self.write(time_step.observation)
+
+    def write(self, observation):
+        for (_, offset, shape), value in zip(self.layout, observation.values()):
+            size = int(np.prod(shape, dtype=np.int64))
+            self.row[offset:offset + size] = np.asarray(value).ravel()
+
+    def free(self):
+        self.row = None
+        self.memory.close()
+        self.memory.unlink()
+        _CREATED_SEGMENTS.discard(self.memory.name)
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.requests = []
+        self.output = bytearray()
+        self.handles = set()
+        # Events the socket is registered for in the selector.
+        self.events = 0
+
+
+class EnvironmentServer:
+    """Hosts environments for the clients connected to a Unix-domain socket."""
+
+    def __init__(self, path, max_envs=256, max_pending=4, pool_size=64, environment_kwargs=None):
+        """Initializes a new `EnvironmentServer` listening on `path`.
+        Args:
+          path: Path of the Unix-domain socket, replaced if it exists.
+          max_envs: Maximum number of handles open at once over all clients.
+          max_pending: Maximum number of unprocessed requests of a connection
+            before the server stops reading from it.
+          pool_size: Maximum number of idle environments kept for reuse by the
+            `EnvironmentPool` of the server.
+          environment_kwargs: Optional `dict` specifying keyword arguments for all
+            environments.
+        """
+        self._path = path
+        self._max_envs = max_envs
+        self._max_pending = max_pending
+        self._pool = env_pool.EnvironmentPool(max_size=pool_size, environment_kwargs=environment_kwargs)
+        self._handles = {}
+        self._next_handle = 0
+        self._connections = {}
+        if os.path.exists(path):
+            os.remove(path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        # Wakes up the selector on `shutdown`.
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._running = False
+
+    @property
+    def path(self):
+        return self._path
+
+    def stats(self):
+        """Returns a `dict` with the open handles, connections and pool statistics."""
+        return {'handles': len(self._handles), 'connections': len(self._connections),
+                'pool': self._pool.stats()}
+
+    def serve_forever(self):
+        """Serves the clients until `shutdown` is called."""
+        self._running = True
+        try:
+            while self._running:
+                for key, events in self._selector.select():
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    elif key.fileobj is self._wakeup_reader:
+                        self._wakeup_reader.recv(1)
+                    elif events & selectors.EVENT_WRITE:
+                        self._write(key.data)
+                    else:
+                        self._read(key.data)
+                self._process()
+        finally:
+            self._close()
+
+    def shutdown(self):
+        """Stops `serve_forever`, may be called from any thread."""
+        self._running = False
+        self._wakeup_writer.send(b'\0')
+
+    def start(self):
+        """Serves the clients in a daemon thread and returns it."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def _accept(self):
+        sock, _ = self._listener.accept()
+        sock.setblocking(False)
+        connection = _Connection(sock)
+        self._connections[sock.fileno()] = connection
+        self._update_events(connection)
+
+    def _update_events(self, connection):
+        """Registers the socket of a connection for the events it waits for."""
+        events = 0
+        if connection.output:
+            events = selectors.EVENT_WRITE
+        elif len(connection.requests) < self._max_pending:
+            # Further requests wait in the socket until these are processed and answered.
+            events = selectors.EVENT_READ
+        if events == connection.events:
+            return
+        if not connection.events:
+            self._selector.register(connection.sock, events, connection)
+        elif not events:
+            self._selector.unregister(connection.sock)
+        else:
+            self._selector.modify(connection.sock, events, connection)
+        connection.events = events
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(1 << 16)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b''
+        if not data:
+            self._disconnect(connection)
+            return
+        connection.buffer += data
+        while len(connection.buffer) >= _HEADER.size:
+            opcode, length = _HEADER.unpack_from(connection.buffer)
+            if len(connection.buffer) < _HEADER.size + length:
+                break
+            connection.requests.append((opcode, bytes(connection.buffer[_HEADER.size:_HEADER.size + length])))
+            del connection.buffer[:_HEADER.size + length]
+        self._update_events(connection)
+
+    def _write(self, connection):
+        """Sends as much of the queued responses of a connection as its socket accepts."""
+        try:
+            sent = connection.sock.send(connection.output)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._disconnect(connection)
+            return
+        del connection.output[:sent]
+        self._update_events(connection)
+
+    def _process(self):
+        """Executes the pending requests of every connection and queues the responses."""
+        for connection in list(self._connections.values()):
+            if not connection.requests:
+                continue
+            for opcode, payload in connection.requests:
+                try:
+                    status, body = _OK, self._execute(connection, opcode, payload)
+                except Exception:  # pylint: disable=broad-except
+                    status, body = _ERROR, traceback.format_exc().encode('utf-8')
+                connection.output += _HEADER.pack(status, len(body)) + body
+            connection.requests = []
+            self._write(connection)
+
+    def _execute(self, connection, opcode, payload):
+        if opcode == _OPEN:
+            return self._open(connection, json.loads(payload.decode('utf-8')))
+        handles, offset = _unpack_handles(payload)
+        for handle in handles:
+            if int(handle) not in connection.handles:
+                raise ValueError('Handle {} is not open on this connection.'.format(handle))
+        if opcode == _CLOSE:
+            for handle in handles:
+                self._release(connection, int(handle))
+            return b''
+        results = []
+        if opcode == _RESET:
+            for handle in handles:
+                handle = self._handles[int(handle)]
+                results.append(handle.env.reset())
+                handle.write(results[-1].observation)
+        elif opcode == _STEP:
+            # Validated before any environment steps, such that a bad request leaves all of them unchanged.
+            handles = [self._handles[int(handle)] for handle in handles]
+            bounds = np.cumsum([0] + [handle.action_size for handle in handles])
+            if len(payload) - offset != bounds[-1] * 8:
+                raise ValueError('Expected {} action values, got {} bytes.'.format(
+                    bounds[-1], len(payload) - offset))
+            actions = np.frombuffer(payload, dtype=np.float64, offset=offset)
+            for handle, start, stop in zip(handles, bounds[:-1], bounds[1:]):
+                results.append(handle.env.step(actions[start:stop].reshape(handle.action_spec.shape)))
+                handle.write(results[-1].observation)
+        else:
+            raise ValueError('Unknown operation {}.'.format(opcode))
+        return (np.array([r.reward or 0.0 for r in results], dtype=np.float64).tobytes() +
+                np.array([1.0 if r.discount is None else r.discount for r in results], dtype=np.float64).tobytes() +
+                np.array([r.step_type for r in results], dtype=np.uint8).tobytes())
+
+    def _open(self, connection, request):
+        if len(self._handles) >= self._max_envs:
+            raise RuntimeError('The server hosts its maximum of {} environments.'.format(self._max_envs))
+        domain_name, task_name, task_kwargs = request['domain'], request['task'], request['task_kwargs']
+        env, time_step = self._pool.checkout(domain_name, task_name, task_kwargs)
+        handle = _Handle(self._pool.key(domain_name, task_name, task_kwargs), env, time_step)
+        handle_id = self._next_handle
+        self._next_handle += 1
+        self._handles[handle_id] = handle
+        connection.handles.add(handle_id)
+        spec = handle.action_spec
+        return json.dumps({
+            'handle': handle_id,
+            'memory': handle.memory.name,
+            'layout': [[name, offset, list(shape)] for name, offset, shape in handle.layout],
+            'action_shape': list(spec.shape),
+            'action_minimum': np.broadcast_to(spec.minimum, spec.shape).tolist(),
+            'action_maximum': np.broadcast_to(spec.maximum, spec.shape).tolist(),
+            'step_type': int(time_step.step_type),
+        }).encode('utf-8')
+
+    def _release(self, connection, handle_id):
+        handle = self._handles.pop(handle_id)
+        connection.handles.discard(handle_id)
+        handle.free()
+        self._pool.release(handle.env)
+
+    def _disconnect(self, connection):
+        for handle_id in list(connection.handles):
+            self._release(connection, handle_id)
+        if connection.events:
+            self._selector.unregister(connection.sock)
+            connection.events = 0
+        del self._connections[connection.sock.fileno()]
+        connection.sock.close()
+
+    def _close(self):
+        for connection in list(self._connections.values()):
+            self._disconnect(connection)
+        self._pool.clear()
+        self._selector.close()
+        self._listener.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class RemoteEnvironment:
+    """A handle on an environment hosted by an `EnvironmentServer`.
+
+    The observations of its time steps are views of shared memory, overwritten
+    by the following call to `reset` or `step`.
+    """
+
+    def __init__(self, client, response):
+        self._client = client
+        self.handle = response['handle']
+        try:
+            self._memory = shared_memory.SharedMemory(name=response['memory'], track=False)
+        except TypeError:
+            # Before Python 3.13, attached segments are unlinked by the tracker at exit. Segments
+            # of a server in this process are shared with its tracker registration, unlinked by it.
+            self._memory = shared_memory.SharedMemory(name=response['memory'])
+            if response['memory'] not in _CREATED_SEGMENTS:
+                resource_tracker.unregister(self._memory._name, 'shared_memory')  # pylint: disable=protected-access
+        size = sum(int(np.prod(shape, dtype=np.int64)) for _, _, shape in response['layout'])
+        self._row = np.ndarray((size,), dtype=np.float64, buffer=self._memory.buf)
+        self.observation = {name: self._row[offset:offset + int(np.prod(shape, dtype=np.int64))].reshape(shape)
+                            for name, offset, shape in response['layout']}
+        self._action_spec = specs.BoundedArray(
+            shape=tuple(response['action_shape']), dtype=np.float64,
+            minimum=response['action_minimum'], maximum=response['action_maximum'], name='action')
+        self.action_size = int(np.prod(self._action_spec.shape, dtype=np.int64))
+
+    def action_spec(self):
+        return self._action_spec
+
+    def observation_spec(self):
+        return {name: specs.Array(value.shape, np.float64, name) for name, value in self.observation.items()}
+
+    def reset(self):
+        return self._client.reset([self])[0]
+
+    def step(self, action):
+        return self._client.step([self], [action])[0]
+
+    def close(self):
+        self._client.close_envs([self])
+
+    def _detach(self):
+        self.observation = None
+        self._row = None
+        self._memory.close()
+
+
+class EnvironmentClient:
+    """A connection to an `EnvironmentServer`, shared by all the handles it opens."""
+
+    def __init__(self, path):
+        """Initializes a new `EnvironmentClient` connected to the socket at `path`."""
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._envs = {}
+
+    def open(self, domain_name, task_name, task_kwargs=None):
+        """Opens a handle on an environment of the given context.
+
+        Returns:
+          A tuple of the `RemoteEnvironment` and its first `TimeStep`.
+        """
+        request = json.dumps({'domain': domain_name, 'task': task_name, 'task_kwargs': task_kwargs})
+        response = json.loads(self._request(_OPEN, request.encode('utf-8')).decode('utf-8'))
+        env = RemoteEnvironment(self, response)
+        self._envs[env.handle] = env
+        time_step = dm_env.TimeStep(step_type=dm_env.StepType(response['step_type']), reward=None,
+                                    discount=None, observation=env.observation)
+        return env, time_step
+
+    def reset(self, envs):
+        """Resets the given `RemoteEnvironment`s and returns their `TimeStep`s."""
+        return self._time_steps(envs, self._request(_RESET, _pack_handles([env.handle for env in envs])))
+
+    def step(self, envs, actions):
+        """Steps the given `RemoteEnvironment`s in one request and returns their `TimeStep`s."""
+        payload = [_pack_handles([env.handle for env in envs])]
+        for env, action in zip(envs, actions):
+            action = np.asarray(action, dtype=np.float64).ravel()
+            if action.size != env.action_size:
+                raise ValueError('Expected an action of size {}, got {}.'.format(env.action_size, action.size))
+            payload.append(action.tobytes())
+        return self._time_steps(envs, self._request(_STEP, b''.join(payload)))
+
+    def close_envs(self, envs):
+        """Closes the given `RemoteEnvironment`s on the server."""
+        self._request(_CLOSE, _pack_handles([env.handle for env in envs]))
+        for env in envs:
+            self._envs.pop(env.handle)._detach()
+
+    def close(self):
+        """Closes the connection, which closes all its handles on the server."""
+        for env in self._envs.values():
+            env._detach()  # pylint: disable=protected-access
+        self._envs.clear()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _request(self, opcode, payload):
+        self._sock.sendall(_HEADER.pack(opcode, len(payload)) + payload)
+        status, length = _HEADER.unpack(_recv_exactly(self._sock, _HEADER.size))
+        response = _recv_exactly(self._sock, length)
+        if status == _ERROR:
+            raise RuntimeError('The server failed:\n' + response.decode('utf-8'))
+        return response
+
+    @staticmethod
+    def _time_steps(envs, response):
+        count = len(envs)
+        rewards = np.frombuffer(response, dtype=np.float64, count=count)
+        discounts = np.frombuffer(response, dtype=np.float64, count=count, offset=8 * count)
+        step_types = np.frombuffer(response, dtype=np.uint8, count=count, offset=16 * count)
+        time_steps = []
+        for env, reward, discount, step_type in zip(envs, rewards, discounts, step_types):
+            step_type = dm_env.StepType(step_type)
+            if step_type == dm_env.StepType.FIRST:
+                reward = discount = None
+            time_steps.append(dm_env.TimeStep(step_type=step_type, reward=reward, discount=discount,
+                                              observation=env.observation))
+        return time_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves environments of the suite over a Unix-domain socket.')
+    parser.add_argument('path', type=str, help='Path of the socket.')
+    parser.add_argument('--max-envs', type=int, default=256)
+    parser.add_argument('--max-pending', type=int, default=4)
+    parser.add_argument('--pool-size', type=int, default=64)
+    args = parser.parse_args()
+
+    server = EnvironmentServer(args.path, max_envs=args.max_envs, max_pending=args.max_pending,
+                               pool_size=args.pool_size)
+    print(f'Serving environments on {server.path}.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""A persistent on-disk store of compiled MuJoCo models shared between processes.
+
+Models are saved in MuJoCo's binary format (MJB) under a content hash of their
+XML and assets, such that every process generating the same XML loads the
+binary instead of compiling it. The store can be pre-warmed for a grid of
+dynamics contexts:
+
+```commandline
+python -m contextual_control_suite.utils.store ~/.cache/ccs-models \
+    --domain walker --task run --grid '{"length": [0.2, 0.3, 0.4, 0.5]}' --workers 4
+```
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import mujoco
+from dm_control.mujoco import wrapper
+
+import contextual_control_suite
+
+# Environment variable enabling the store in every process, e.g. in workers.
+STORE_ENV_VAR = 'CONTEXTUAL_CONTROL_SUITE_MODEL_STORE'
+
+
+def _as_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else bytes(value)
+
+
+def content_key(xml_string, assets=None):
+    """Returns a hex digest identifying a model by its XML and assets."""
+    digest = hashlib.sha256(_as_bytes(xml_string))
+    for name, value in sorted((assets or {}).items()):
+        digest.update(b'\0' + _as_bytes(name) + b'\0')
+        digest.update(hashlib.sha256(_as_bytes(value)).digest())
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """A directory of compiled models in MJB format.
+
+    Binaries are kept in a subdirectory named after the versions of the package
+    and of MuJoCo, so that stale binaries are never loaded after an upgrade.
+    Files are written to a temporary file and atomically renamed, such that any
+    number of processes can populate the store concurrently without ever
+    reading a partial file. Binaries are loaded by MuJoCo straight from the
+    file, so concurrent readers share its pages through the OS page cache.
+    """
+
+    def __init__(self, directory):
+        """Initializes a new `ModelStore`.
+        Args:
+          directory: Path of the root directory of the store, created if needed.
+        """
+        self._root = os.path.abspath(os.path.expanduser(directory))
+        self._directory = os.path.join(self._root, 'ccs-{}-mujoco-{}'.format(
+            contextual_control_suite.__version__, mujoco.__version__))
+        os.makedirs(self._directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def stats(self):
+        """Returns a `dict` with the hit and miss counts of this process."""
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'directory': self._directory}
+
+    def path(self, xml_string, assets=None):
+        """Returns the path of the binary of the given model, existing or not."""
+        return os.path.join(self._directory, content_key(xml_string, assets) + '.mjb')
+
+    def load_or_compile(self, xml_string, assets=None):
+        """Returns the compiled model, loading it from the store if possible.
+
+        Args:
+          xml_string: String containing the MJCF model description.
+          assets: Optional dict of assets referenced by the model.
+
+        Returns:
+          A `wrapper.MjModel` instance.
+        """
+        path = self.path(xml_string, assets)
+        if os.path.exists(path):
+            try:
+                model = wrapper.MjModel.from_binary_path(path)
+            except Exception:  # pylint: disable=broad-except
+                # Unreadable binaries are recompiled and overwritten below.
+                pass
+            else:
+                with self._lock:
+                    self._hits += 1
+                return model
+
+        with self._lock:
+            self._misses += 1
+        model = wrapper.MjModel.from_xml_string(xml_string, assets=assets)
+        self._save(model, path)
+        return model
+
+    def _save(self, model, path):
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            model.save_binary(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+_MODEL_STORE = None
+
+
+def get_model_store():
+    """Returns the `ModelStore` used by the suite, or `None` if disabled.
+
+    Unless set with `set_model_store`, the store is located in the directory
+    given by the `CONTEXTUAL_CONTROL_SUITE_MODEL_STORE` environment variable.
+    """
+    global _MODEL_STORE
+    if _MODEL_STORE is None and os.environ.get(STORE_ENV_VAR):
+        _MODEL_STORE = ModelStore(os.environ[STORE_ENV_VAR])
+    return _MODEL_STORE
+
+
+def set_model_store(directory):
+    """Sets the directory of the model store of the suite, `None` disables it."""
+    global _MODEL_STORE
+    if directory is None:
+        _MODEL_STORE = None
+        os.environ.pop(STORE_ENV_VAR, None)
+        return
+    _MODEL_STORE = ModelStore(directory)
+    # Exported such that worker processes use the same store.
+    os.environ[STORE_ENV_VAR] = _MODEL_STORE._root
+
+
+def _prewarm(args):
+    domain_name, task_name, dynamics_kwargs = args
+    # Imported here to avoid a circular import with the suite package.
+    from contextual_control_suite import suite
+
+    suite.load(domain_name, task_name, task_kwargs={'dynamics_kwargs': dynamics_kwargs})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-warms the model store for a grid of dynamics contexts.')
+    parser.add_argument('directory', type=str, help='Root directory of the model store.')
+    parser.add_argument('--domain', type=str, required=True)
+    parser.add_argument('--task', type=str, required=True)
+    parser.add_argument('--grid', type=str, default='{}',
+                        help='JSON object mapping each dynamics parameter to a list of values, '
+                             'the store is populated with their Cartesian product.')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    # Also exported to the environment, and hence to the worker processes.
+    set_model_store(args.directory)
+    directory = get_model_store().directory
+
+    # Imported here to avoid a circular import with the suite package.
+    from contextual_control_suite import suite
+
+    # The default model is stored in any case.
+    model_loader = suite.load(args.domain, args.task).model_loader
+    if model_loader is not None and model_loader.derives_models:
+        print(f'The models of {args.domain}/{args.task} are derived from its default model without compiling them, '
+              f'only the default model is stored in {directory}.')
+        return
+    stored = len(os.listdir(directory))
+
+    grid = json.loads(args.grid)
+    names = sorted(grid)
+    jobs = [(args.domain, args.task, dict(zip(names, values)))
+            for values in itertools.product(*(grid[name] for name in names))]
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            list(pool.imap_unordered(_prewarm, jobs))
+    else:
+        list(map(_prewarm, jobs))
+    compiled = len(os.listdir(directory)) - stored
+    print(f'{len(jobs)} contexts of {args.domain}/{args.task}: {compiled} models compiled, '
+          f'{len(jobs) - compiled} already stored in {directory}.')
+
+
+if __name__ == '__main__':
+    main()
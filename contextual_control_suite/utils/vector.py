@@ -0,0 +1,321 @@
+"""Vectorized environments with heterogeneous contexts stepped in worker processes."""
+
+import multiprocessing
+import os
+import traceback
+
+import dm_env
+import numpy as np
+
+from contextual_control_suite.utils import rendering
+
+# Seconds a worker is given to exit on `close` before it is terminated.
+_JOIN_TIMEOUT = 5.0
+
+
+def _flat_size(spec):
+    return int(np.prod(spec.shape, dtype=np.int64))
+
+
+def _write_observation(buffer, observation):
+    """Writes an observation `dict` into a flat row, in the order of its keys."""
+    offset = 0
+    for value in observation.values():
+        value = np.asarray(value).ravel()
+        buffer[offset:offset + value.size] = value
+        offset += value.size
+
+
+class _SharedBuffers:
+    """Views of the shared-memory arrays exchanged with the workers."""
+
+    def __init__(self, num_envs, observation_size, action_size, frame_shape=None, arrays=None):
+        if arrays is None:
+            arrays = (
+                multiprocessing.RawArray('d', num_envs * observation_size),
+                multiprocessing.RawArray('d', num_envs * action_size),
+                multiprocessing.RawArray('d', num_envs),
+                multiprocessing.RawArray('d', num_envs),
+                multiprocessing.RawArray('b', num_envs),
+                multiprocessing.RawArray('B', num_envs * int(np.prod(frame_shape))) if frame_shape else None,
+            )
+        self.arrays = arrays
+        self.observation = np.frombuffer(arrays[0], dtype=np.float64).reshape(num_envs, observation_size)
+        self.action = np.frombuffer(arrays[1], dtype=np.float64).reshape(num_envs, action_size)
+        self.reward = np.frombuffer(arrays[2], dtype=np.float64)
+        self.discount = np.frombuffer(arrays[3], dtype=np.float64)
+        self.step_type = np.frombuffer(arrays[4], dtype=np.int8)
+        self.frames = None
+        if frame_shape:
+            self.frames = np.frombuffer(arrays[5], dtype=np.uint8).reshape((num_envs,) + tuple(frame_shape))
+
+    def shape(self):
+        frame_shape = None if self.frames is None else self.frames.shape[1:]
+        return self.observation.shape[0], self.observation.shape[1], self.action.shape[1], frame_shape
+
+
+def _worker(conn, indices, contexts, environment_kwargs, render_kwargs, shape, arrays):
+    """Builds a shard of environments and steps them on request of the parent."""
+    # Imported here such that the parent does not need the suite to unpickle.
+    from contextual_control_suite import suite
+
+    try:
+        buffers = _SharedBuffers(*shape, arrays=arrays)
+        envs = [suite.build_environment(domain_name, task_name, task_kwargs, environment_kwargs)
+                for domain_name, task_name, task_kwargs in contexts]
+        action_sizes = [_flat_size(env.action_spec()) for env in envs]
+        reset_next_step = [True] * len(envs)
+        renderer = None
+        if render_kwargs is not None:
+            # One offscreen context renders the whole shard, whose rows are contiguous.
+            renderer = rendering.BatchRenderer(len(envs), frames=buffers.frames[indices[0]:indices[-1] + 1],
+                                               **render_kwargs)
+        conn.send(('ok', None))
+    except Exception:  # pylint: disable=broad-except
+        conn.send(('error', traceback.format_exc()))
+        conn.close()
+        return
+
+    def reset(j, i):
+        time_step = envs[j].reset()
+        _write_observation(buffers.observation[i], time_step.observation)
+        buffers.reward[i] = 0.0
+        buffers.discount[i] = 1.0
+        buffers.step_type[i] = dm_env.StepType.FIRST
+        reset_next_step[j] = False
+
+    while True:
+        command, render = conn.recv()
+        if command == 'close':
+            break
+        render = renderer is not None and (render or command == 'reset')
+        try:
+            for j, i in enumerate(indices):
+                if command == 'reset' or reset_next_step[j]:
+                    reset(j, i)
+                else:
+                    time_step = envs[j].step(buffers.action[i, :action_sizes[j]])
+                    _write_observation(buffers.observation[i], time_step.observation)
+                    buffers.reward[i] = time_step.reward
+                    buffers.discount[i] = time_step.discount
+                    buffers.step_type[i] = time_step.step_type
+                    reset_next_step[j] = time_step.last()
+                if render:
+                    renderer.submit(j, envs[j].physics)
+            if render:
+                renderer.wait()
+            conn.send(('ok', None))
+        except Exception:  # pylint: disable=broad-except
+            conn.send(('error', traceback.format_exc()))
+    if renderer is not None:
+        renderer.close()
+    conn.close()
+
+
+class VectorEnvironment:
+    """Environments with different contexts, sharded over a pool of processes.
+
+    Each environment is given by a `(domain_name, task_name, task_kwargs)` triple,
+    where `task_kwargs` typically holds its `reward_kwargs` and `dynamics_kwargs`.
+    Actions, observations, rewards, discounts and step types are exchanged
+    through preallocated shared-memory arrays, so nothing but short commands is
+    pickled per step. Since the domains may differ, observations are flattened
+    in the order of their keys and padded with zeros to the largest observation,
+    and actions are read from the first `action_sizes[i]` entries of each row.
+    The numeric encodings of the contexts are computed once, in the parent, and
+    stacked in the same way into `context_encodings`.
+
+    Environments whose episode ended are reset by their worker on the following
+    call to `step`, in which case their step type is `FIRST`, their reward 0
+    and their discount 1. The returned arrays are overwritten on every call.
+
+    With `render_kwargs`, every worker renders its environments with a single
+    offscreen context into the shared `frames` array of shape
+    `[num_envs, height, width, 3]`.
+    """
+
+    def __init__(self, contexts, num_workers=None, environment_kwargs=None, seed=None,
+                 start_method=None, render_kwargs=None):
+        """Initializes a new `VectorEnvironment` and starts its workers.
+        Args:
+          contexts: A sequence of `(domain_name, task_name, task_kwargs)` triples,
+            `task_kwargs` may be `None`.
+          num_workers: Optional number of worker processes, defaults to the number
+            of CPUs. Never more than the number of environments.
+          environment_kwargs: Optional `dict` specifying keyword arguments for all
+            environments.
+          seed: Optional integer. If given, environment `i` is seeded with
+            `seed + i` unless its `task_kwargs` already specify `random`.
+          start_method: Optional `multiprocessing` start method of the workers.
+          render_kwargs: Optional `dict` of keyword arguments of the
+            `rendering.BatchRenderer` of every worker, e.g. `height`, `width`,
+            `camera_id` and `threaded`.
+        """
+        # Imported here to avoid a circular import with the suite package.
+        from contextual_control_suite import suite
+
+        contexts = [(domain_name, task_name, dict(task_kwargs or {}))
+                    for domain_name, task_name, task_kwargs in contexts]
+        if not contexts:
+            raise ValueError('At least one context is required.')
+        if seed is not None:
+            for i, (_, _, task_kwargs) in enumerate(contexts):
+                task_kwargs.setdefault('random', seed + i)
+
+        # The shapes of the observations and actions only depend on the task, so
+        # they are read from one default environment per distinct task, which
+        # also encodes the contexts of the task.
+        specs = {}
+        default_envs = {}
+        for domain_name, task_name, _ in contexts:
+            if (domain_name, task_name) not in specs:
+                env = suite.build_environment(domain_name, task_name,
+                                              environment_kwargs=environment_kwargs)
+                specs[domain_name, task_name] = (
+                    sum(_flat_size(spec) for spec in env.observation_spec().values()),
+                    _flat_size(env.action_spec()))
+                default_envs[domain_name, task_name] = env
+        self._observation_sizes = np.array([specs[d, t][0] for d, t, _ in contexts])
+        self._action_sizes = np.array([specs[d, t][1] for d, t, _ in contexts])
+
+        encodings = [default_envs[d, t].encode_context(task_kwargs.get('reward_kwargs'),
+                                                       task_kwargs.get('dynamics_kwargs'))
+                     for d, t, task_kwargs in contexts]
+        del default_envs
+        self._context_sizes = np.array([encoding.size for encoding in encodings])
+        self._context_encodings = np.zeros((len(contexts), int(self._context_sizes.max())))
+        for i, encoding in enumerate(encodings):
+            self._context_encodings[i, :encoding.size] = encoding
+        self._context_encodings.flags.writeable = False
+
+        self._num_envs = len(contexts)
+        frame_shape = None
+        if render_kwargs is not None:
+            frame_shape = (render_kwargs.get('height', rendering.DEFAULT_HEIGHT),
+                           render_kwargs.get('width', rendering.DEFAULT_WIDTH), 3)
+        self._buffers = _SharedBuffers(self._num_envs, int(self._observation_sizes.max()),
+                                       int(self._action_sizes.max()), frame_shape)
+
+        num_workers = min(num_workers or os.cpu_count() or 1, self._num_envs)
+        mp_context = multiprocessing.get_context(start_method)
+        self._connections = []
+        self._processes = []
+        for indices in np.array_split(np.arange(self._num_envs), num_workers):
+            parent_conn, child_conn = mp_context.Pipe()
+            process = mp_context.Process(
+                target=_worker,
+                args=(child_conn, indices.tolist(), [contexts[i] for i in indices],
+                      environment_kwargs, render_kwargs, self._buffers.shape(), self._buffers.arrays),
+                daemon=True)
+            process.start()
+            child_conn.close()
+            self._connections.append(parent_conn)
+            self._processes.append(process)
+        self._closed = False
+        self._receive()
+
+    @property
+    def num_envs(self):
+        return self._num_envs
+
+    @property
+    def observation_sizes(self):
+        return self._observation_sizes
+
+    @property
+    def action_sizes(self):
+        return self._action_sizes
+
+    @property
+    def context_sizes(self):
+        return self._context_sizes
+
+    @property
+    def context_encodings(self):
+        """The context encodings of the environments, stacked and padded with zeros.
+
+        Row `i` holds the encoding of environment `i` in its first
+        `context_sizes[i]` entries, see `contexts.ContextSchema.encode`.
+        """
+        return self._context_encodings
+
+    @property
+    def frames(self):
+        """The frames of the environments in shared memory, or `None` without `render_kwargs`."""
+        return self._buffers.frames
+
+    def reset(self):
+        """Starts a new episode in every environment and returns the `TimeStep`."""
+        self._send('reset')
+        return self._receive()
+
+    def step(self, actions, render=True):
+        """Steps every environment with its row of `actions`, shaped `[num_envs, A]`.
+
+        `render=False` leaves the frames untouched, e.g. for the steps of an
+        action repeat whose frames are never observed.
+        """
+        self.step_async(actions, render)
+        return self.step_wait()
+
+    def step_async(self, actions, render=True):
+        """Sends the actions to the workers without waiting for the results."""
+        actions = np.asarray(actions, dtype=np.float64)
+        self._buffers.action[:, :actions.shape[1]] = actions
+        self._send('step', render)
+
+    def step_wait(self):
+        """Waits for the workers to finish stepping and returns the `TimeStep`."""
+        return self._receive()
+
+    def close(self):
+        """Stops the workers."""
+        if self._closed:
+            return
+        self._closed = True
+        for conn in self._connections:
+            try:
+                conn.send(('close', False))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self._processes:
+            process.join(_JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, '_closed'):
+            self.close()
+
+    def _send(self, command, render=False):
+        if self._closed:
+            raise RuntimeError('The environment has been closed.')
+        for index, conn in enumerate(self._connections):
+            try:
+                conn.send((command, render))
+            except BrokenPipeError:
+                self.close()
+                raise RuntimeError('Worker {} exited unexpectedly.'.format(index)) from None
+
+    def _receive(self):
+        errors = []
+        for index, conn in enumerate(self._connections):
+            try:
+                status, message = conn.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                errors.append('Worker {} exited unexpectedly.'.format(index))
+                continue
+            if status == 'error':
+                errors.append('Worker {} failed:\n{}'.format(index, message))
+        if errors:
+            self.close()
+            raise RuntimeError(errors[0])
+        return dm_env.TimeStep(step_type=self._buffers.step_type, reward=self._buffers.reward,
+                               discount=self._buffers.discount, observation=self._buffers.observation)
@@ -0,0 +1,49 @@
+"""Tests of the asyncio interfaces of the environments."""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+
+
+def _sync_observations(actions, key, environment_kwargs=None):
+    env = suite.load('cheetah', 'run', task_kwargs={'random': 0}, environment_kwargs=environment_kwargs)
+    env.reset()
+    return [np.array(env.step(action).observation[key]) for action in actions]
+
+
+@pytest.mark.parametrize('process', [False, True])
+def test_queued_steps_match_sync_steps(process):
+    actions = np.random.RandomState(0).uniform(-1, 1, (5, 6))
+
+    async def run():
+        env = suite.load_async('cheetah', 'run', task_kwargs={'random': 0}, process=process)
+        await env.reset()
+        buffer = np.empty(6)
+        futures = []
+        for action in actions:
+            # The buffer is reused before the queued steps run.
+            buffer[...] = action
+            futures.append(env.step(buffer))
+        time_steps = await asyncio.gather(*futures)
+        await env.close()
+        return [np.array(time_step.observation['position']) for time_step in time_steps]
+
+    np.testing.assert_array_equal(asyncio.run(run()), _sync_observations(actions, 'position'))
+
+
+def test_queued_flat_observations_are_copies():
+    actions = np.random.RandomState(1).uniform(-1, 1, (5, 6))
+
+    async def run():
+        env = suite.load_async('cheetah', 'run', task_kwargs={'random': 0},
+                               environment_kwargs={'flat_observation': True, 'reuse_observation': True})
+        await env.reset()
+        time_steps = await asyncio.gather(*(env.step(action) for action in actions))
+        await env.close()
+        return [time_step.observation['observations'] for time_step in time_steps]
+
+    expected = _sync_observations(actions, 'observations', {'flat_observation': True, 'reuse_observation': True})
+    np.testing.assert_array_equal(asyncio.run(run()), expected)
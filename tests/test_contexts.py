@@ -0,0 +1,102 @@
+"""Tests of the canonical contexts of the tasks."""
+
+import pickle
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import contexts
+
+
+def test_all_terms_share_the_resolved_parameters():
+    # As in the published tasks, 'ALL' gives every term the parameters changed by `set_direction`.
+    env = suite.load('hopper', 'hop', task_kwargs={'reward_kwargs': {'ALL': {'margin': -2, 'sigmoid': 'linear'}}})
+    assert env.task.speed_direction == -1.0
+    for parameters in env.task.reward_parameters.values():
+        assert parameters['margin'] == 2.0
+        assert list(parameters['bounds']) == [2.0, float('inf')]
+
+
+@pytest.mark.parametrize('domain_name,task_name', [('hopper', 'stand'), ('walker', 'run'), ('quadruped', 'run')])
+def test_all_with_negative_margin_builds(domain_name, task_name):
+    env = suite.load(domain_name, task_name,
+                     task_kwargs={'reward_kwargs': {'ALL': {'margin': -2, 'sigmoid': 'linear'}}})
+    env.reset()
+    assert np.isfinite(env.step(np.zeros(env.action_spec().shape)).reward)
+
+
+def test_equivalent_kwargs_share_a_context():
+    context = suite.resolve_context('cheetah', 'run', {'reward_kwargs': {'speed': {'margin': -10}}})
+    other = suite.resolve_context('cheetah', 'run', {'reward_kwargs': {'ALL': {
+        'margin': -10.0, 'bounds': (10, float('inf')), 'sigmoid': 'linear', 'value_at_margin': 0.1}}})
+    assert context == other and hash(context) == hash(other) and context.digest == other.digest
+    assert context.direction == -1.0
+    assert suite.resolve_context('cheetah', 'run', {'dynamics_kwargs': {}}) == suite.resolve_context('cheetah', 'run')
+
+
+def test_explicit_dynamics_defaults_are_kept():
+    # The declared defaults are rounded, so they do not reproduce the default model.
+    default = suite.resolve_context('hopper', 'hop')
+    explicit = suite.resolve_context('hopper', 'hop', {'dynamics_kwargs': {'torso_mass': 4.515}})
+    assert default != explicit and default.digest != explicit.digest
+
+
+@pytest.mark.parametrize('domain_name,task_name', suite.ALL_TASKS)
+def test_context_round_trip(domain_name, task_name):
+    env = suite.load(domain_name, task_name)
+    context = suite.resolve_context(domain_name, task_name)
+    assert env.context == context
+    assert pickle.loads(pickle.dumps(context)) == context
+    env.set_context(**context.to_kwargs())
+    assert env.context == context
+
+
+def test_contexts_are_immutable():
+    context = suite.resolve_context('walker', 'run', {'dynamics_kwargs': {'length': 0.3}})
+    with pytest.raises(AttributeError):
+        context._dynamics = ()
+    assert context.dynamics_kwargs == {'length': 0.3}
+    assert isinstance(context, contexts.Context)
+
+
+@pytest.mark.parametrize('sample', [
+    lambda schema, ranges: contexts.uniform(schema, ranges, 64, random=0),
+    lambda schema, ranges: contexts.log_uniform(schema, ranges, 64, random=0),
+    lambda schema, ranges: contexts.sobol(schema, ranges, 64, random=0),
+], ids=['uniform', 'log_uniform', 'sobol'])
+def test_samples_stay_in_their_ranges(sample):
+    schema = suite.context_schema('cheetah', 'run')
+    ranges = {'reward.speed.margin': (-12.0, -2.0), 'dynamics.length': (0.3, 0.6)}
+    samples = sample(schema, ranges)
+    assert samples.shape == (64,) and samples.dtype == schema.dtype
+    for name, (low, high) in ranges.items():
+        assert np.all((low <= samples[name]) & (samples[name] <= high))
+    default = schema.default()
+    assert np.all(samples['reward.speed.value_at_margin'] == default['reward.speed.value_at_margin'])
+    np.testing.assert_array_equal(sample(schema, ranges), samples)
+
+
+def test_grid_and_fixed_contexts():
+    schema = suite.context_schema('walker', 'run')
+    samples = contexts.grid(schema, {'dynamics.length': [0.2, 0.3], 'reward.horizontal_velocity.margin': [1, 2, 3]})
+    assert len(samples) == 6
+    np.testing.assert_array_equal(samples['reward.horizontal_velocity.margin'], [1, 2, 3, 1, 2, 3])
+    fixed = contexts.fixed(schema, [{'dynamics.length': 0.25}, {}])
+    np.testing.assert_array_equal(fixed['dynamics.length'], [0.25, schema.parameters['dynamics.length'].default])
+    with pytest.raises(ValueError):
+        contexts.fixed(schema, [{'dynamics.length': 10.0}])
+    with pytest.raises(ValueError):
+        contexts.uniform(schema, {'dynamics.unknown': (0, 1)}, 4)
+
+
+def test_sampled_contexts_build_environments():
+    schema = suite.context_schema('cheetah', 'run')
+    sample = contexts.uniform(schema, {'reward.speed.margin': (-12.0, -2.0), 'dynamics.length': (0.3, 0.6)}, 1,
+                              random=0)[0]
+    kwargs = schema.to_kwargs(sample)
+    env = suite.load('cheetah', 'run', task_kwargs=kwargs)
+    assert env.task.speed_direction == -1.0
+    encoding = dict(zip(schema.encoding_names, env.context_encoding))
+    assert encoding['reward.speed.margin'] == sample['reward.speed.margin']
+    assert encoding['dynamics.length'] == sample['dynamics.length']
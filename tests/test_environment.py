@@ -0,0 +1,162 @@
+"""Tests of the contextual environments."""
+
+import json
+
+import dm_env
+import numpy as np
+import pytest
+from dm_control.rl import control
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils import profiling
+
+
+def _actions(env, num_steps, seed=0):
+    spec = env.action_spec()
+    return np.random.RandomState(seed).uniform(spec.minimum, spec.maximum, (num_steps,) + spec.shape)
+
+
+def _rollout(env, num_steps=20, seed=0):
+    return [env.reset()] + [env.step(action) for action in _actions(env, num_steps, seed)]
+
+
+def _assert_same_time_steps(time_steps, expected):
+    for time_step, expected_time_step in zip(time_steps, expected):
+        assert time_step.step_type == expected_time_step.step_type
+        assert time_step.reward == expected_time_step.reward
+        for name, value in expected_time_step.observation.items():
+            np.testing.assert_array_equal(time_step.observation[name], value)
+
+
+def test_flat_observations_match_dm_control():
+    time_steps = _rollout(suite.load('walker', 'run', task_kwargs={'random': 0}))
+    flat_time_steps = _rollout(suite.load('walker', 'run', task_kwargs={'random': 0},
+                                          environment_kwargs={'flat_observation': True}))
+    observations = [time_step.observation[control.FLAT_OBSERVATION_KEY] for time_step in flat_time_steps]
+    for time_step, observation in zip(time_steps, observations):
+        expected = control.flatten_observation(time_step.observation)[control.FLAT_OBSERVATION_KEY]
+        assert observation.dtype == np.float64
+        np.testing.assert_array_equal(observation, expected)
+    # Every time step holds its own array.
+    assert not np.shares_memory(observations[0], observations[1])
+
+
+def test_reused_flat_observations():
+    env = suite.load('walker', 'run', task_kwargs={'random': 0},
+                     environment_kwargs={'flat_observation': True, 'reuse_observation': True})
+    first = env.reset().observation[control.FLAT_OBSERVATION_KEY]
+    second = env.step(np.zeros(env.action_spec().shape)).observation[control.FLAT_OBSERVATION_KEY]
+    assert first is second and first.dtype == np.float32
+    assert env.observation_spec()[control.FLAT_OBSERVATION_KEY].dtype == np.float32
+    with pytest.raises(ValueError):
+        suite.load('walker', 'run', environment_kwargs={'reuse_observation': True})
+
+
+@pytest.mark.parametrize('environment_kwargs', [
+    {},
+    {'context_observation': True},
+    {'flat_observation': True},
+    {'flat_observation': True, 'reuse_observation': True, 'context_observation': True},
+])
+def test_step_n_matches_step(environment_kwargs):
+    task_kwargs = {'random': 0, 'time_limit': 0.25}
+    env = suite.load('cheetah', 'run', task_kwargs=task_kwargs, environment_kwargs=environment_kwargs)
+    batched_env = suite.load('cheetah', 'run', task_kwargs=task_kwargs, environment_kwargs=environment_kwargs)
+    actions = _actions(env, 60)
+
+    env.reset()
+    batched_env.reset()
+    offset = 0
+    # Chunks of 7 steps end the 25-step episodes in the middle of a call, after
+    # which the following call starts with a reset.
+    while offset < len(actions):
+        time_steps = batched_env.step_n(actions[offset:offset + 7])
+        for n in range(len(time_steps.step_type)):
+            time_step = env.step(actions[offset + n])
+            assert time_steps.step_type[n] == time_step.step_type
+            assert time_steps.reward[n] == (time_step.reward or 0.0)
+            assert time_steps.discount[n] == (1.0 if time_step.discount is None else time_step.discount)
+            for name, value in time_step.observation.items():
+                np.testing.assert_array_equal(time_steps.observation[name][n], value)
+        num_steps = len(time_steps.step_type)
+        assert num_steps == len(actions[offset:offset + 7]) or time_steps.step_type[-1] == dm_env.StepType.LAST
+        offset += num_steps
+
+
+@pytest.mark.parametrize('domain_name,task_name,reward_kwargs,dynamics_kwargs', [
+    ('cheetah', 'run', {'speed': {'margin': -5}}, {'length': 0.6}),
+    ('cartpole', 'swingup', {'ALL': {'sigmoid': 'linear', 'margin': 3}}, {'mass': 0.2, 'length': 1.2}),
+    ('hopper', 'hop', None, {'thigh_length': 0.4, 'torso_mass': 6.0}),
+    ('pendulum', 'swingup', None, {'length': 0.7, 'damping': 0.3}),
+    ('reacher', 'hard', None, {'hand_length': 0.08, 'gear': 0.1}),
+    ('quadruped', 'walk', None, {'damping': 10.0}),
+])
+def test_set_context_matches_fresh_build(domain_name, task_name, reward_kwargs, dynamics_kwargs):
+    task_kwargs = {'random': 0, 'reward_kwargs': reward_kwargs, 'dynamics_kwargs': dynamics_kwargs}
+    expected = _rollout(suite.load(domain_name, task_name, task_kwargs=task_kwargs))
+    env = suite.load(domain_name, task_name, task_kwargs={'random': 0})
+    env.set_context(reward_kwargs, dynamics_kwargs)
+    _assert_same_time_steps(_rollout(env), expected)
+
+    # Switching back to the default context restores the default model.
+    env.set_context({}, {})
+    default = suite.load(domain_name, task_name, task_kwargs={'random': 0})
+    assert models.model_diff(env.physics.model, default.physics.model) == ()
+
+
+@pytest.mark.parametrize('domain_name,task_name', [('walker', 'run'), ('finger', 'spin'), ('reacher', 'easy')])
+def test_restored_snapshot_continues_identically(domain_name, task_name):
+    env = suite.load(domain_name, task_name, task_kwargs={'random': 0, 'time_limit': 0.5})
+    _rollout(env, num_steps=10)
+    snapshot = env.snapshot()
+    # The continuation crosses the end of the episode, so the following episode
+    # depends on the restored random number generator and model fields.
+    expected = [env.step(action) for action in _actions(env, 80, seed=1)]
+
+    env.restore(snapshot)
+    _assert_same_time_steps([env.step(action) for action in _actions(env, 80, seed=1)], expected)
+
+    # Snapshots can be restored into another environment of the same context.
+    other = suite.load(domain_name, task_name, task_kwargs={'random': 1, 'time_limit': 0.5})
+    other.reset()
+    other.restore(snapshot)
+    _assert_same_time_steps([other.step(action) for action in _actions(other, 80, seed=1)], expected)
+
+
+def test_profiling_records_every_phase(tmp_path):
+    env = suite.load('cheetah', 'run', task_kwargs={'random': 0})
+    profiler = env.enable_profiling()
+    _rollout(env, num_steps=5)
+    stats = profiler.stats()
+    assert set(stats) == set(profiling.PHASES)
+    assert all(phase['count'] == 5 and phase['min_s'] > 0 for phase in stats.values())
+
+    path = str(tmp_path / 'trace.json')
+    profiler.export_chrome_trace(path)
+    with open(path) as f:
+        assert len(json.load(f)['traceEvents']) == 5 * len(profiling.PHASES)
+
+    env.disable_profiling()
+    env.step(np.zeros(env.action_spec().shape))
+    assert profiler.stats()['physics']['count'] == 5
+
+
+@pytest.mark.parametrize('flat_observation', [False, True])
+def test_context_observation_follows_the_context(flat_observation):
+    env = suite.load('walker', 'run', environment_kwargs={'flat_observation': flat_observation,
+                                                         'context_observation': True})
+    layout = env.observation_layout['context']
+
+    def observed_context(time_step):
+        if flat_observation:
+            return time_step.observation[control.FLAT_OBSERVATION_KEY][layout.slice]
+        return time_step.observation['context']
+
+    np.testing.assert_array_equal(observed_context(env.reset()), env.context_encoding)
+    reward_kwargs, dynamics_kwargs = {'horizontal_velocity': {'margin': -4}}, {'length': 0.25}
+    env.set_context(reward_kwargs, dynamics_kwargs)
+    expected = env.encode_context(reward_kwargs, dynamics_kwargs)
+    assert not np.array_equal(expected, env.encode_context())
+    np.testing.assert_array_equal(observed_context(env.reset()), expected)
+    np.testing.assert_array_equal(observed_context(env.step(np.zeros(env.action_spec().shape))), expected)
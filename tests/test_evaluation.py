@@ -0,0 +1,43 @@
+"""Tests of the parallel evaluation runner."""
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import evaluation
+
+
+class _Policy:
+    """A deterministic policy of the cheetah."""
+
+    def __call__(self, time_step):
+        return np.tanh(time_step.observation['velocity'][3:])
+
+
+_JOBS = [('cheetah', 'run', {'time_limit': 0.2, 'reward_kwargs': {'speed': {'margin': margin}},
+                             'dynamics_kwargs': {'length': length}})
+         for margin in (-5, 5) for length in (0.4, 0.6)]
+
+
+def test_returns_do_not_depend_on_scheduling():
+    results = evaluation.evaluate(_Policy(), _JOBS, num_episodes=2, num_workers=0, seed=3)
+    parallel = evaluation.evaluate(_Policy(), _JOBS, num_episodes=2, num_workers=2, seed=3)
+    assert not np.any(np.isnan(results.returns))
+    np.testing.assert_array_equal(parallel.returns, results.returns)
+    np.testing.assert_array_equal(results.lengths, 20)
+
+    # Every job is seeded from its index.
+    env = suite.load(*_JOBS[1][:2], task_kwargs=dict(_JOBS[1][2], random=evaluation.job_seed(3, 1)))
+    for episode in range(2):
+        time_step = env.reset()
+        episode_return = 0.0
+        while not time_step.last():
+            time_step = env.step(_Policy()(time_step))
+            episode_return += time_step.reward
+        assert results.returns[1, episode] == episode_return
+    assert [row['episodes'] for row in results.table()] == [2] * len(_JOBS)
+
+
+def test_failing_job_raises():
+    with pytest.raises(RuntimeError, match='A job failed'):
+        evaluation.evaluate(_Policy(), _JOBS[:1] + [('cheetah', 'walk', None)], num_episodes=1, num_workers=2)
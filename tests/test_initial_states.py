@@ -0,0 +1,50 @@
+"""Tests of the initial state banks."""
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import initial_states
+from contextual_control_suite.utils import models
+
+# Escape builds a rendering context to initialize its episodes.
+_TASKS = [task for task in suite.ALL_TASKS if task != ('quadruped', 'escape')]
+
+
+@pytest.mark.parametrize('domain_name,task_name', _TASKS)
+def test_bank_reset_matches_initialized_model(domain_name, task_name):
+    # The bank is cached by the first environment, the second one only restores its states.
+    for seed in (0, 1):
+        env = suite.load(domain_name, task_name, task_kwargs={'random': seed},
+                         environment_kwargs={'initial_states': 4})
+        env.reset()
+    fresh = suite.load(domain_name, task_name, task_kwargs={'random': 2})
+    fresh.reset()
+
+    state = env.initial_state_bank.states[0]
+    env.set_physics_state(state)
+    fresh.set_physics_state(state)
+    assert models.model_diff(fresh.physics.model, env.physics.model) == ()
+    np.testing.assert_array_equal(fresh.physics_state(), env.physics_state())
+
+
+def test_bank_resets_are_reproducible():
+    observations = []
+    for _ in range(2):
+        env = suite.load('walker', 'run', task_kwargs={'random': 3}, environment_kwargs={'initial_states': 8})
+        observations.append([env.reset().observation['height'] for _ in range(5)])
+    np.testing.assert_array_equal(observations[0], observations[1])
+
+
+def test_bank_is_saved_and_loaded(tmp_path):
+    initial_states.set_directory(str(tmp_path))
+    try:
+        env = suite.load('cartpole', 'swingup', environment_kwargs={'initial_states': 3})
+        bank = initial_states.get_bank(env, 3, seed=7)
+        paths = list(tmp_path.rglob('*.npz'))
+        assert len(paths) == 1
+        loaded = initial_states.InitialStateBank.load(str(paths[0]))
+    finally:
+        initial_states.set_directory(None)
+    assert loaded.key == bank.key
+    np.testing.assert_array_equal(loaded.states, bank.states)
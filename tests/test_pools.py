@@ -0,0 +1,47 @@
+"""Tests of the warm worker pool and of the pool of reusable environments."""
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import env_pool
+from contextual_control_suite.utils import pool
+
+
+def _build_and_count_misses(dynamics_kwargs):
+    misses = suite.model_cache_stats()['misses']
+    suite.load('walker', 'run', task_kwargs={'dynamics_kwargs': dynamics_kwargs})
+    return suite.model_cache_stats()['misses'] - misses
+
+
+def test_warm_workers_inherit_the_models():
+    entries = [('walker', 'run', {'length': length}) for length in (0.21, 0.27)]
+    with pool.WarmPool(entries, num_workers=2) as workers:
+        assert workers.num_models == 2
+        misses = workers.map(_build_and_count_misses, [{'length': 0.21}, {'length': 0.27}, {'length': 0.33}])
+    assert misses == [0, 0, 1]
+
+
+def test_equivalent_contexts_reuse_environments():
+    envs = env_pool.EnvironmentPool(max_size=2)
+    task_kwargs = {'reward_kwargs': {'speed': {'margin': -10}}, 'dynamics_kwargs': {'length': 0.5}}
+    with envs.borrow('cheetah', 'run', task_kwargs) as (env, _):
+        pass
+    # An equivalent context, with a seed that the reused environment takes over.
+    equivalent = {'reward_kwargs': {'speed': {'margin': np.float64(-10)}}, 'dynamics_kwargs': {'length': 0.5},
+                  'random': 4}
+    with envs.borrow('cheetah', 'run', equivalent) as (reused, time_step):
+        assert reused is env
+        expected = suite.load('cheetah', 'run', task_kwargs=equivalent).reset()
+        for name, value in expected.observation.items():
+            np.testing.assert_array_equal(time_step.observation[name], value)
+    with envs.borrow('cheetah', 'run', dict(task_kwargs, dynamics_kwargs={'length': 0.6})) as (other, _):
+        assert other is not env
+    assert envs.stats()['hits'] == 1 and envs.stats()['misses'] == 2
+
+    # The least recently released environment is evicted first.
+    with envs.borrow('cheetah', 'run'):
+        pass
+    assert envs.stats()['evictions'] == 1 and envs.stats()['idle'] == 2
+    with pytest.raises(ValueError):
+        envs.release(env)
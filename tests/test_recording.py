@@ -0,0 +1,74 @@
+"""Tests of the trajectory recorder and of the datasets it writes."""
+
+import dm_env
+import mujoco
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import recording
+
+
+def _record(directory, num_steps, seed=0):
+    """Records 20-step episodes of `num_steps` steps, returns the environment and its time steps."""
+    env = suite.load('cheetah', 'run', task_kwargs={'random': seed, 'time_limit': 0.2,
+                                                    'dynamics_kwargs': {'length': 0.55}})
+    actions = np.random.RandomState(seed).uniform(-1, 1, (num_steps,) + env.action_spec().shape)
+    with recording.TrajectoryRecorder(env, str(directory), chunk_size=8) as recorder:
+        time_steps = [recorder.reset()] + [recorder.step(action) for action in actions]
+    return env, actions, time_steps
+
+
+def test_recorded_rows_match_time_steps(tmp_path):
+    env, actions, time_steps = _record(tmp_path, 45)
+    dataset = recording.TrajectoryDataset(str(tmp_path))
+    assert len(dataset) == 46
+    # The step following the end of the first episode resets the environment.
+    assert time_steps[21].first()
+
+    np.testing.assert_array_equal(dataset.column('step_type'), [time_step.step_type for time_step in time_steps])
+    np.testing.assert_array_equal(dataset.column('reward'), [time_step.reward or 0.0 for time_step in time_steps])
+    np.testing.assert_array_equal(dataset.column('episode'), [0] * 21 + [1] * 21 + [2] * 4)
+    np.testing.assert_array_equal(dataset.column('action', [1, 21, 22]), [actions[0], np.zeros(6), actions[21]])
+    for name in time_steps[0].observation:
+        np.testing.assert_array_equal(dataset.column('observation.' + name),
+                                      [time_step.observation[name] for time_step in time_steps])
+    np.testing.assert_array_equal(dataset.column('context', [0, 45]), [env.context_encoding] * 2)
+
+    # The physics states reproduce the observations.
+    physics = env.physics
+    for index in (0, 13, 44):
+        mujoco.mj_setState(physics.model.ptr, physics.data.ptr, dataset.column('physics_state', index),
+                           recording.PHYSICS_STATE)
+        physics.forward()
+        for name, value in env.task.get_observation(physics).items():
+            np.testing.assert_array_equal(dataset.column('observation.' + name, index), value)
+
+
+def test_sampled_transitions_stay_within_episodes(tmp_path):
+    _record(tmp_path, 45)
+    dataset = recording.TrajectoryDataset(str(tmp_path))
+    # The last row of an episode starts no transition.
+    assert dataset.num_transitions == 45 - 2
+    batch = dataset.sample(64, random=0)
+    assert np.all(batch['step_type'] != dm_env.StepType.FIRST)
+    positions, velocities = dataset.column('observation.position'), dataset.column('observation.velocity')
+    for k, (position, velocity) in enumerate(zip(batch['observation']['position'], batch['observation']['velocity'])):
+        index, = np.flatnonzero(np.all(positions == position, axis=1) & np.all(velocities == velocity, axis=1))
+        assert batch['episode'][k] == dataset.column('episode', index)
+        np.testing.assert_array_equal(batch['action'][k], dataset.column('action', index + 1))
+        np.testing.assert_array_equal(batch['next_observation']['velocity'][k], velocities[index + 1])
+
+
+def test_recordings_are_appended(tmp_path):
+    _record(tmp_path, 25)
+    dataset = recording.TrajectoryDataset(str(tmp_path))
+    assert len(dataset) == 26
+    _record(tmp_path, 5, seed=1)
+    dataset.refresh()
+    assert len(dataset) == 32
+    # Episodes continue the numbering of the existing chunks.
+    np.testing.assert_array_equal(dataset.column('episode')[-6:], [2] * 6)
+
+    with pytest.raises(ValueError):
+        recording.TrajectoryRecorder(suite.load('walker', 'run'), str(tmp_path))
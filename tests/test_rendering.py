@@ -0,0 +1,37 @@
+"""Tests of the batched offscreen rendering."""
+
+import os
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+
+
+def _require_rendering():
+    # Without a display, GLFW aborts the process instead of raising.
+    if os.environ.get('MUJOCO_GL', 'glfw') == 'glfw' and not os.environ.get('DISPLAY'):
+        pytest.skip('Offscreen rendering requires a display, or MUJOCO_GL=egl or osmesa.')
+    try:
+        suite.load('cartpole', 'balance').physics.render(height=8, width=8)
+    except Exception as e:  # pylint: disable=broad-except
+        pytest.skip('Offscreen rendering is unavailable: {}'.format(e))
+
+
+@pytest.mark.parametrize('threaded', [False, True])
+def test_batch_frames_match_physics_render(threaded):
+    _require_rendering()
+    render_kwargs = {'height': 48, 'width': 64, 'camera_id': 0, 'threaded': threaded}
+    env = suite.load_batch('cheetah', 'run', 3, task_kwargs={'random': 0}, render_kwargs=render_kwargs)
+    try:
+        env.reset()
+        env.step(np.random.RandomState(0).uniform(-1, 1, (3, 6)))
+        assert env.frames.shape == (3, 48, 64, 3)
+        for i, physics in enumerate(env.physics):
+            np.testing.assert_array_equal(env.frames[i], physics.render(height=48, width=64, camera_id=0))
+        # Frames are kept without rendering.
+        frames = env.frames.copy()
+        env.step(np.zeros((3, 6)), render=False)
+        np.testing.assert_array_equal(env.frames, frames)
+    finally:
+        env.close()
@@ -0,0 +1,78 @@
+"""Tests of the reward kernels and of the relabeling of rewards."""
+
+import inspect
+
+import numpy as np
+import pytest
+from dm_control.utils import rewards
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import contexts
+from contextual_control_suite.utils import rewards as rewards_lib
+
+_PARAMETERS = [
+    {'bounds': (0.0, 0.0), 'margin': 0.0},
+    {'bounds': (-1.0, 2.0), 'margin': 0.0},
+] + [
+    {'bounds': (-0.5, 1.0), 'margin': 2.0, 'sigmoid': sigmoid, 'value_at_margin': 0.1}
+    for sigmoid in contexts.SIGMOIDS if sigmoid not in contexts._ZERO_VALUE_SIGMOIDS
+] + [
+    {'bounds': (1.0, float('inf')), 'margin': 3.0, 'sigmoid': sigmoid, 'value_at_margin': 0.0}
+    for sigmoid in contexts._ZERO_VALUE_SIGMOIDS
+]
+
+
+@pytest.mark.parametrize('parameters', _PARAMETERS, ids=lambda p: p.get('sigmoid', 'bounds'))
+def test_kernels_match_tolerance(parameters):
+    x = np.random.RandomState(0).uniform(-8, 8, 200)
+    kernel = rewards_lib.tolerance_kernel(**parameters)
+    np.testing.assert_array_equal(kernel(x), rewards.tolerance(x, **parameters))
+    for value in x:
+        assert kernel(float(value)) == rewards.tolerance(float(value), **parameters)
+    # Relabeling evaluates all parameters at once.
+    columns = rewards_lib.batch_tolerance(x[:, None], [parameters, dict(parameters, margin=1.0)], scalar=True)
+    np.testing.assert_array_equal(columns[:, 0], [rewards.tolerance(float(value), **parameters) for value in x])
+
+
+def test_kernels_validate_parameters():
+    with pytest.raises(ValueError):
+        rewards_lib.tolerance_kernel(bounds=(1.0, 0.0))
+    with pytest.raises(ValueError):
+        rewards_lib.tolerance_kernel(margin=-1.0)
+    with pytest.raises(ValueError):
+        rewards_lib.tolerance_kernel(margin=1.0, sigmoid='linear', value_at_margin=1.5)
+
+
+_REWARD_KWARGS = [
+    {},
+    {'ALL': {'sigmoid': 'linear', 'margin': 4}},
+    {'ALL': {'sigmoid': 'long_tail', 'margin': 2, 'value_at_margin': 0.3}},
+]
+
+
+@pytest.mark.parametrize('domain_name,task_name', [task for task in suite.ALL_TASKS if task != ('quadruped', 'escape')])
+def test_batch_reward_matches_get_reward(domain_name, task_name):
+    env = suite.load(domain_name, task_name, task_kwargs={'random': 0})
+    task, physics = env.task, env.physics
+    # The arguments of `batch_reward` are the physics quantities of the same name.
+    names = list(inspect.signature(task.batch_reward).parameters)[1:]
+    spec = env.action_spec()
+    actions = np.random.RandomState(0).uniform(spec.minimum, spec.maximum, (15,) + spec.shape)
+
+    env.reset()
+    quantities = {name: [] for name in names}
+    expected = []
+    for action in actions:
+        env.step(action)
+        for name in names:
+            quantities[name].append(np.copy(getattr(physics, name)()))
+        row = []
+        for reward_kwargs in _REWARD_KWARGS:
+            task.set_reward_kwargs(reward_kwargs)
+            row.append(task.get_reward(physics))
+        task.set_reward_kwargs({})
+        expected.append(row)
+
+    relabeled = task.batch_reward(_REWARD_KWARGS, **{name: np.array(values) for name, values in quantities.items()})
+    assert relabeled.shape == (len(actions), len(_REWARD_KWARGS))
+    np.testing.assert_array_equal(relabeled, expected)
@@ -0,0 +1,63 @@
+"""Tests of the environment server."""
+
+import socket
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import server as server_lib
+
+
+@pytest.fixture
+def environment_server(tmp_path):
+    environment_server = server_lib.EnvironmentServer(str(tmp_path / 'ccs.sock'), max_envs=8)
+    thread = environment_server.start()
+    yield environment_server
+    environment_server.shutdown()
+    thread.join(timeout=30)
+
+
+def test_stalled_client_does_not_block_others(environment_server):
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stalled.connect(environment_server.path)
+    # Requests on handles that are not open are answered with tracebacks, far
+    # more bytes than the socket buffers hold, which this client never reads.
+    request = server_lib._HEADER.pack(server_lib._RESET, 8) + server_lib._pack_handles([12345])
+    stalled.sendall(request * 4096)
+
+    with server_lib.EnvironmentClient(environment_server.path) as client:
+        client._sock.settimeout(30)
+        env, _ = client.open('cartpole', 'balance', {'random': 0})
+        time_step = env.step(np.zeros(env.action_spec().shape))
+        assert np.isfinite(time_step.reward)
+    stalled.close()
+
+
+def test_round_trip_matches_local_environments(environment_server):
+    contexts = [{'random': 0, 'time_limit': 0.2, 'dynamics_kwargs': {'length': length}} for length in (0.4, 0.6)]
+    local_envs = [suite.load('cheetah', 'run', task_kwargs=task_kwargs) for task_kwargs in contexts]
+    actions = np.random.RandomState(0).uniform(-1, 1, (30, 2, 6))
+
+    with server_lib.EnvironmentClient(environment_server.path) as client:
+        envs, time_steps = zip(*(client.open('cheetah', 'run', task_kwargs) for task_kwargs in contexts))
+        for time_step, env in zip(time_steps, local_envs):
+            _assert_same_time_step(time_step, env.reset())
+        assert environment_server.stats()['handles'] == 2
+        for action in actions:
+            for time_step, env, env_action in zip(client.step(envs, action), local_envs, action):
+                _assert_same_time_step(time_step, env.step(env_action))
+        with pytest.raises(ValueError, match='Expected an action of size'):
+            client.step(envs[:1], [np.zeros(5)])
+        client.close_envs(envs[1:])
+        assert environment_server.stats()['handles'] == 1
+        # Errors of the server are raised by the client.
+        with pytest.raises(RuntimeError, match='is not open on this connection'):
+            client.reset(envs[1:])
+
+
+def _assert_same_time_step(time_step, expected):
+    assert time_step.step_type == expected.step_type
+    assert time_step.reward == expected.reward
+    for name, value in expected.observation.items():
+        np.testing.assert_array_equal(time_step.observation[name], value)
@@ -0,0 +1,57 @@
+"""Tests of the on-disk store of compiled models."""
+
+import os
+import subprocess
+import sys
+
+from dm_control.mujoco import wrapper
+from dm_control.suite import cheetah
+
+from contextual_control_suite import suite
+from contextual_control_suite.suite import walker
+from contextual_control_suite.utils import models
+from contextual_control_suite.utils import store
+
+
+def test_stored_models_match_compilation(tmp_path):
+    xml_string, assets = cheetah.get_model_and_assets()
+    model_store = store.ModelStore(str(tmp_path))
+    compiled = model_store.load_or_compile(xml_string, assets)
+    assert os.path.exists(model_store.path(xml_string, assets))
+
+    # Another process finds the binary written by the first one.
+    other_store = store.ModelStore(str(tmp_path))
+    loaded = other_store.load_or_compile(xml_string, assets)
+    assert other_store.stats()['hits'] == 1 and other_store.stats()['misses'] == 0
+    assert models.model_diff(compiled, loaded) == ()
+
+    # Unreadable binaries are compiled again.
+    with open(model_store.path(xml_string, assets), 'wb') as f:
+        f.write(b'corrupted')
+    assert models.model_diff(compiled, other_store.load_or_compile(xml_string, assets)) == ()
+    assert other_store.stats()['misses'] == 1
+
+
+def test_suite_populates_the_store(tmp_path):
+    try:
+        suite.set_model_store(str(tmp_path))
+        directory = store.get_model_store().directory
+        # A context that is not in the model cache of this process yet.
+        env = suite.load('walker', 'run', task_kwargs={'dynamics_kwargs': {'length': 0.2345}})
+        assert len(os.listdir(directory)) == 1
+        assert os.environ[store.STORE_ENV_VAR] == str(tmp_path)
+    finally:
+        suite.set_model_store(None)
+    assert store.get_model_store() is None
+    xml_string, assets = walker.get_model_and_assets({'length': 0.2345})
+    expected = wrapper.MjModel.from_xml_string(xml_string, assets=assets)
+    assert models.model_diff(env.physics.model, expected) == ()
+
+
+def test_prewarm_grid(tmp_path):
+    subprocess.run([sys.executable, '-m', 'contextual_control_suite.utils.store', str(tmp_path),
+                    '--domain', 'cartpole', '--task', 'balance', '--grid', '{"length": [0.8, 1.2], "mass": [0.1]}'],
+                   check=True, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    directory, = os.listdir(str(tmp_path))
+    # The default model and the two contexts of the grid.
+    assert len(os.listdir(os.path.join(str(tmp_path), directory))) == 3
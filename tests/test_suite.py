@@ -0,0 +1,114 @@
+"""Tests of the suite against the published tasks and of its compiled-model cache."""
+
+import json
+import os
+import subprocess
+import sys
+
+import mujoco
+import numpy as np
+import pytest
+from dm_control.mujoco import wrapper
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import models
+
+# Trajectories of the published tasks, recorded before the contexts were made
+# switchable. Finger spin and quadruped escape failed to step at the time.
+with open(os.path.join(os.path.dirname(__file__), 'data', 'baseline_trajectories.json')) as f:
+    _BASELINE = json.load(f)
+
+
+def _actions(env, num_steps, seed=0):
+    spec = env.action_spec()
+    return np.random.RandomState(seed).uniform(spec.minimum, spec.maximum, (num_steps,) + spec.shape)
+
+
+@pytest.mark.parametrize('trajectory', _BASELINE,
+                         ids=lambda t: '{}-{}-{}'.format(t['domain_name'], t['task_name'], len(t['task_kwargs'])))
+def test_trajectories_match_baseline(trajectory):
+    env = suite.load(trajectory['domain_name'], trajectory['task_name'],
+                     task_kwargs=dict(trajectory['task_kwargs'], random=0))
+    env.reset()
+    time_steps = [env.step(action) for action in _actions(env, len(trajectory['rewards']))]
+    rewards = [time_step.reward for time_step in time_steps]
+    observation = np.concatenate([np.ravel(value) for value in time_steps[-1].observation.values()])
+    np.testing.assert_allclose(rewards, trajectory['rewards'], rtol=1e-7, atol=1e-10)
+    np.testing.assert_allclose(observation, trajectory['observation'], rtol=1e-7, atol=1e-10)
+
+
+def test_equivalent_dynamics_share_a_model():
+    assert models.canonical_key('cheetah', 'run', {'length': 1, 'a': [1, 2]}) == \
+        models.canonical_key('cheetah', 'run', {'a': (1.0, np.float32(2)), 'length': 1.0})
+    dynamics_kwargs = {'length': 0.55}
+    first = suite.load('cheetah', 'run', task_kwargs={'dynamics_kwargs': dynamics_kwargs})
+    hits = suite.model_cache_stats()['hits']
+    second = suite.load('cheetah', 'run', task_kwargs={'dynamics_kwargs': {'length': np.float64(0.55)}})
+    assert suite.model_cache_stats()['hits'] == hits + 1
+    assert models.model_diff(first.physics.model, second.physics.model) == ()
+    # Every environment owns a private copy of the cached model.
+    second.physics.model.body_mass[1] += 1.0
+    assert models.model_diff(first.physics.model, second.physics.model) == ('body_mass',)
+
+
+@pytest.mark.parametrize('domain_name,task_name,dynamics_kwargs', [
+    ('cheetah', 'run', {'length': 0.4}),
+    ('hopper', 'hop', {'thigh_length': 0.4, 'torso_mass': 6.0, 'damping': 0.2}),
+    ('pendulum', 'swingup', {'length': 0.7, 'mass': 2.0}),
+    ('reacher', 'easy', {'arm_length': 0.15}),
+    ('quadruped', 'run', {'torso_mass': 40.0, 'gain': 500.0}),
+])
+def test_context_models_match_compilation(domain_name, task_name, dynamics_kwargs):
+    env = suite.load(domain_name, task_name, task_kwargs={'dynamics_kwargs': dynamics_kwargs})
+    default = suite.load(domain_name, task_name).physics.model
+    loader = env._model_loader
+    if loader.derives_models:
+        # Derived models equal the default model edited and fully compiled.
+        spec = mujoco.MjSpec.from_string(*_xml_and_assets(loader))
+        loader._edit_fn(spec, dynamics_kwargs)
+        expected = wrapper.MjModel(spec.compile())
+    else:
+        xml_string, assets = loader._model_fn(dynamics_kwargs)
+        expected = wrapper.MjModel.from_xml_string(xml_string, assets=assets)
+    assert models.model_diff(env.physics.model, expected) == ()
+    assert models.model_diff(env.physics.model, default)
+
+
+def _xml_and_assets(loader):
+    xml_string, assets = loader._model_fn()
+    if isinstance(xml_string, bytes):
+        xml_string = xml_string.decode('utf-8')
+    return xml_string, assets
+
+
+def test_import_does_not_load_domains():
+    code = ('import sys; from contextual_control_suite import suite; '
+            'assert len(suite.ALL_TASKS) == 16; '
+            'assert not any(name.startswith("contextual_control_suite.suite.") for name in sys.modules); '
+            'assert "mujoco" not in sys.modules')
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+@pytest.mark.parametrize('environment_kwargs', [{}, {'flat_observation': True, 'context_observation': True}])
+def test_batch_members_match_single_environments(environment_kwargs):
+    task_kwargs = {'random': 3, 'time_limit': 0.25, 'dynamics_kwargs': {'length': 0.45}}
+    batch = suite.load_batch('cheetah', 'run', 3, task_kwargs=task_kwargs, environment_kwargs=environment_kwargs)
+    # The first member is seeded by `random`, the others by draws from it.
+    random = np.random.RandomState(3)
+    seeds = [3] + [random.randint(2 ** 31 - 1) for _ in range(2)]
+    envs = [suite.load('cheetah', 'run', task_kwargs=dict(task_kwargs, random=seed),
+                       environment_kwargs=environment_kwargs) for seed in seeds]
+    actions = _actions(envs[0], 40)
+
+    time_step = batch.reset()
+    for i, env in enumerate(envs):
+        for name, value in env.reset().observation.items():
+            np.testing.assert_array_equal(time_step.observation[name][i], value)
+    for action in actions:
+        time_step = batch.step(np.stack([action] * 3))
+        for i, env in enumerate(envs):
+            expected = env.step(action)
+            assert time_step.step_type[i] == expected.step_type
+            assert time_step.reward[i] == (expected.reward or 0.0)
+            for name, value in expected.observation.items():
+                np.testing.assert_array_equal(time_step.observation[name][i], value)
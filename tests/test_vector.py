@@ -0,0 +1,46 @@
+"""Tests of the vectorized environments."""
+
+import numpy as np
+import pytest
+
+from contextual_control_suite import suite
+from contextual_control_suite.utils import vector
+
+
+def test_dead_worker_raises():
+    env = vector.VectorEnvironment([('cartpole', 'balance', None)] * 2, num_workers=2, seed=0)
+    env.reset()
+    env._processes[1].kill()
+    env._processes[1].join()
+    with pytest.raises(RuntimeError, match='Worker 1 exited unexpectedly'):
+        env.step(np.zeros((2, 1)))
+    assert not any(process.is_alive() for process in env._processes)
+
+
+def test_vector_matches_single_environments():
+    contexts = [('cheetah', 'run', {'time_limit': 0.2, 'dynamics_kwargs': {'length': 0.4}}),
+                ('walker', 'run', {'time_limit': 0.25, 'reward_kwargs': {'horizontal_velocity': {'margin': -4}}}),
+                ('cartpole', 'balance', None)]
+    envs = [suite.load(domain_name, task_name, task_kwargs=dict(task_kwargs or {}, random=5 + i))
+            for i, (domain_name, task_name, task_kwargs) in enumerate(contexts)]
+    actions = np.random.RandomState(0).uniform(-1, 1, (25, 3, 6))
+
+    with vector.VectorEnvironment(contexts, num_workers=2, seed=5) as env:
+        np.testing.assert_array_equal(env.action_sizes, [6, 6, 1])
+        for i, single_env in enumerate(envs):
+            np.testing.assert_array_equal(env.context_encodings[i, :env.context_sizes[i]], single_env.context_encoding)
+        time_step = env.reset()
+        _assert_rows_match(time_step, [single_env.reset() for single_env in envs], env.observation_sizes)
+        for action in actions:
+            time_step = env.step(action)
+            expected = [single_env.step(action[i, :env.action_sizes[i]]) for i, single_env in enumerate(envs)]
+            _assert_rows_match(time_step, expected, env.observation_sizes)
+
+
+def _assert_rows_match(time_step, expected, observation_sizes):
+    for i, expected_time_step in enumerate(expected):
+        assert time_step.step_type[i] == expected_time_step.step_type
+        assert time_step.reward[i] == (expected_time_step.reward or 0.0)
+        observation = np.concatenate([np.ravel(value) for value in expected_time_step.observation.values()])
+        np.testing.assert_array_equal(time_step.observation[i, :observation_sizes[i]], observation)
+        assert not np.any(time_step.observation[i, observation_sizes[i]:])